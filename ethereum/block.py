@@ -174,11 +174,12 @@ class Block(rlp.Serializable):
         self.uncles = uncles or []
         self.uncles = list(self.uncles)
 
-    def __getattribute__(self, name):
-        try:
-            return rlp.Serializable.__getattribute__(self, name)
-        except AttributeError:
-            return getattr(self.header, name)
+    def __getattr__(self, name):
+        # only reached for names the block itself doesn't have, so the
+        # block's own fields are plain lookups
+        if name == 'header':
+            raise AttributeError(name)
+        return getattr(self.header, name)
 
     @property
     def transaction_count(self):
@@ -0,0 +1,105 @@
+# -*- coding: utf8 -*-
+"""
+alt_bn128 arithmetic used by the ECADD, ECMUL and ECPAIRING precompiles.
+
+A backend works on plain integer coordinates and returns None for any
+input that is not a valid point, leaving gas accounting to specials.
+py_ecc is the default; a compiled implementation can be installed with
+`set_backend` as long as it provides `add`, `multiply` and
+`pairing_check` with the same signatures.
+"""
+
+
+class PyECCBackend(object):
+
+    name = 'py_ecc'
+
+    def __init__(self):
+        import py_ecc.optimized_bn128 as bn128
+        self.bn128 = bn128
+        self.G1_zero = (bn128.FQ.one(), bn128.FQ.one(), bn128.FQ.zero())
+        self.G2_zero = (bn128.FQ2.one(), bn128.FQ2.one(), bn128.FQ2.zero())
+
+    def g1_point(self, x, y):
+        bn128 = self.bn128
+        if x >= bn128.field_modulus or y >= bn128.field_modulus:
+            return None
+        if (x, y) == (0, 0):
+            return self.G1_zero
+        p = (bn128.FQ(x), bn128.FQ(y), bn128.FQ.one())
+        if not bn128.is_on_curve(p, bn128.b):
+            return None
+        return p
+
+    def g2_point(self, x_i, x_r, y_i, y_r):
+        """Parses a G2 point without the (costly) subgroup check"""
+        bn128 = self.bn128
+        for v in (x_i, x_r, y_i, y_r):
+            if v >= bn128.field_modulus:
+                return None
+        if x_i == x_r == y_i == y_r == 0:
+            return self.G2_zero
+        p = (bn128.FQ2([x_r, x_i]), bn128.FQ2([y_r, y_i]), bn128.FQ2.one())
+        if not bn128.is_on_curve(p, bn128.b2):
+            return None
+        return p
+
+    def _to_ints(self, p):
+        o = self.bn128.normalize(p)
+        return o[0].n, o[1].n
+
+    def add(self, x1, y1, x2, y2):
+        p1 = self.g1_point(x1, y1)
+        p2 = self.g1_point(x2, y2)
+        if p1 is None or p2 is None:
+            return None
+        return self._to_ints(self.bn128.add(p1, p2))
+
+    def multiply(self, x, y, m):
+        p = self.g1_point(x, y)
+        if p is None:
+            return None
+        return self._to_ints(self.bn128.multiply(p, m))
+
+    def pairing_check(self, pairs):
+        """
+        Checks whether the product of the pairings of `pairs`, given as
+        (x1, y1, x2_i, x2_r, y2_i, y2_r) tuples, is one. All points are
+        validated before any Miller loop runs, pairs with a point at
+        infinity are skipped as their pairing is one, and the Miller loop
+        results share a single final exponentiation.
+        """
+        bn128 = self.bn128
+        points = []
+        for x1, y1, x2_i, x2_r, y2_i, y2_r in pairs:
+            p1 = self.g1_point(x1, y1)
+            p2 = self.g2_point(x2_i, x2_r, y2_i, y2_r)
+            if p1 is None or p2 is None:
+                return None
+            points.append((p1, p2))
+        for p1, p2 in points:
+            if p2 is not self.G2_zero and \
+                    bn128.multiply(p2, bn128.curve_order)[-1] != bn128.FQ2.zero():
+                return None
+        exponent = bn128.FQ12.one()
+        for p1, p2 in points:
+            if p1 is self.G1_zero or p2 is self.G2_zero:
+                continue
+            exponent *= bn128.pairing(p2, p1, final_exponentiate=False)
+        return bn128.final_exponentiate(exponent) == bn128.FQ12.one()
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = PyECCBackend()
+    return _backend
+
+
+def set_backend(backend):
+    """Installs a bn128 backend, eg. bindings to a compiled library"""
+    global _backend
+    _backend = backend
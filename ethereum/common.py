@@ -1,13 +1,16 @@
+import threading
+from collections import OrderedDict
+
 from ethereum.config import default_config
 from ethereum.block import Block, BlockHeader
 from ethereum import trie
-from ethereum.db import EphemDB
 from ethereum.utils import sha3, encode_hex
 import rlp
 from ethereum.slogging import get_logger
 from ethereum.exceptions import InsufficientBalance, BlockGasLimitReached, \
     InsufficientStartGas, InvalidNonce, UnsignedTransaction
 from ethereum.messages import apply_transaction
+from ethereum.transactions import recover_senders
 log = get_logger('eth.block')
 
 
@@ -126,6 +129,7 @@ def add_transactions(state, block, txqueue, min_gasprice=0):
     pre_txs = len(block.transactions)
     log.info('Adding transactions, %d in txqueue, %d dunkles' %
              (len(txqueue.txs), pre_txs))
+    recover_senders([item.tx for item in txqueue.txs])
     while True:
         tx = txqueue.pop_transaction(max_gas=state.gas_limit - state.gas_used,
                                      min_gasprice=min_gasprice)
@@ -141,10 +145,38 @@ def add_transactions(state, block, txqueue, min_gasprice=0):
 
 
 # Validate that the transaction list root is correct
-def validate_transaction_tree(state, block):
+# Blocks whose transaction roots were checked ahead of execution (eg. by the
+# import pipeline), as header hash -> the checked transaction list. The
+# pipeline fills it from its own thread, hence the lock.
+checked_tx_roots = OrderedDict()
+checked_tx_roots.max_items = 1024
+checked_tx_roots_lock = threading.Lock()
+
+
+def precheck_transaction_tree(block):
+    """
+    Checks a block's transaction root ahead of its execution; if it is
+    right, validate_transaction_tree won't compute it again for this
+    same block object.
+    """
     if block.header.tx_list_root != mk_transaction_sha(block.transactions):
+        return False
+    with checked_tx_roots_lock:
+        checked_tx_roots[block.header.hash] = block.transactions
+        if len(checked_tx_roots) > checked_tx_roots.max_items:
+            checked_tx_roots.popitem(last=False)
+    return True
+
+
+def validate_transaction_tree(state, block):
+    with checked_tx_roots_lock:
+        checked = checked_tx_roots.pop(block.header.hash, None)
+    if checked is block.transactions:
+        return True
+    tx_list_root = mk_transaction_sha(block.transactions)
+    if block.header.tx_list_root != tx_list_root:
         raise ValueError("Transaction root mismatch: header %s computed %s, %d transactions" %
-                         (encode_hex(block.header.tx_list_root), encode_hex(mk_transaction_sha(block.transactions)),
+                         (encode_hex(block.header.tx_list_root), encode_hex(tx_list_root),
                           len(block.transactions)))
     return True
 
@@ -169,9 +201,10 @@ def verify_execution_results(state, block):
     if block.header.state_root != state.trie.root_hash:
         raise ValueError("State root mismatch: header %s computed %s" %
                          (encode_hex(block.header.state_root), encode_hex(state.trie.root_hash)))
-    if block.header.receipts_root != mk_receipt_sha(state.receipts):
+    receipts_root = mk_receipt_sha(state.receipts)
+    if block.header.receipts_root != receipts_root:
         raise ValueError("Receipt root mismatch: header %s computed %s, gas used header %d computed %d, %d receipts" %
-                         (encode_hex(block.header.receipts_root), encode_hex(mk_receipt_sha(state.receipts)),
+                         (encode_hex(block.header.receipts_root), encode_hex(receipts_root),
                           block.header.gas_used, state.gas_used, len(state.receipts)))
     if block.header.gas_used != state.gas_used:
         raise ValueError("Gas used mismatch: header %d computed %d" %
@@ -179,12 +212,21 @@ def verify_execution_results(state, block):
     return True
 
 
-# Make the root of a receipt tree
+# Trie keys of receipts and transactions by index, sha3(rlp.encode(i))
+index_keys = {}
+
+
+def get_index_key(i):
+    key = index_keys.get(i)
+    if key is None:
+        key = index_keys[i] = sha3(rlp.encode(i))
+    return key
+
+
+# Make the root of a receipt tree, built in one pass by trie.bulk_root
 def mk_receipt_sha(receipts):
-    t = trie.Trie(EphemDB())
-    for i, receipt in enumerate(receipts):
-        t.update(sha3(rlp.encode(i)), rlp.encode(receipt))
-    return t.root_hash
+    return trie.bulk_root([(get_index_key(i), rlp.encode(receipt))
+                           for i, receipt in enumerate(receipts)])
 
 
 # Make the root of a transaction tree
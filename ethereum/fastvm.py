@@ -11,7 +11,7 @@ from ethereum.abi import is_numeric
 import copy
 from ethereum import opcodes
 import time
-from ethereum.slogging import get_logger
+from ethereum.slogging import get_logger, add_level_listener
 from rlp.utils import encode_hex, ascii_chr
 from ethereum.utils import to_string, encode_int, zpad, bytearray_to_bytestr
 
@@ -23,6 +23,21 @@ log_vm_op_stack = get_logger('eth.vm.op.stack')
 log_vm_op_memory = get_logger('eth.vm.op.memory')
 log_vm_op_storage = get_logger('eth.vm.op.storage')
 
+# Level flags for the hot path, refreshed by slogging whenever the log
+# configuration changes, so disabled logging costs a single boolean test
+trace_vm_op = trace_vm_exit = trace_log = debug_msg = False
+
+
+def _refresh_log_flags():
+    global trace_vm_op, trace_vm_exit, trace_log, debug_msg
+    trace_vm_op = log_vm_op.is_active('trace')
+    trace_vm_exit = log_vm_exit.is_active('trace')
+    trace_log = log_log.is_active('trace')
+    debug_msg = log_msg.is_active('debug')
+
+
+add_level_listener(_refresh_log_flags)
+
 TT256 = 2 ** 256
 TT256M1 = 2 ** 256 - 1
 TT255 = 2 ** 255
@@ -182,17 +197,20 @@ def all_but_1n(x, n):
 
 
 def vm_exception(error, **kargs):
-    log_vm_exit.trace('EXCEPTION', cause=error, **kargs)
+    if trace_vm_exit:
+        log_vm_exit.trace('EXCEPTION', cause=error, **kargs)
     return 0, 0, []
 
 
 def peaceful_exit(cause, gas, data, **kargs):
-    log_vm_exit.trace('EXIT', cause=cause, **kargs)
+    if trace_vm_exit:
+        log_vm_exit.trace('EXIT', cause=cause, **kargs)
     return 1, gas, data
 
 
 def revert(gas, data, **kargs):
-    log_vm_exit.trace('REVERT', **kargs)
+    if trace_vm_exit:
+        log_vm_exit.trace('REVERT', **kargs)
     return 0, gas, data
 
 
@@ -202,7 +220,7 @@ code_cache = {}
 def vm_execute(ext, msg, code):
     # precompute trace flag
     # if we trace vm, we're in slow mode anyway
-    trace_vm = log_vm_op.is_active('trace')
+    trace_vm = trace_vm_op
 
     compustate = Compustate(gas=msg.gas)
     stk = compustate.stack
@@ -576,8 +594,9 @@ def vm_execute(ext, msg, code):
                     return vm_exception('OOG EXTENDING MEMORY')
                 data = bytearray_to_bytestr(mem[mstart: mstart + msz])
                 ext.log(msg.to, topics, data)
-                log_log.trace('LOG', to=msg.to, topics=topics,
-                              data=list(map(utils.safe_ord, data)))
+                if trace_log:
+                    log_log.trace('LOG', to=msg.to, topics=topics,
+                                  data=list(map(utils.safe_ord, data)))
                 # print('LOG', msg.to, topics, list(map(ord, data)))
 
             elif op == 'CREATE':
@@ -706,12 +725,13 @@ def vm_execute(ext, msg, code):
                 ext.set_balance(to, ext.get_balance(to) + xfer)
                 ext.set_balance(msg.to, 0)
                 ext.add_suicide(msg.to)
-                log_msg.debug(
-                    'SUICIDING',
-                    addr=utils.checksum_encode(
-                        msg.to),
-                    to=utils.checksum_encode(to),
-                    xferring=xfer)
+                if debug_msg:
+                    log_msg.debug(
+                        'SUICIDING',
+                        addr=utils.checksum_encode(
+                            msg.to),
+                        to=utils.checksum_encode(to),
+                        xferring=xfer)
                 return 1, compustate.gas, []
 
             # assert utils.is_numeric(compustate.gas)
@@ -323,19 +323,16 @@ def casper_start_epoch(state):
 
 def get_dunkle_candidates(chain, state, scan_limit=10):
     blknumber = call_casper(state, 'getBlockNumber')
-    anc = chain.get_block(
-        chain.get_blockhash_by_number(
-            blknumber - scan_limit))
+    anc_hash = chain.get_blockhash_by_number(blknumber - scan_limit)
+    anc = chain.get_header(anc_hash) if anc_hash else None
     if anc:
-        descendants = chain.get_descendants(anc)
+        descendants = chain.get_descendant_headers(anc)
     else:
-        descendants = chain.get_descendants(
-            chain.get_block(chain.db.get('GENESIS_HASH')))
-    potential_uncles = [
-        x for x in descendants if x not in chain and isinstance(
-            x, Block)]
-    uncles = [x.header for x in potential_uncles if not call_casper(
-        chain.state, 'isDunkleIncluded', [x.header.hash])]
+        descendants = chain.get_descendant_headers(
+            chain.get_header(chain.db.get('GENESIS_HASH')))
+    potential_uncles = [x for x in descendants if x not in chain]
+    uncles = [x for x in potential_uncles if not call_casper(
+        chain.state, 'isDunkleIncluded', [x.hash])]
     dunkle_txs = []
     ct = get_casper_ct()
     start_nonce = state.get_nonce(state.config['METROPOLIS_ENTRY_POINT'])
@@ -16,6 +16,7 @@ from ethereum.config import Env
 from ethereum.state import State, dict_to_prev_header
 from ethereum.block import Block, BlockHeader, BLANK_UNCLES_HASH
 from ethereum.pow.consensus import initialize
+from ethereum.pow.chain_index import DecodedCache, HeaderStore
 from ethereum.genesis_helpers import mk_basic_state, state_from_genesis_declaration, initialize_genesis_keys
 
 
@@ -70,6 +71,8 @@ class Chain(object):
 
         initialize(self.state)
         self.new_head_cb = new_head_cb
+        self.headers = HeaderStore(self.env.db)
+        self.block_cache = DecodedCache(kwargs.get('block_cache_size', 256))
 
         self.head_hash = self.state.prev_headers[0].hash
         self.checkpoint_head_hash = b'\x00' * 32
@@ -84,6 +87,8 @@ class Chain(object):
         else:
             self.genesis = self.get_block_by_number(0)
         self.db.put(b'cp_subtree_score' + self.genesis.hash, 2/3.)
+        if b'cp_pow_head:' + self.genesis.hash not in self.db:
+            self.db.put(b'cp_pow_head:' + self.genesis.hash, self.genesis.hash)
         self.min_gasprice = kwargs.get('min_gasprice', 5 * 10**9)
         self.coinbase = coinbase
         self.extra_data = 'moo ha ha says the laughing cow.'
@@ -93,15 +98,10 @@ class Chain(object):
 
     @property
     def head(self):
-        try:
-            block_rlp = self.db.get(self.head_hash)
-            if block_rlp == 'GENESIS':
-                return self.genesis
-            else:
-                return rlp.decode(block_rlp, Block)
-        except Exception as e:
-            log.error(e)
-            return None
+        block = self.get_block(self.head_hash)
+        if block is None:
+            log.error("Head block not found", hash=encode_hex(self.head_hash))
+        return block
 
     @property
     def head_checkpoint(self):
@@ -167,13 +167,26 @@ class Chain(object):
         self.checkpoint_head_hash = cp_head_hash
 
     def find_heaviest_pow_block(self, root):
-        children = self.get_children(root)
-        maxchild, maxscore = root, self.get_pow_difficulty(root)
-        for c in children:
-            maxc, s = self.find_heaviest_pow_block(c)
-            if s > maxscore:
-                maxchild, maxscore = maxc, s
-        return maxchild, maxscore
+        head = self.get_pow_head(root.hash) or root
+        return head, self.get_pow_difficulty(head)
+
+    # Keeps cp_pow_head: of each checkpoint pointing at the heaviest block
+    # of its subtree. A checkpoint's subtree holds those of the checkpoints
+    # after it, so going back stops at the first one the block doesn't beat
+    def update_pow_heads(self, block):
+        score = self.get_pow_difficulty(block)
+        if self.is_checkpoint(block):
+            cp_hash = block.hash
+        else:
+            cp_hash = self.get_prev_checkpoint_hash(block.hash)
+        while True:
+            head = self.get_pow_head(cp_hash)
+            if head is not None and self.get_pow_difficulty(head) >= score:
+                break
+            self.db.put(b'cp_pow_head:' + cp_hash, block.hash)
+            if cp_hash == self.genesis.hash:
+                break
+            cp_hash = self.get_prev_checkpoint_hash(cp_hash)
 
     def get_shared_parent_cp(self, b1, b2):
         while self.get_prev_checkpoint_block(b1) != self.get_prev_checkpoint_block(b2):
@@ -249,7 +262,6 @@ class Chain(object):
         log.info('Adding to head', head=encode_hex(block.header.prevhash))
         apply_block(self.state, block)
         self.db.put('block:' + str(block.header.number), block.header.hash)
-        self.get_pow_difficulty(block)  # side effect: put 'score:' cache in db
         self.head_hash = block.header.hash
         for i, tx in enumerate(block.transactions):
             self.db.put(b'txindex:' + tx.hash, rlp.encode([block.number, i]))
@@ -282,6 +294,7 @@ class Chain(object):
         # ~~~ Store ~~~~ #
         # Store the block
         self.db.put(block.header.hash, rlp.encode(block))
+        self.headers.put(block.header)
         self.add_child(block)
         if block.number % self.config['EPOCH_LENGTH'] == 0:
             self.db.put(b'cp_subtree_score' + block.hash, 0)
@@ -292,6 +305,9 @@ class Chain(object):
             temp_state = self.mk_poststate_of_blockhash(block.header.prevhash)
         apply_block(temp_state, block)
         self.db.put(b'state:' + block.header.hash, temp_state.trie.root_hash)
+        # Store the total difficulty, and the block as its checkpoints'
+        # heaviest if it is
+        self.update_pow_heads(block)
         # ~~~ Finality Gadget Fork Choice ~~~~ #
         old_head_chekpoint = self.head_checkpoint
         # Store the new score
@@ -320,8 +336,9 @@ class Chain(object):
         log.info('Head cp num: {} - block prev cp num: {}'.format(self.head_checkpoint.number, cp.number))
         if self.head_checkpoint == cp:
             if self.head_checkpoint == old_head_chekpoint:
-                log.info('Head checkpoint == old head. CP Head Num: {} - Head diff: {} - Block diff: {}'.format(self.head_checkpoint.number, self.get_pow_difficulty(self.head), self.get_pow_difficulty(block)))
-                if self.get_pow_difficulty(self.head) < self.get_pow_difficulty(block):
+                head_difficulty = self.get_pow_difficulty(self.get_header(self.head_hash))
+                log.info('Head checkpoint == old head. CP Head Num: {} - Head diff: {} - Block diff: {}'.format(self.head_checkpoint.number, head_difficulty, self.get_pow_difficulty(block)))
+                if head_difficulty < self.get_pow_difficulty(block):
                     self.set_head(block)
             else:
                 log.info('Head checkpoint changed to cp number: {}'.format(self.head_checkpoint.number))
@@ -382,21 +399,21 @@ class Chain(object):
         if b'prev_cp' + block_hash in self.db:
             return self.db.get(b'prev_cp' + block_hash)
         # Otherwise, compute the checkpoint
-        block = self.get_block(block_hash)
-        checkpoint_distance = (block.header.number) % self.config['EPOCH_LENGTH']
+        header = self.get_header(block_hash)
+        checkpoint_distance = header.number % self.config['EPOCH_LENGTH']
         if checkpoint_distance == 0:
             checkpoint_distance = self.config['EPOCH_LENGTH']
-        b = block
+        h = header
         for i in range(checkpoint_distance):
-            if b'prev_cp' + b.hash in self.db:
-                prev_checkpoint_hash = self.db.get(b'prev_cp' + b.hash)
-                self.db.put(b'prev_cp' + block.hash, prev_checkpoint_hash)
+            if b'prev_cp' + h.hash in self.db:
+                prev_checkpoint_hash = self.db.get(b'prev_cp' + h.hash)
+                self.db.put(b'prev_cp' + header.hash, prev_checkpoint_hash)
                 return prev_checkpoint_hash
-            b = self.get_block(b.header.prevhash)
-            if b is None:
+            h = self.get_header(h.prevhash)
+            if h is None:
                 raise Exception('No prev checkpoint')
-        self.db.put(b'prev_cp' + block.hash, b.hash)
-        return b.hash
+        self.db.put(b'prev_cp' + header.hash, h.hash)
+        return h.hash
 
     def is_parent_checkpoint(self, parent, child):
         if parent == b'\x00' * 32:
@@ -468,6 +485,9 @@ class Chain(object):
         return self.get_block(block.header.prevhash)
 
     def get_block(self, blockhash):
+        block = self.block_cache.get(blockhash)
+        if block is not None:
+            return block
         try:
             block_rlp = self.db.get(blockhash)
             if block_rlp == 'GENESIS':
@@ -475,11 +495,21 @@ class Chain(object):
                     self.genesis = rlp.decode(self.db.get('GENESIS_RLP'), sedes=Block)
                 return self.genesis
             else:
-                return rlp.decode(block_rlp, Block)
+                block = rlp.decode(block_rlp, Block)
+                self.block_cache.put(blockhash, block)
+                self.headers.remember(block.header)
+                return block
         except Exception as e:
             log.debug("Failed to get block", hash=blockhash, error=e)
             return None
 
+    def get_header(self, blockhash):
+        try:
+            return self.headers.get(blockhash)
+        except KeyError:
+            block = self.get_block(blockhash)
+            return block.header if block else None
+
     # Add a record allowing you to later look up the provided block's
     # parent hash and see that it is one of its children
     def add_child(self, child):
@@ -521,16 +551,19 @@ class Chain(object):
         return [self.get_block(h) for h in self.get_child_hashes(block)]
 
     # Get the score (AKA total difficulty in PoW) of a given block
+    # Total difficulty of a block (or header), stored for each block as it
+    # is added, so normally a single lookup
     def get_pow_difficulty(self, block):
         if not block:
             return 0
-        key = b'score:' + block.header.hash
+        header = block.header if isinstance(block, Block) else block
+        key = b'score:' + header.hash
         fills = []
         while key not in self.db:
-            fills.insert(0, (block.header.hash, block.difficulty))
-            key = b'score:' + block.header.prevhash
-            block = self.get_parent(block)
-            if block is None:
+            fills.insert(0, (header.hash, header.difficulty))
+            key = b'score:' + header.prevhash
+            header = self.get_header(header.prevhash)
+            if header is None:
                 return 0
         score = int(self.db.get(key))
         for h, d in fills:
@@ -555,6 +588,17 @@ class Chain(object):
                 return chain
             chain.append(self.get_block(h))
 
+    # Same as get_chain, but returns the headers and decodes no block bodies
+    def get_header_chain(self, frm=None, to=2**63 - 1):
+        if frm is None:
+            frm = int(self.db.get('GENESIS_NUMBER')) + 1
+        headers = []
+        for i in itertools.islice(itertools.count(), frm, to):
+            h = self.get_blockhash_by_number(i)
+            if not h:
+                return headers
+            headers.append(self.get_header(h))
+
     # Recover transaction and the block that contains it
     def get_transaction(self, tx):
         if not isinstance(tx, (str, bytes)):
@@ -577,20 +621,29 @@ class Chain(object):
             output.append(b)
         return output
 
+    # Get the headers of a block's descendants, the block's own included,
+    # without decoding any block bodies
+    def get_descendant_headers(self, header):
+        output = []
+        headers = [header]
+        while len(headers):
+            h = headers.pop()
+            headers.extend(self.get_header(c)
+                           for c in self.get_child_hashes(h.hash))
+            output.append(h)
+        return output
+
     # Get blockhashes starting from a hash and going backwards
     def get_blockhashes_from_hash(self, hash, max):
-        block = self.get_block(hash)
-        if block is None:
+        header = self.get_header(hash)
+        if header is None:
             return []
 
-        header = block.header
         hashes = []
-        for i in xrange(max):
-            hash = header.prevhash
-            block = self.get_block(hash)
-            if block is None:
+        for i in range(max):
+            header = self.get_header(header.prevhash)
+            if header is None:
                 break
-            header = block.header
             hashes.append(header.hash)
             if header.number == 0:
                 break
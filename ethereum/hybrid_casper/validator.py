@@ -1,10 +1,9 @@
-import copy
 from ethereum.hybrid_casper import casper_utils, chain
 from ethereum.pow.ethpow import Miner
 from ethereum.tools import tester
-from ethereum.meta import make_head_candidate
+from ethereum.meta import HeadCandidateBuilder
 from ethereum import block, transactions
-from ethereum.transaction_queue import TransactionQueue
+from ethereum.transaction_queue import TransactionPool
 from ethereum.messages import apply_transaction
 from ethereum import abi, utils
 from ethereum.slogging import get_logger
@@ -40,10 +39,12 @@ class Validator(object):
         self.prev_prepare_epoch = 0
         self.prev_commit_epoch = 0
         self.epoch_length = self.chain.env.config['EPOCH_LENGTH']
-        # When the transaction_queue is modified, we must set
-        # self._head_candidate_needs_updating to True in order to force the
-        # head candidate to be updated.
-        self.transaction_queue = TransactionQueue()
+        # Incoming transactions are added to the head candidate as they
+        # arrive; it is only rebuilt from the transaction_queue when
+        # self._head_candidate_needs_updating is set, ie. on a new head.
+        self.transaction_queue = TransactionPool(
+            get_nonce=lambda sender: self.chain.state.get_nonce(sender))
+        self.candidate_builder = HeadCandidateBuilder(self.chain)
         self._head_candidate_needs_updating = True
         # Add validator to the network
         self.network = network
@@ -53,15 +54,12 @@ class Validator(object):
     def head_candidate(self):
         if self._head_candidate_needs_updating:
             self._head_candidate_needs_updating = False
-            # Make a copy of self.transaction_queue because
-            # make_head_candidate modifies it.
-            txqueue = copy.deepcopy(self.transaction_queue)
-            self._head_candidate, self._head_candidate_state = make_head_candidate(
-                self.chain, txqueue=txqueue, timestamp=self.chain.state.timestamp + 14)
-        return self._head_candidate
+            self.candidate_builder.reset(
+                self.transaction_queue, timestamp=self.chain.state.timestamp + 14)
+        return self.candidate_builder.candidate()
 
     def _on_new_head(self, block):
-        self.transaction_queue = self.transaction_queue.diff(block.transactions)
+        self.transaction_queue.remove_included(block)
         self._head_candidate_needs_updating = True
 
     def epoch_blockhash(self, state, epoch):
@@ -118,7 +116,9 @@ class Validator(object):
             self.broadcast_transaction(commit_tx)
 
     def accept_transaction(self, tx):
-        self.transaction_queue.add_transaction(tx)
+        if self.transaction_queue.add_transaction(tx) and \
+                not self._head_candidate_needs_updating:
+            self.candidate_builder.add_transaction(tx)
         if self.mining:
             log.info('Mining tx: {}'.format(tx))
             self.mine_and_broadcast_blocks(1)
@@ -190,9 +190,8 @@ class Validator(object):
 
     def mine_and_broadcast_blocks(self, number_of_blocks=1):
         for i in range(number_of_blocks):
-            self._head_candidate_needs_updating = True
             block = Miner(self.head_candidate).mine(rounds=100, start_nonce=0)
-            self.transaction_queue = self.transaction_queue.diff(block.transactions)
+            self.transaction_queue.remove_included(block)
             self.broadcast_newblock(block)
 
     def broadcast_deposit(self):
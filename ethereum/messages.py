@@ -17,7 +17,7 @@ from ethereum import opcodes
 from ethereum.transactions import Transaction
 from ethereum.consensus_strategy import get_consensus_strategy
 from ethereum import vm
-from ethereum.specials import specials as default_specials
+from ethereum.specials import resolve_precompiles
 from ethereum.config import Env, default_config
 from ethereum.db import BaseDB, EphemDB
 from ethereum.exceptions import InvalidNonce, InsufficientStartGas, UnsignedTransaction, \
@@ -27,7 +27,7 @@ if sys.version_info.major == 2:
     from repoze.lru import lru_cache
 else:
     from functools import lru_cache
-from ethereum.slogging import get_logger
+from ethereum.slogging import get_logger, add_level_listener
 
 null_address = b'\xff' * 20
 
@@ -36,6 +36,20 @@ log_tx = get_logger('eth.pb.tx')
 log_msg = get_logger('eth.pb.msg')
 log_state = get_logger('eth.pb.msg.state')
 
+# Level flags for the hot path, refreshed by slogging whenever the log
+# configuration changes
+debug_tx = debug_msg = trace_msg = False
+
+
+def _refresh_log_flags():
+    global debug_tx, debug_msg, trace_msg
+    debug_tx = log_tx.is_active('debug')
+    debug_msg = log_msg.is_active('debug')
+    trace_msg = log_msg.is_active('trace')
+
+
+add_level_listener(_refresh_log_flags)
+
 # contract creating transactions send to an empty address
 CREATE_CONTRACT_ADDRESS = b''
 
@@ -251,7 +265,8 @@ def apply_transaction(state, _tx, require_rw_list_strict=True):
                 raise InsufficientStartGas(
                     rp(tx, 'startgas', tx.startgas, intrinsic_gas))
 
-    log_tx.debug('TX NEW', txdict=tx.to_dict())
+    if debug_tx:
+        log_tx.debug('TX NEW', txdict=tx.to_dict())
 
     # start transacting #################
     if tx.sender != null_address:
@@ -273,7 +288,7 @@ def apply_transaction(state, _tx, require_rw_list_strict=True):
         salt=tx.nonce)
 
     # MESSAGE
-    ext = VMExt(state, tx)
+    ext = get_block_ext(state, tx)
 
     if tx.to != b'':
         result, gas_remained, data = apply_msg(ext, message)
@@ -282,29 +297,33 @@ def apply_transaction(state, _tx, require_rw_list_strict=True):
 
     assert gas_remained >= 0
 
-    log_tx.debug("TX APPLIED", result=result, gas_remained=gas_remained,
-                 data=data)
+    if debug_tx:
+        log_tx.debug("TX APPLIED", result=result, gas_remained=gas_remained,
+                     data=data)
 
     gas_used = tx.startgas - gas_remained
 
     # Transaction failed
     if not result:
-        log_tx.debug('TX FAILED', reason='out of gas',
-                     startgas=tx.startgas, gas_remained=gas_remained)
+        if debug_tx:
+            log_tx.debug('TX FAILED', reason='out of gas',
+                         startgas=tx.startgas, gas_remained=gas_remained)
         state.delta_balance(tx.sender, tx.gasprice * gas_remained)
         state.delta_balance(state.block_coinbase, tx.gasprice * gas_used)
         output = b''
         success = 0
     # Transaction success
     else:
-        log_tx.debug('TX SUCCESS', data=data)
+        if debug_tx:
+            log_tx.debug('TX SUCCESS', data=data)
         state.refunds += len(set(state.suicides)) * opcodes.GSUICIDEREFUND
         if state.refunds > 0:
-            log_tx.debug(
-                'Refunding',
-                gas_refunded=min(
-                    state.refunds,
-                    gas_used // 2))
+            if debug_tx:
+                log_tx.debug(
+                    'Refunding',
+                    gas_refunded=min(
+                        state.refunds,
+                        gas_used // 2))
             gas_remained += min(state.refunds, gas_used // 2)
             gas_used -= min(state.refunds, gas_used // 2)
             state.refunds = 0
@@ -341,14 +360,15 @@ def apply_transaction(state, _tx, require_rw_list_strict=True):
     return success, output
 
 
-# VM interface
+# VM interface. Everything that depends only on the block context is set
+# up once per block (see get_block_ext); per-transaction fields are
+# (re)bound with set_tx.
 class VMExt():
 
-    def __init__(self, state, tx):
-        self.specials = {k: v for k, v in default_specials.items()}
-        for k, v in state.config['CUSTOM_SPECIALS']:
-            self.specials[k] = v
+    def __init__(self, state, tx=None):
+        self.specials = resolve_precompiles(state.config, state.block_number)
         self._state = state
+        self._block_key = block_context_key(state)
         self.get_code = state.get_code
         self.set_code = state.set_code
         self.get_balance = state.get_balance
@@ -358,37 +378,33 @@ class VMExt():
         self.increment_nonce = state.increment_nonce
         self.set_storage_data = state.set_storage_data
         self.get_storage_data = state.get_storage_data
-        self.log_storage = lambda x: state.account_to_dict(x)
-        self.add_suicide = lambda x: state.add_suicide(x)
-        self.add_refund = lambda x: \
-            state.set_param('refunds', state.refunds + x)
-        self.block_hash = lambda x: state.get_block_hash(state.block_number - x - 1) \
-            if (1 <= state.block_number - x <= 256 and x <= state.block_number) else b''
+        self.log_storage = state.account_to_dict
+        self.add_suicide = state.add_suicide
         self.block_coinbase = state.block_coinbase
         self.block_timestamp = state.timestamp
         self.block_number = state.block_number
         self.block_difficulty = state.block_difficulty
         self.block_gas_limit = state.gas_limit
-        self.log = lambda addr, topics, data: \
-            state.add_log(Log(addr, topics, data))
-        self.create = lambda msg, is_create_copy: create_contract(self, msg, is_create_copy)
-        self.msg = lambda msg: _apply_msg(
-            self, msg, self.get_code(msg.code_address))
         self.account_exists = state.account_exists
-        self.post_homestead_hardfork = lambda: state.is_HOMESTEAD()
-        self.post_metropolis_hardfork = lambda: state.is_METROPOLIS()
-        self.post_constantinople_hardfork = lambda: state.is_CONSTANTINOPLE()
-        self.post_serenity_hardfork = lambda: state.is_SERENITY()
-        self.post_anti_dos_hardfork = lambda: state.is_ANTI_DOS()
-        self.post_spurious_dragon_hardfork = lambda: state.is_SPURIOUS_DRAGON()
+        self._homestead = state.is_HOMESTEAD()
+        self._metropolis = state.is_METROPOLIS()
+        self._constantinople = state.is_CONSTANTINOPLE()
+        self._serenity = state.is_SERENITY()
+        self._anti_dos = state.is_ANTI_DOS()
+        self._spurious_dragon = state.is_SPURIOUS_DRAGON()
         self.blockhash_store = state.config['METROPOLIS_BLOCKHASH_STORE']
         self.snapshot = state.snapshot
         self.revert = state.revert
         self.transfer_value = state.transfer_value
         self.reset_storage = state.reset_storage
+        self.set_tx(tx)
+
+    def set_tx(self, tx):
         self.tx_origin = tx.sender if tx else '\x00' * 20
         self.tx_gasprice = tx.gasprice if tx else 0
-         # self.gathering_mode is used to indicate that vm will be
+        self.tracer = self._state.tracer
+        self.profiler = self._state.profiler
+        # self.gathering_mode is used to indicate that vm will be
         # gathering accounts that data are read from/written to.
         self.gathering_mode = False
         self.read_list = list(set(tx.read_list)) if tx else list()
@@ -397,13 +413,69 @@ class VMExt():
         self.record_read_list = set()       # list of accounts that data are read from
         self.record_write_list = set()      # list of accounts that data are written to
 
+    def matches(self, state):
+        return self._state is state and \
+            self._block_key == block_context_key(state)
+
+    def add_refund(self, x):
+        self._state.set_param('refunds', self._state.refunds + x)
+
+    def block_hash(self, x):
+        state = self._state
+        if 1 <= state.block_number - x <= 256 and x <= state.block_number:
+            return state.get_block_hash(state.block_number - x - 1)
+        return b''
+
+    def log(self, addr, topics, data):
+        self._state.add_log(Log(addr, topics, data))
+
+    def create(self, msg, is_create_copy=False):
+        return create_contract(self, msg, is_create_copy)
+
+    def msg(self, msg):
+        return _apply_msg(self, msg, self.get_code(msg.code_address))
+
+    def post_homestead_hardfork(self):
+        return self._homestead
+
+    def post_metropolis_hardfork(self):
+        return self._metropolis
+
+    def post_constantinople_hardfork(self):
+        return self._constantinople
+
+    def post_serenity_hardfork(self):
+        return self._serenity
+
+    def post_anti_dos_hardfork(self):
+        return self._anti_dos
+
+    def post_spurious_dragon_hardfork(self):
+        return self._spurious_dragon
+
+
+def block_context_key(state):
+    return (state.block_number, state.timestamp, state.block_coinbase,
+            state.block_difficulty, state.gas_limit)
+
+
+def get_block_ext(state, tx):
+    """
+    Returns a VMExt bound to `tx`. The VMExt of the current block context
+    is kept on the state and reused by every transaction of the block.
+    """
+    ext = state.block_ext
+    if ext is None or not ext.matches(state):
+        ext = state.block_ext = VMExt(state)
+    ext.set_tx(tx)
+    return ext
+
 
 def apply_msg(ext, msg):
     return _apply_msg(ext, msg, ext.get_code(msg.code_address))
 
 
 def _apply_msg(ext, msg, code):
-    trace_msg = log_msg.is_active('trace')
     if trace_msg:
         log_msg.debug("MSG APPLY", sender=encode_hex(msg.sender), to=encode_hex(msg.to),
                       gas=msg.gas, value=msg.value, codelen=len(code),
@@ -418,15 +490,22 @@ def _apply_msg(ext, msg, code):
     snapshot = ext.snapshot()
     if msg.transfers_value:
         if not ext.transfer_value(msg.sender, msg.to, msg.value):
-            log_msg.debug('MSG TRANSFER FAILED', have=ext.get_balance(msg.sender),
-                          want=msg.value)
+            if debug_msg:
+                log_msg.debug('MSG TRANSFER FAILED', have=ext.get_balance(msg.sender),
+                              want=msg.value)
             return 0, msg.gas, []
 
     # Main loop
-    if msg.code_address in ext.specials:
+    profiler = ext.profiler
+    is_precompile = msg.code_address in ext.specials
+    if profiler is not None:
+        profiler.enter_frame(msg, code, is_precompile)
+    if is_precompile:
         res, gas, dat = ext.specials[msg.code_address](ext, msg)
     else:
         res, gas, dat = vm.vm_execute(ext, msg, code)
+    if profiler is not None:
+        profiler.exit_frame(gas)
 
     if trace_msg:
         log_msg.debug('MSG APPLIED', gas_remained=gas,
@@ -435,14 +514,16 @@ def _apply_msg(ext, msg, code):
                       post_storage=ext.log_storage(msg.to))
 
     if res == 0:
-        log_msg.debug('REVERTING')
+        if debug_msg:
+            log_msg.debug('REVERTING')
         ext.revert(snapshot)
 
     return res, gas, dat
 
 
 def create_contract(ext, msg, is_create_copy=False):
-    log_msg.debug('CONTRACT CREATION')
+    if debug_msg:
+        log_msg.debug('CONTRACT CREATION')
 
     code = msg.data.extract_all()
 
@@ -457,7 +538,8 @@ def create_contract(ext, msg, is_create_copy=False):
 
     if ext.post_metropolis_hardfork() and (
             ext.get_nonce(msg.to) or len(ext.get_code(msg.to))):
-        log_msg.debug('CREATING CONTRACT ON TOP OF EXISTING CONTRACT')
+        if debug_msg:
+            log_msg.debug('CREATING CONTRACT ON TOP OF EXISTING CONTRACT')
         return 0, 0, b''
 
     b = ext.get_balance(msg.to)
@@ -475,13 +557,14 @@ def create_contract(ext, msg, is_create_copy=False):
     ext.set_nonce(msg.to, 1 if ext.post_spurious_dragon_hardfork() else 0)
     res, gas, dat = _apply_msg(ext, msg, code)
 
-    log_msg.debug(
-        'CONTRACT CREATION FINISHED',
-        res=res,
-        gas=gas,
-        dat=dat if len(dat) < 2500 else (
-            "data<%d>" %
-            len(dat)))
+    if debug_msg:
+        log_msg.debug(
+            'CONTRACT CREATION FINISHED',
+            res=res,
+            gas=gas,
+            dat=dat if len(dat) < 2500 else (
+                "data<%d>" %
+                len(dat)))
 
     if res:
         if not len(dat) and not is_create_copy:
@@ -494,32 +577,35 @@ def create_contract(ext, msg, is_create_copy=False):
                 gas -= gcost
             else:
                 dat = []
-                log_msg.debug(
-                    'CONTRACT CREATION FAILED',
-                    have=gas,
-                    want=gcost,
-                    block_number=ext.block_number)
+                if debug_msg:
+                    log_msg.debug(
+                        'CONTRACT CREATION FAILED',
+                        have=gas,
+                        want=gcost,
+                        block_number=ext.block_number)
                 if ext.post_homestead_hardfork():
                     ext.revert(snapshot)
                     return 0, 0, b''
             
             ext.set_code(msg.to, bytearray_to_bytestr(dat))
-            log_msg.debug('SETTING CODE', addr=encode_hex(msg.to), lendat=len(dat))
+            if debug_msg:
+                log_msg.debug('SETTING CODE', addr=encode_hex(msg.to), lendat=len(dat))
         else:
             # Check if the data returned by processing the init_code is
             # exactly 32 bytes
             if len(dat) != 32:
-                log_msg.debug(
-                    'CONTRACT CREATION FAILED',
-                    have=gas,
-                    want=gcost,
-                    block_number=ext.block_number)
+                if debug_msg:
+                    log_msg.debug(
+                        'CONTRACT CREATION FAILED',
+                        lendat=len(dat),
+                        block_number=ext.block_number)
                 return 0, 0, b''
             # If it's a CREATE_COPY call, avoid the per byte gas cost and
             # copy the code from the address returned by processing the
             # init_code
             ext.set_code(msg.to, ext.get_code(utils.decode_addr(dat[12:])))
-            log_msg.debug('SETTING CODE', addr=encode_hex(msg.to), lendat=len(ext.get_code(msg.to)))
+            if debug_msg:
+                log_msg.debug('SETTING CODE', addr=encode_hex(msg.to), lendat=len(ext.get_code(msg.to)))
         return 1, gas, msg.to
     else:
         ext.revert(snapshot)
@@ -6,8 +6,11 @@ from ethereum.common import mk_block_from_prevstate, validate_header, \
     set_execution_results, add_transactions, post_finalize
 from ethereum.consensus_strategy import get_consensus_strategy
 from ethereum.messages import apply_transaction
-from ethereum.state import State
+from ethereum.transactions import recover_senders
 from ethereum.utils import sha3, encode_hex
+from ethereum.exceptions import InsufficientBalance, BlockGasLimitReached, \
+    InsufficientStartGas, InvalidNonce, UnsignedTransaction, InvalidTransaction
+import copy
 import rlp
 
 
@@ -25,6 +28,7 @@ def apply_block(state, block):
         assert cs.validate_uncles(state, block)
         assert validate_transaction_tree(state, block)
         # Process transactions
+        recover_senders(block.transactions)
         for tx in block.transactions:
             apply_transaction(state, tx)
         # Finalize (incl paying block rewards)
@@ -48,10 +52,23 @@ def make_head_candidate(chain, txqueue=None,
                         extra_data='moo ha ha says the laughing cow.',
                         min_gasprice=0):
     log.debug('Creating head candidate')
+    blk, temp_state = _mk_candidate_base(
+        chain, parent, timestamp, coinbase, extra_data)
+    cs = get_consensus_strategy(chain.env.config)
+    # Add transactions
+    add_transactions(temp_state, blk, txqueue, min_gasprice)
+    # Call the finalize state transition function
+    cs.finalize(temp_state, blk)
+    # Set state root, receipt root, etc
+    set_execution_results(temp_state, blk)
+    log.debug('Created head candidate successfully')
+    return blk, temp_state
+
+
+# Creates an empty, initialized candidate block and its state
+def _mk_candidate_base(chain, parent, timestamp, coinbase, extra_data):
     if parent is None:
-        temp_state = State.from_snapshot(
-            chain.state.to_snapshot(
-                root_only=True), chain.env)
+        temp_state = chain.state.clone()
     else:
         temp_state = chain.mk_poststate_of_blockhash(parent.hash)
 
@@ -68,11 +85,77 @@ def make_head_candidate(chain, txqueue=None,
     blk.header.uncles_hash = sha3(rlp.encode(blk.uncles))
     # Call the initialize state transition function
     cs.initialize(temp_state, blk)
-    # Add transactions
-    add_transactions(temp_state, blk, txqueue, min_gasprice)
-    # Call the finalize state transition function
-    cs.finalize(temp_state, blk)
-    # Set state root, receipt root, etc
-    set_execution_results(temp_state, blk)
-    log.debug('Created head candidate successfully')
     return blk, temp_state
+
+
+class HeadCandidateBuilder(object):
+
+    """
+    Maintains a head candidate incrementally. The candidate's state is
+    kept unfinalized, so transactions arriving later are applied on top of
+    it rather than rebuilding the whole block; only `reset`, on a new
+    head, starts over. `candidate()` finalizes into a copy of the block
+    and rolls the state back again.
+    """
+
+    def __init__(self, chain, coinbase=b'\x35' * 20,
+                 extra_data='moo ha ha says the laughing cow.',
+                 min_gasprice=0):
+        self.chain = chain
+        self.coinbase = coinbase
+        self.extra_data = extra_data
+        self.min_gasprice = min_gasprice
+        self.block = None
+        self.state = None
+        self.deferred = {}  # sender -> {nonce: tx} waiting on an earlier nonce
+        self._finalized = None
+
+    def reset(self, txqueue=None, timestamp=None):
+        """Starts a new candidate on the current head of the chain"""
+        self.block, self.state = _mk_candidate_base(
+            self.chain, None, timestamp, self.coinbase, self.extra_data)
+        self.deferred = {}
+        self._finalized = None
+        if txqueue:
+            # Pop from a copy; the queue keeps its txs until they are included
+            add_transactions(self.state, self.block, txqueue.diff([]),
+                             self.min_gasprice)
+        # Finalization is rolled back with revert, which needs a committed
+        # state to snapshot
+        self.state.commit()
+
+    def add_transaction(self, tx):
+        """Applies a newly arrived transaction on top of the candidate"""
+        if self.block is None or tx.gasprice < self.min_gasprice:
+            return False
+        try:
+            apply_transaction(self.state, tx)
+        except InvalidNonce:
+            if tx.nonce > self.state.get_nonce(tx.sender):
+                self.deferred.setdefault(tx.sender, {})[tx.nonce] = tx
+            return False
+        except (InsufficientBalance, BlockGasLimitReached, InsufficientStartGas,
+                UnsignedTransaction, InvalidTransaction) as e:
+            log.debug('Candidate rejected tx', tx=tx, error=e)
+            return False
+        self.block.transactions.append(tx)
+        self.state.commit()
+        self._finalized = None
+        # A deferred tx from the same sender may be executable now
+        successor = self.deferred.get(tx.sender, {}).pop(tx.nonce + 1, None)
+        if successor is not None:
+            self.add_transaction(successor)
+        return True
+
+    def candidate(self):
+        """Returns the finalized candidate block"""
+        if self._finalized is None:
+            cs = get_consensus_strategy(self.chain.env.config)
+            snapshot = self.state.snapshot()
+            cs.finalize(self.state, self.block)
+            set_execution_results(self.state, self.block)
+            self._finalized = Block(copy.copy(self.block.header),
+                                    list(self.block.transactions),
+                                    self.block.uncles)
+            self.state.revert(snapshot)
+        return self._finalized
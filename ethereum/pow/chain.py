@@ -17,6 +17,7 @@ from ethereum.config import Env
 from ethereum.state import State, dict_to_prev_header
 from ethereum.block import Block, BlockHeader, BLANK_UNCLES_HASH, FakeHeader
 from ethereum.pow.consensus import initialize
+from ethereum.pow.chain_index import DecodedCache, HeaderStore, NumberIndex
 from ethereum.genesis_helpers import mk_basic_state, state_from_genesis_declaration, \
     initialize_genesis_keys
 from ethereum.db import RefcountDB
@@ -31,8 +32,11 @@ config_string = ':info'  # ,eth.chain:debug'
 class Chain(object):
 
     def __init__(self, genesis=None, env=None,
-                 new_head_cb=None, reset_genesis=False, localtime=None, max_history=1000, **kwargs):
+                 new_head_cb=None, reset_genesis=False, localtime=None, max_history=1000,
+                 index_path=None, block_cache_size=256, **kwargs):
         self.env = env or Env()
+        self.headers = HeaderStore(self.env.db)
+        self.block_cache = DecodedCache(block_cache_size)
         # Initialize the state
         if 'head_hash' in self.db:  # new head tag
             self.state = self.mk_poststate_of_blockhash(
@@ -46,6 +50,7 @@ class Chain(object):
             assert env is None
             self.state = genesis
             self.env = self.state.env
+            self.headers = HeaderStore(self.env.db)
             print('Initializing chain from provided state')
             reset_genesis = True
         elif "extraData" in genesis:
@@ -90,26 +95,30 @@ class Chain(object):
             self.genesis = Block(header)
             self.state.prev_headers[0] = header
             initialize_genesis_keys(self.state, self.genesis)
-        else:
+            self.headers.put(header)
+        # number -> hash of the canonical chain; b'block:%d' keys are
+        # still written, and recover the index if it fell behind
+        self.number_index = NumberIndex(index_path)
+        self.sync_number_index()
+        if not reset_genesis:
             self.genesis = self.get_block_by_number(0)
         self.head_hash = self.state.prev_headers[0].hash
+        self.head_score = self.get_score(self.get_header(self.head_hash))
         self.time_queue = []
         self.parent_queue = {}
         self.localtime = time.time() if localtime is None else localtime
         self.max_history = max_history
+        # the db is committed once this many blocks were added (see commit)
+        self.commit_interval = 1
+        self.uncommitted_blocks = 0
 
     # Head (tip) of the chain
     @property
     def head(self):
-        try:
-            block_rlp = self.db.get(self.head_hash)
-            if block_rlp in ('GENESIS', b'GENESIS'):
-                return self.genesis
-            else:
-                return rlp.decode(block_rlp, Block)
-        except Exception as e:
-            log.error(e)
-            return None
+        block = self.get_block(self.head_hash)
+        if block is None:
+            log.error("Head block not found", hash=encode_hex(self.head_hash))
+        return block
 
     # Returns the post-state of the block
     def mk_poststate_of_blockhash(self, blockhash):
@@ -129,20 +138,26 @@ class Chain(object):
         state.txindex = len(block.transactions)
         state.recent_uncles = {}
         state.prev_headers = []
-        b = block
+        header = block.header
         header_depth = state.config['PREV_HEADER_DEPTH']
         for i in range(header_depth + 1):
-            state.prev_headers.append(b.header)
+            state.prev_headers.append(header)
             if i < 6:
                 state.recent_uncles[state.block_number - i] = []
-                for u in b.uncles:
+                for u in block.uncles:
                     state.recent_uncles[state.block_number - i].append(u.hash)
+            # only the uncles of the last few blocks are needed, the rest
+            # of the walk reads headers alone
             try:
-                b = rlp.decode(state.db.get(b.header.prevhash), Block)
+                if i < 5:
+                    block = rlp.decode(state.db.get(header.prevhash), Block)
+                    header = block.header
+                else:
+                    header = self.headers.get(header.prevhash)
             except BaseException:
                 break
         if i < header_depth:
-            if state.db.get(b.header.prevhash) == 'GENESIS':
+            if state.db.get(header.prevhash) == 'GENESIS':
                 jsondata = json.loads(state.db.get('GENESIS_STATE'))
                 for h in jsondata["prev_headers"][:header_depth - i]:
                     state.prev_headers.append(dict_to_prev_header(h))
@@ -164,19 +179,49 @@ class Chain(object):
 
     # Gets the block with a given blockhash
     def get_block(self, blockhash):
+        block = self.block_cache.get(blockhash)
+        if block is not None:
+            return block
         try:
             block_rlp = self.db.get(blockhash)
-            if block_rlp == 'GENESIS':
+            if block_rlp in ('GENESIS', b'GENESIS'):
                 if not hasattr(self, 'genesis'):
                     self.genesis = rlp.decode(
                         self.db.get('GENESIS_RLP'), sedes=Block)
                 return self.genesis
             else:
-                return rlp.decode(block_rlp, Block)
+                block = rlp.decode(block_rlp, Block)
+                self.block_cache.put(blockhash, block)
+                self.headers.remember(block.header)
+                return block
         except Exception as e:
             log.debug("Failed to get block", hash=blockhash, error=e)
             return None
 
+    # Gets the header of the block with a given blockhash, without decoding
+    # the block's body where the header store has it
+    def get_header(self, blockhash):
+        try:
+            return self.headers.get(blockhash)
+        except KeyError:
+            block = self.get_block(blockhash)
+            return block.header if block else None
+
+    # Gets up to `count` canonical headers from block number `start`, every
+    # `skip + 1`th one, going down instead if `reverse` (as asked by peers)
+    def get_headers(self, start, count, skip=0, reverse=False):
+        step = -(skip + 1) if reverse else skip + 1
+        headers = []
+        for number in range(start, start + step * count, step):
+            if number < 0:
+                break
+            blockhash = self.get_blockhash_by_number(number)
+            header = self.get_header(blockhash) if blockhash else None
+            if header is None:
+                break
+            headers.append(header)
+        return headers
+
     # Add a record allowing you to later look up the provided block's
     # parent hash and see that it is one of its children
     def add_child(self, child):
@@ -194,11 +239,31 @@ class Chain(object):
 
     # Gets the hash of the block with the given block number
     def get_blockhash_by_number(self, number):
+        blockhash = self.number_index.get(number)
+        if blockhash is not None:
+            return blockhash
         try:
             return self.db.get(b'block:%d' % number)
         except BaseException:
             return None
 
+    # Brings the number index in line with the b'block:%d' keys, which are
+    # only committed with the rest of a block; entries written ahead of an
+    # interrupted commit are dropped and missing ones filled in
+    def sync_number_index(self):
+        index = self.number_index
+        n = len(index) - 1
+        while n >= 0 and index.get(n) is not None:
+            key = b'block:%d' % n
+            if key in self.db and self.db.get(key) == index.get(n):
+                break
+            n -= 1
+        index.truncate(n + 1)
+        n = len(index)
+        while b'block:%d' % n in self.db:
+            index.set(n, self.db.get(b'block:%d' % n))
+            n += 1
+
     # Gets the block with the given block number
     def get_block_by_number(self, number):
         return self.get_block(self.get_blockhash_by_number(number))
@@ -222,17 +287,60 @@ class Chain(object):
             block = block.hash
         return [self.get_block(h) for h in self.get_child_hashes(block)]
 
-    # Get the score (AKA total difficulty in PoW) of a given block
+    # Get the accounts a block changed, as (address, (rlp before, rlp
+    # after)) pairs, or None if no diff is kept for the block
+    def get_state_diff(self, blockhash):
+        key = b'diff:' + blockhash
+        if key not in self.db:
+            return None
+        return [(addr, (before, after)) for addr, before, after in
+                rlp.decode(self.db.get(key))]
+
+    # Get the account RLPs the flat address table must hold after a reorg
+    # from `old_blocks` to `new_blocks`, the last of which, `block`, made
+    # the changes `changed` ending in `post_state`. The old chain's diffs
+    # are undone newest first, so that each account ends up as it was at
+    # the common ancestor, then the new chain's are redone oldest first.
+    # Blocks stored before diffs were recorded only list the addresses they
+    # changed, under b'changed:'; those accounts are read from `post_state`.
+    # Returns None if a block has neither, as once pruned by max_history.
+    def _reorg_accounts(self, old_blocks, new_blocks, block, changed,
+                        post_state):
+        accounts = {}
+        from_trie = set()
+        for b, undo in [(b, True) for b in reversed(old_blocks)] + \
+                [(b, False) for b in new_blocks]:
+            if b is block:
+                diff = changed.items()
+            else:
+                diff = self.get_state_diff(b.header.hash)
+            if diff is not None:
+                for addr, (before, after) in diff:
+                    accounts[addr] = before if undo else after
+            elif b'changed:' + b.header.hash in self.db:
+                acct_list = self.db.get(b'changed:' + b.header.hash)
+                for j in range(0, len(acct_list), 20):
+                    from_trie.add(acct_list[j: j + 20])
+            else:
+                return None
+        for addr in from_trie:
+            accounts[addr] = post_state.trie.get(addr) or b''
+        return accounts
+
+    # Get the score (AKA total difficulty in PoW) of a given block. add_block
+    # stores each block's score as it arrives, from its parent's, so this is
+    # a single lookup; the walk only fills in blocks stored without one
     def get_score(self, block):
         if not block:
             return 0
-        key = b'score:' + block.header.hash
+        header = block.header if isinstance(block, Block) else block
+        key = b'score:' + header.hash
 
         fills = []
         while key not in self.db:
-            fills.insert(0, (block.header.hash, block.difficulty))
-            key = b'score:' + block.header.prevhash
-            block = self.get_parent(block)
+            fills.insert(0, (header.hash, header.difficulty))
+            key = b'score:' + header.prevhash
+            header = self.get_header(header.prevhash)
         score = int(self.db.get(key))
         for h, d in fills:
             key = b'score:' + h
@@ -281,9 +389,9 @@ class Chain(object):
                          (block.number, encode_hex(block.header.hash[:4]), encode_hex(block.header.prevhash[:4]), str(e)))
                 return False
             self.db.put(b'block:%d' % block.header.number, block.header.hash)
-            # side effect: put 'score:' cache in db
-            block_score = self.get_score(block)
+            self.number_index.set(block.header.number, block.header.hash)
             self.head_hash = block.header.hash
+            self.head_score = self.get_score(block)
             for i, tx in enumerate(block.transactions):
                 self.db.put(b'txindex:' +
                             tx.hash, rlp.encode([block.number, i]))
@@ -308,7 +416,7 @@ class Chain(object):
             block_score = self.get_score(block)
             changed = temp_state.changed
             # If the block should be the new head, replace the head
-            if block_score > self.get_score(self.head):
+            if block_score > self.head_score:
                 b = block
                 new_chain = {}
                 # Find common ancestor
@@ -324,74 +432,61 @@ class Chain(object):
                         break
                     b = self.get_parent(b)
                 replace_from = b.header.number
-                # Replace block index and tx indices, and edit the state cache
-
-                # Get a list of all accounts that have been edited along the old and
-                # new chains
-                changed_accts = {}
-                # Read: for i in range(common ancestor block number...new block
-                # number)
+                # Blocks leaving and joining the main chain, in order
+                old_blocks, new_blocks = [], []
                 for i in itertools.count(replace_from):
-                    log.info('Rewriting height %d' % i)
-                    key = b'block:%d' % i
-                    # Delete data for old blocks
-                    orig_at_height = self.db.get(
-                        key) if key in self.db else None
+                    orig_at_height = self.get_blockhash_by_number(i)
+                    new_block_at_height = new_chain.get(i)
+                    if not orig_at_height and new_block_at_height is None:
+                        break
+                    if new_block_at_height is not None and \
+                            new_block_at_height.header.hash == orig_at_height:
+                        continue
                     if orig_at_height:
-                        orig_block_at_height = self.get_block(orig_at_height)
-                        log.info(
-                            '%s no longer in main chain' %
-                            encode_hex(
-                                orig_block_at_height.header.hash))
-                        # Delete from block index
-                        self.db.delete(key)
-                        # Delete from txindex
-                        for tx in orig_block_at_height.transactions:
+                        old_blocks.append(self.get_block(orig_at_height))
+                    if new_block_at_height is not None:
+                        new_blocks.append(new_block_at_height)
+                # Work out the account changes before writing anything, so
+                # that a reorg that can't be done leaves the db untouched
+                accounts = self._reorg_accounts(old_blocks, new_blocks, block,
+                                                changed, temp_state)
+                if accounts is None:
+                    log.error('Cannot reorganise to %s: the state diffs of '
+                              'blocks it replaces are gone, keeping head %s' %
+                              (encode_hex(block.header.hash[:4]),
+                               encode_hex(self.head_hash[:4])))
+                else:
+                    # Replace block index and tx indices, and edit the state
+                    # cache
+                    for b in old_blocks:
+                        log.info('%s no longer in main chain' %
+                                 encode_hex(b.header.hash))
+                        self.db.delete(b'block:%d' % b.header.number)
+                        for tx in b.transactions:
                             if b'txindex:' + tx.hash in self.db:
                                 self.db.delete(b'txindex:' + tx.hash)
-                        # Add to changed list
-                        acct_list = self.db.get(
-                            b'changed:' + orig_block_at_height.hash)
-                        for j in range(0, len(acct_list), 20):
-                            changed_accts[acct_list[j: j + 20]] = True
-                    # Add data for new blocks
-                    if i in new_chain:
-                        new_block_at_height = new_chain[i]
-                        log.info(
-                            '%s now in main chain' %
-                            encode_hex(
-                                new_block_at_height.header.hash))
-                        # Add to block index
-                        self.db.put(key, new_block_at_height.header.hash)
-                        # Add to txindex
-                        for j, tx in enumerate(
-                                new_block_at_height.transactions):
+                    for b in new_blocks:
+                        log.info('%s now in main chain' %
+                                 encode_hex(b.header.hash))
+                        self.db.put(b'block:%d' % b.header.number,
+                                    b.header.hash)
+                        for j, tx in enumerate(b.transactions):
                             self.db.put(b'txindex:' + tx.hash,
-                                        rlp.encode([new_block_at_height.number, j]))
-                        # Add to changed list
-                        if i < b.number:
-                            acct_list = self.db.get(
-                                b'changed:' + new_block_at_height.hash)
-                            for j in range(0, len(acct_list), 20):
-                                changed_accts[acct_list[j: j + 20]] = True
-                    if i not in new_chain and not orig_at_height:
-                        break
-                # Add changed list from new head to changed list
-                for c in changed.keys():
-                    changed_accts[c] = True
-                # Update the on-disk state cache
-                for addr in changed_accts.keys():
-                    data = temp_state.trie.get(addr)
-                    if data:
-                        self.state.db.put(b'address:' + addr, data)
-                    else:
-                        try:
-                            self.state.db.delete(b'address:' + addr)
-                        except KeyError:
-                            pass
-                self.head_hash = block.header.hash
-                self.state = temp_state
-                self.state.executing_on_head = True
+                                        rlp.encode([b.header.number, j]))
+                    for addr, data in accounts.items():
+                        if data:
+                            self.db.put(b'address:' + addr, data)
+                        elif b'address:' + addr in self.db:
+                            self.db.delete(b'address:' + addr)
+                    if old_blocks:
+                        self.number_index.truncate(
+                            old_blocks[0].header.number)
+                    for b in new_blocks:
+                        self.number_index.set(b.header.number, b.header.hash)
+                    self.head_hash = block.header.hash
+                    self.head_score = block_score
+                    self.state = temp_state
+                    self.state.executing_on_head = True
         # Block has no parent yet
         else:
             if block.header.prevhash not in self.parent_queue:
@@ -403,8 +498,10 @@ class Chain(object):
         self.add_child(block)
         self.db.put('head_hash', self.head_hash)
         self.db.put(block.hash, rlp.encode(block))
-        self.db.put(b'changed:' + block.hash,
-                    b''.join([k.encode() if not is_string(k) else k for k in list(changed.keys())]))
+        self.headers.put(block.header)
+        self.db.put(b'diff:' + block.hash, rlp.encode(
+            [[k if is_string(k) else k.encode(), before, after]
+             for k, (before, after) in changed.items()]))
         print('Saved %d address change logs' % len(changed.keys()))
         self.db.put(b'deletes:' + block.hash, b''.join(deletes))
         log.debug('Saved %d trie node deletes for block %d (%s)' %
@@ -422,11 +519,15 @@ class Chain(object):
                 for i in range(0, len(deletes), 32):
                     rdb.delete(deletes[i: i + 32])
                 self.db.delete(b'deletes:' + old_block_hash)
-                self.db.delete(b'changed:' + old_block_hash)
+                self.db.delete(b'diff:' + old_block_hash)
+                if b'changed:' + old_block_hash in self.db:
+                    self.db.delete(b'changed:' + old_block_hash)
             except KeyError as e:
                 print(e)
                 pass
-        self.db.commit()
+        self.uncommitted_blocks += 1
+        if self.uncommitted_blocks >= self.commit_interval:
+            self.commit()
         assert (b'deletes:' + block.hash) in self.db
         log.info('Added block %d (%s) with %d txs and %d gas' %
                  (block.header.number, encode_hex(block.header.hash)[:8],
@@ -442,18 +543,17 @@ class Chain(object):
             del self.parent_queue[block.header.hash]
         return True
 
+    # Commits the writes of the blocks added since the last commit
+    def commit(self):
+        self.db.commit()
+        self.uncommitted_blocks = 0
+
     def __contains__(self, blk):
         if isinstance(blk, (str, bytes)):
-            try:
-                blk = rlp.decode(self.db.get(blk), Block)
-            except BaseException:
+            blk = self.get_header(blk)
+            if blk is None:
                 return False
-        try:
-            o = self.get_block(self.get_blockhash_by_number(blk.number)).hash
-            assert o == blk.hash
-            return True
-        except Exception as e:
-            return False
+        return self.get_blockhash_by_number(blk.number) == blk.hash
 
     def has_block(self, block):
         return block in self
@@ -471,6 +571,17 @@ class Chain(object):
                 return chain
             chain.append(self.get_block(h))
 
+    # Same as get_chain, but returns the headers and decodes no block bodies
+    def get_header_chain(self, frm=None, to=2**63 - 1):
+        if frm is None:
+            frm = int(self.db.get('GENESIS_NUMBER')) + 1
+        headers = []
+        for i in itertools.islice(itertools.count(), frm, to):
+            h = self.get_blockhash_by_number(i)
+            if not h:
+                return headers
+            headers.append(self.get_header(h))
+
     # Get block number and transaction index
     def get_tx_position(self, tx):
         if not isinstance(tx, (str, bytes)):
@@ -497,24 +608,33 @@ class Chain(object):
             output.append(b)
         return output
 
+    # Get the headers of a block's descendants, the block's own included,
+    # without decoding any block bodies
+    def get_descendant_headers(self, header):
+        output = []
+        headers = [header]
+        while len(headers):
+            h = headers.pop()
+            headers.extend(self.get_header(c)
+                           for c in self.get_child_hashes(h.hash))
+            output.append(h)
+        return output
+
     @property
     def db(self):
         return self.env.db
 
     # Get blockhashes starting from a hash and going backwards
     def get_blockhashes_from_hash(self, hash, max):
-        block = self.get_block(hash)
-        if block is None:
+        header = self.get_header(hash)
+        if header is None:
             return []
 
-        header = block.header
         hashes = []
-        for i in xrange(max):
-            hash = header.prevhash
-            block = self.get_block(hash)
-            if block is None:
+        for i in range(max):
+            header = self.get_header(header.prevhash)
+            if header is None:
                 break
-            header = block.header
             hashes.append(header.hash)
             if header.number == 0:
                 break
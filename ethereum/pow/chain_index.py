@@ -0,0 +1,152 @@
+import os
+from collections import OrderedDict
+
+import rlp
+
+from ethereum.block import Block, BlockHeader
+
+
+class DecodedCache(object):
+
+    """
+    LRU cache of decoded objects (blocks, headers) keyed by hash, counting
+    hits and misses. Decoded RLP objects are immutable, so the cached ones
+    are handed out as they are.
+    """
+
+    def __init__(self, max_items):
+        self.items = OrderedDict()
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key):
+        """Returns the object at `key`, or None"""
+        obj = self.items.pop(key, None)
+        if obj is None:
+            self.misses += 1
+            return None
+        self.items[key] = obj  # pop and append at end
+        self.hits += 1
+        return obj
+
+    def put(self, key, obj):
+        self.items.pop(key, None)
+        self.items[key] = obj
+        if len(self.items) > self.max_items:
+            self.items.popitem(last=False)
+
+    def clear(self):
+        self.items.clear()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hit_rate, 'entries': len(self.items)}
+
+
+class HeaderStore(object):
+
+    """
+    Block headers kept apart from the block bodies, under b'header:' + hash,
+    with an LRU cache in front, so that ancestry walks and header requests
+    never decode transaction lists. Blocks stored before their header was
+    can still be read, by decoding them in full once.
+    """
+
+    def __init__(self, db, max_items=4096):
+        self.db = db
+        self.cache = DecodedCache(max_items)
+
+    def put(self, header):
+        self.db.put(b'header:' + header.hash, rlp.encode(header))
+        self.remember(header)
+
+    def remember(self, header):
+        """Caches a header that was decoded elsewhere, eg. with its block"""
+        self.cache.put(header.hash, header)
+
+    def get(self, blockhash):
+        """Returns the header of `blockhash`, or raises KeyError"""
+        header = self.cache.get(blockhash)
+        if header is not None:
+            return header
+        key = b'header:' + blockhash
+        if key in self.db:
+            header = rlp.decode(self.db.get(key), BlockHeader)
+        else:
+            try:
+                header = rlp.decode(self.db.get(blockhash), Block).header
+            except (rlp.DecodingError, rlp.DeserializationError):
+                # not a block, eg. the genesis marker
+                raise KeyError(blockhash)
+        self.remember(header)
+        return header
+
+
+class NumberIndex(object):
+
+    """
+    Canonical block number -> hash table of fixed-width 32 byte slots, the
+    hash of block n sitting at offset 32 * n and unknown numbers being left
+    zero. It is appended to as the chain grows and truncated back to the
+    fork point on a reorg. If `path` is given, the table is kept in that
+    file as well as in memory and reloaded from it on startup.
+    """
+
+    WIDTH = 32
+    EMPTY = b'\x00' * WIDTH
+
+    def __init__(self, path=None):
+        self.file = None
+        self.table = bytearray()
+        if path is not None:
+            mode = 'r+b' if os.path.exists(path) else 'w+b'
+            self.file = open(path, mode)
+            self.table = bytearray(self.file.read())
+            # drop a partially written last slot
+            self.truncate(len(self))
+
+    def __len__(self):
+        return len(self.table) // self.WIDTH
+
+    def get(self, number):
+        if number < 0 or number >= len(self):
+            return None
+        blockhash = bytes(self.table[number * self.WIDTH: (number + 1) * self.WIDTH])
+        return blockhash if blockhash != self.EMPTY else None
+
+    def set(self, number, blockhash):
+        """Sets the hash at `number`, dropping any entries above it"""
+        assert len(blockhash) == self.WIDTH
+        self.truncate(number)
+        self.table += self.EMPTY * (number - len(self)) + blockhash
+        if self.file is not None:
+            self.file.seek(number * self.WIDTH)
+            self.file.write(blockhash)
+            self.file.flush()
+
+    def truncate(self, number):
+        """Drops the entries at `number` and above"""
+        size = max(number, 0) * self.WIDTH
+        if size >= len(self.table):
+            return
+        del self.table[size:]
+        if self.file is not None:
+            self.file.truncate(size)
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -1,27 +1,30 @@
 import copy
+import multiprocessing
 import sys
 
+from ethereum import utils
+from ethereum.pow.ethash_utils import *
 
-if sys.version_info.major == 2:
-    from repoze.lru import lru_cache
-else:
-    from functools import lru_cache
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 cache_seeds = [b'\x00' * 32]
 
 
-def mkcache(block_number):
+def get_seed(block_number):
     while len(cache_seeds) <= block_number // EPOCH_LENGTH:
-        cache_seeds.append(sha3.sha3_256(cache_seeds[-1]).digest())
+        cache_seeds.append(utils.sha3(cache_seeds[-1]))
+    return cache_seeds[block_number // EPOCH_LENGTH]
 
-    seed = cache_seeds[block_number // EPOCH_LENGTH]
 
+def mkcache(block_number):
     n = get_cache_size(block_number) // HASH_BYTES
-    return _get_cache(seed, n)
+    return _get_cache(get_seed(block_number), n)
 
 
-@lru_cache(5)
 def _get_cache(seed, n):
     # Sequentially produce the initial dataset
     o = [sha3_512(seed)]
@@ -48,16 +51,147 @@ def calc_dataset_item(cache, i):
     return sha3_512(mix)
 
 
-def calc_dataset(full_size, cache):
-    o = []
-    percent = (full_size // HASH_BYTES) // 100
-    for i in range(full_size // HASH_BYTES):
-        if i % percent == 0:
-            sys.stderr.write(
-                "Completed %d items, %d percent\n" %
-                (i, i // percent))
-        o.append(calc_dataset_item(cache, i))
-    return o
+# Vectorised ethash on numpy arrays. Caches and datasets are (items x 16)
+# uint32 arrays, so that a step of the mix is a single FNV over arrays.
+
+def item_array(items):
+    """
+    Returns a cache or dataset, given as a list of items or serialized
+    (eg. an mmap), as an (items x 16) uint32 array. Serialized data is
+    viewed, not copied.
+    """
+    if isinstance(items, numpy.ndarray):
+        return items
+    if isinstance(items, ListWrapper):
+        items = items.data
+    elif isinstance(items, list):
+        return numpy.array(items, dtype='<u4')
+    return numpy.frombuffer(items, dtype='<u4').reshape(
+        -1, HASH_BYTES // WORD_BYTES)
+
+
+def fnv_array(v1, v2):
+    return v1 * numpy.uint32(FNV_PRIME) ^ v2
+
+
+def _words(data, count):
+    return numpy.frombuffer(data, dtype='<u4').reshape(count, -1)
+
+
+def _hash_rows(h, rows):
+    return _words(b''.join([h(row.tobytes()) for row in rows.astype('<u4')]),
+                  len(rows))
+
+
+def calc_dataset_items(cache, indices):
+    """calc_dataset_item for an array of indices at once, one row per item"""
+    n = len(cache)
+    r = HASH_BYTES // WORD_BYTES
+    indices = numpy.asarray(indices, dtype=numpy.uint32)
+    mix = cache[indices % n]
+    mix[:, 0] ^= indices
+    mix = _hash_rows(keccak_512, mix).copy()
+    # the FNV multiplications of the parent indices don't depend on the mix
+    parent_seeds = (indices[:, None] ^ numpy.arange(
+        DATASET_PARENTS, dtype=numpy.uint32)) * numpy.uint32(FNV_PRIME)
+    prime, n = numpy.uint32(FNV_PRIME), numpy.uint32(n)
+    for j in range(DATASET_PARENTS):
+        parents = (parent_seeds[:, j] ^ mix[:, j % r]) % n
+        mix *= prime
+        mix ^= cache.take(parents, axis=0)
+    return _hash_rows(keccak_512, mix)
+
+
+def hashimoto_batch(header, nonces, full_size, dataset_rows):
+    """
+    hashimoto for a list of nonces at once, either all for `header` or, if
+    it is a list, each for its own header. `dataset_rows(indices)` returns
+    the dataset items at an array of indices as an (items x 16) array.
+    """
+    n = full_size // HASH_BYTES
+    w = MIX_BYTES // WORD_BYTES
+    mixhashes = MIX_BYTES // HASH_BYTES
+    headers = header if isinstance(header, list) else [header] * len(nonces)
+    s = _words(b''.join([keccak_512(h + nonce[::-1])
+                         for h, nonce in zip(headers, nonces)]), len(nonces))
+    mix = numpy.tile(s, (1, mixhashes))
+    offsets = numpy.arange(mixhashes, dtype=numpy.uint32)
+    for i in range(ACCESSES):
+        p = fnv_array(s[:, 0] ^ numpy.uint32(i), mix[:, i % w]) \
+            % (n // mixhashes) * mixhashes
+        newdata = dataset_rows((p[:, None] + offsets).ravel())
+        mix = fnv_array(mix, newdata.reshape(mix.shape))
+    mix = mix.reshape(len(nonces), -1, 4)
+    cmix = fnv_array(fnv_array(fnv_array(
+        mix[:, :, 0], mix[:, :, 1]), mix[:, :, 2]), mix[:, :, 3])
+    results = _hash_rows(keccak_256, numpy.hstack([s, cmix]))
+    return [{
+        b"mix digest": c.astype('<u4').tobytes(),
+        b"result": result.tobytes()
+    } for c, result in zip(cmix, results)]
+
+
+# Cache of the dataset worker processes, installed by _init_dataset_worker
+_worker_cache = None
+
+
+def _init_dataset_worker(cache_bytes):
+    global _worker_cache
+    if numpy is not None:
+        _worker_cache = item_array(cache_bytes)
+    else:
+        _worker_cache = deserialize_cache(cache_bytes)
+
+
+def _calc_dataset_chunk(bounds):
+    start, end = bounds
+    if numpy is not None:
+        return start, calc_dataset_items(
+            _worker_cache, numpy.arange(start, end)).tobytes()
+    return start, b''.join([serialize_hash(calc_dataset_item(_worker_cache, i))
+                            for i in range(start, end)])
+
+
+def calc_dataset(full_size, cache, out=None, processes=None,
+                 chunk_items=4096):
+    """
+    Computes the full dataset into `out`, a writable buffer of `full_size`
+    bytes such as an mmap (a bytearray is allocated if None), and returns
+    it wrapped in a ListWrapper, or as an item_array if numpy is installed.
+    Items are independent of each other, so chunks of them are spread over
+    a pool of `processes` workers (all cores if None), each of which gets
+    the cache once.
+    """
+    n = full_size // HASH_BYTES
+    if out is None:
+        out = bytearray(full_size)
+    if isinstance(cache, bytes):  # pyethash's
+        cache_bytes = cache
+    elif numpy is not None and isinstance(cache, numpy.ndarray):
+        cache_bytes = cache.astype('<u4').tobytes()
+    else:
+        cache_bytes = serialize_cache(cache)
+    chunks = [(i, min(i + chunk_items, n)) for i in range(0, n, chunk_items)]
+    if processes == 1:
+        _init_dataset_worker(cache_bytes)
+        results = map(_calc_dataset_chunk, chunks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes, _init_dataset_worker,
+                                    (cache_bytes,))
+        results = pool.imap_unordered(_calc_dataset_chunk, chunks)
+    try:
+        for done, (start, data) in enumerate(results, 1):
+            out[start * HASH_BYTES: start * HASH_BYTES + len(data)] = data
+            if done % max(len(chunks) // 100, 1) == 0:
+                sys.stderr.write("Completed %d of %d chunks\n" %
+                                 (done, len(chunks)))
+    finally:
+        if pool is not None:
+            pool.terminate()
+    if numpy is not None:
+        return item_array(out)
+    return ListWrapper(out)
 
 
 def hashimoto(header, nonce, full_size, dataset_lookup):
@@ -78,17 +212,31 @@ def hashimoto(header, nonce, full_size, dataset_lookup):
     for i in range(0, len(mix), 4):
         cmix.append(fnv(fnv(fnv(mix[i], mix[i + 1]), mix[i + 2]), mix[i + 3]))
     return {
-        "mix digest": serialize_hash(cmix),
-        "result": serialize_hash(sha3_256(s + cmix))
+        b"mix digest": serialize_hash(cmix),
+        b"result": serialize_hash(sha3_256(s + cmix))
     }
 
 
 def hashimoto_light(block_number, cache, header, nonce):
+    if numpy is not None:
+        return hashimoto_light_batch(block_number, cache, header, [nonce])[0]
     return hashimoto(header, nonce, get_full_size(block_number),
                      lambda x: calc_dataset_item(cache, x))
 
 
+def hashimoto_light_batch(block_number, cache, header, nonces):
+    cache = item_array(cache)
+    return hashimoto_batch(header, nonces, get_full_size(block_number),
+                           lambda indices: calc_dataset_items(cache, indices))
+
+
 def hashimoto_full(dataset, header, nonce):
+    # a dataset held as lists would have to be converted on every call
+    if numpy is not None and (not isinstance(dataset, list) or
+                              isinstance(dataset, ListWrapper)):
+        dataset = item_array(dataset)
+        return hashimoto_batch(header, [nonce], len(dataset) * HASH_BYTES,
+                               lambda indices: dataset[indices])[0]
     return hashimoto(header, nonce, len(dataset) * HASH_BYTES,
                      lambda x: dataset[x])
 
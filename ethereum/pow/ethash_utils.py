@@ -1,17 +1,18 @@
 try:
     from Crypto.Hash import keccak
 
-    def sha3_256(x): return keccak.new(digest_bits=256, data=x).digest()
+    def keccak_256(x): return keccak.new(digest_bits=256, data=x).digest()
 
-    def sha3_512(x): return keccak.new(digest_bits=512, data=x)
-except BaseException:
+    def keccak_512(x): return keccak.new(digest_bits=512, data=x).digest()
+except ImportError:
     import sha3 as _sha3
 
-    def sha3_256(x): return _sha3.sha3_256(x).digest()
+    def keccak_256(x): return _sha3.keccak_256(x).digest()
 
-    def sha3_512(x): return _sha3.sha3_512(x).digest()
+    def keccak_512(x): return _sha3.keccak_512(x).digest()
 from rlp.utils import decode_hex
 from ethereum.utils import encode_hex
+import struct
 import sys
 
 WORD_BYTES = 4                    # bytes in word
@@ -49,12 +50,11 @@ def zpad(s, length):
 
 
 def serialize_hash(h):
-    return b''.join([zpad(encode_int(x), 4) for x in h])
+    return struct.pack('<%dI' % len(h), *h)
 
 
 def deserialize_hash(h):
-    return [decode_int(h[i:i + WORD_BYTES])
-            for i in range(0, len(h), WORD_BYTES)]
+    return list(struct.unpack('<%dI' % (len(h) // WORD_BYTES), h))
 
 
 def hash_words(h, sz, x):
@@ -72,11 +72,11 @@ def to_bytes(x):
 
 # sha3 hash function, outputs 64 bytes
 def sha3_512(x):
-    return hash_words(sha3_512(to_bytes(v)).digest(), 64, x)
+    return hash_words(lambda v: keccak_512(to_bytes(v)), 64, x)
 
 
 def sha3_256(x):
-    return hash_words(sha3_256(to_bytes(v)).digest(), 32, x)
+    return hash_words(lambda v: keccak_256(to_bytes(v)), 32, x)
 
 
 def xor(a, b):
@@ -1,20 +1,17 @@
-from ethereum.pow import ethash
+from ethereum.pow import ethash, ethash_utils
 from ethereum import utils
+import mmap
+import multiprocessing
+import os
 import time
-import sys
+import threading
 import warnings
-from collections import OrderedDict
-from ethereum import utils
+from collections import OrderedDict, deque
 from ethereum.slogging import get_logger
 import rlp
 
 log = get_logger('eth.pow')
 
-if sys.version_info.major == 2:
-    from repoze.lru import lru_cache
-else:
-    from functools import lru_cache
-
 try:
     import pyethash
     ETHASH_LIB = 'pyethash'  # the C++ based implementation
@@ -35,30 +32,181 @@ elif ETHASH_LIB == 'pyethash':
 else:
     raise Exception("invalid ethash library set")
 
+# Whether the pure python ethash runs vectorised on numpy arrays
+VECTORIZED = ETHASH_LIB == 'ethash' and ethash.numpy is not None
+# Nonces tried per vectorised hashimoto call when mining
+MINE_BATCH = 64
+
 TT64M1 = 2**64 - 1
-cache_seeds = ['\x00' * 32]
+ETHASH_REVISION = 23
 cache_by_seed = OrderedDict()
 cache_by_seed.max_items = 10
+# The LRUs here are shared with the block importer's preparing thread
+_lru_lock = threading.Lock()
+
+
+def _lru_get(lru, key):
+    with _lru_lock:
+        value = lru.pop(key, None)  # pop and append at end
+        if value is not None:
+            lru[key] = value
+        return value
+
+
+def _lru_put(lru, key, value):
+    with _lru_lock:
+        lru[key] = value
+        if len(lru) > lru.max_items:
+            # remove last recently accessed
+            lru.popitem(last=False)
 
 
 def get_cache(block_number):
-    import sha3
-    while len(cache_seeds) <= block_number // EPOCH_LENGTH:
-        cache_seeds.append(utils.sha3(cache_seeds[-1]))
-    seed = cache_seeds[block_number // EPOCH_LENGTH]
-    if seed in cache_by_seed:
-        c = cache_by_seed.pop(seed)  # pop and append at end
-        cache_by_seed[seed] = c
+    seed = ethash.get_seed(block_number)
+    c = _lru_get(cache_by_seed, seed)
+    if c is not None:
         return c
-    c = mkcache(block_number)
-    cache_by_seed[seed] = c
-    if len(cache_by_seed) > cache_by_seed.max_items:
-        # remove last recently accessed
-        cache_by_seed.pop(cache_by_seed.keys()[0])
+    if store is not None:
+        c = store.get_cache(block_number)
+    else:
+        c = mkcache(block_number)
+        if VECTORIZED:
+            c = ethash.item_array(c)
+    _lru_put(cache_by_seed, seed, c)
     return c
 
 
-@lru_cache(maxsize=32)
+def _write_file(path, data):
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.rename(tmp, path)  # readers never see a partial file
+
+
+def _generate_cache_file(path, block_number):
+    c = mkcache(block_number)
+    if not isinstance(c, bytes):
+        c = ethash_utils.serialize_cache(c)
+    _write_file(path, c)
+
+
+class EthashStore(object):
+
+    """
+    Keeps epoch caches and datasets as files under `directory`, named after
+    the ethash revision and the epoch seed so that they survive restarts
+    and files of another revision are never picked up. Files are mapped
+    into memory rather than read. Generation runs on a pool of `processes`
+    workers, which also pregenerates the cache of the next epoch in the
+    background whenever one is loaded.
+    """
+
+    def __init__(self, directory, processes=None, pregenerate=True):
+        self.directory = directory
+        self.processes = processes
+        self.pregenerate = pregenerate
+        self.pending = {}
+        self._pool = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.processes)
+        return self._pool
+
+    def path(self, kind, block_number):
+        return os.path.join(self.directory, '%s-R%d-%s' % (
+            kind, ETHASH_REVISION,
+            utils.encode_hex(ethash.get_seed(block_number)[:8])))
+
+    @staticmethod
+    def is_complete(path, size):
+        return os.path.exists(path) and os.path.getsize(path) == size
+
+    def load(self, path, size):
+        """Maps the file at `path` if it is complete, returns None otherwise"""
+        if not self.is_complete(path, size):
+            return None
+        with open(path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def generate_cache(self, block_number):
+        """
+        Starts generating the cache of `block_number`'s epoch, unless a
+        complete file has it; a truncated one is replaced
+        """
+        path = self.path('cache', block_number)
+        size = ethash_utils.get_cache_size(block_number)
+        if path not in self.pending and not self.is_complete(path, size):
+            self.pending[path] = self.pool.apply_async(
+                _generate_cache_file, (path, block_number))
+
+    def get_cache(self, block_number):
+        path = self.path('cache', block_number)
+        size = ethash_utils.get_cache_size(block_number)
+        data = self.load(path, size)
+        if data is None:
+            self.generate_cache(block_number)
+            self.pending.pop(path).get()
+            data = self.load(path, size)
+        self.pending.pop(path, None)
+        if self.pregenerate:
+            self.generate_cache(block_number + EPOCH_LENGTH)
+        if ETHASH_LIB == 'pyethash':
+            return data[:]
+        if VECTORIZED:
+            return ethash.item_array(data)
+        return ethash_utils.deserialize_cache(data)
+
+    def get_dataset(self, block_number):
+        """Returns the full dataset, generating and storing it if needed"""
+        path = self.path('full', block_number)
+        size = ethash_utils.get_full_size(block_number)
+        data = self.load(path, size)
+        if data is None:
+            cache = self.get_cache(block_number)
+            tmp = '%s.%d.tmp' % (path, os.getpid())
+            with open(tmp, 'w+b') as f:
+                f.truncate(size)
+                out = mmap.mmap(f.fileno(), size)
+                ethash.calc_dataset(size, cache, out, self.processes)
+                out.flush()
+            os.rename(tmp, path)
+            data = self.load(path, size)
+        if VECTORIZED:
+            return ethash.item_array(data)
+        return ethash_utils.ListWrapper(data)
+
+
+store = None
+
+
+def set_ethash_dir(directory, processes=None, pregenerate=True):
+    """
+    Stores ethash caches and datasets under `directory` and generates them
+    on a process pool; None goes back to computing them in memory.
+    """
+    global store
+    store = EthashStore(directory, processes, pregenerate) \
+        if directory is not None else None
+
+
+# Outcomes of seal checks, keyed by the arguments of check_pow
+pow_cache = OrderedDict()
+pow_cache.max_items = 4096
+# Seals verified per vectorised hashimoto call by verify_headers_pow
+VERIFY_BATCH = 64
+
+
+def _seal_ok(mining_output, mixhash, difficulty):
+    if mining_output[b'mix digest'] != mixhash:
+        return False
+    return utils.big_endian_to_int(
+        mining_output[b'result']) <= 2**256 // (difficulty or 1)
+
+
 def check_pow(block_number, header_hash, mixhash, nonce, difficulty):
     """Check if the proof-of-work of the block is valid.
 
@@ -70,14 +218,75 @@ def check_pow(block_number, header_hash, mixhash, nonce, difficulty):
     log.debug('checking pow', block_number=block_number)
     if len(mixhash) != 32 or len(header_hash) != 32 or len(nonce) != 8:
         return False
+    seal = (block_number, header_hash, mixhash, nonce, difficulty)
+    ok = _lru_get(pow_cache, seal)
+    if ok is not None:
+        return ok
 
     # Grab current cache
     cache = get_cache(block_number)
     mining_output = hashimoto_light(block_number, cache, header_hash, nonce)
-    if mining_output[b'mix digest'] != mixhash:
-        return False
-    return utils.big_endian_to_int(
-        mining_output[b'result']) <= 2**256 // (difficulty or 1)
+    ok = _seal_ok(mining_output, mixhash, difficulty)
+    _lru_put(pow_cache, seal, ok)
+    return ok
+
+
+def _verify_seals(seals):
+    # seals of one epoch
+    block_number = seals[0][0]
+    cache = get_cache(block_number)
+    if VECTORIZED:
+        outputs = ethash.hashimoto_light_batch(
+            block_number, cache, [s[1] for s in seals], [s[3] for s in seals])
+    else:
+        outputs = [hashimoto_light(block_number, cache, s[1], s[3])
+                   for s in seals]
+    return [_seal_ok(o, s[2], s[4]) for o, s in zip(outputs, seals)]
+
+
+def verify_headers_pow(headers, processes=1):
+    """
+    Checks the proof of work of many headers at once, eg. during header
+    sync ahead of executing their blocks, and returns a bool per header.
+
+    Headers are grouped by epoch, each epoch's cache is loaded once and
+    its seals are hashed in batches, vectorised with numpy and spread over
+    `processes` workers (all cores if None). Outcomes are remembered, so
+    that check_pow on the same seals later costs nothing.
+    """
+    results = [None] * len(headers)
+    by_epoch = {}
+    for i, h in enumerate(headers):
+        seal = (h.number, h.mining_hash, h.mixhash, h.nonce, h.difficulty)
+        results[i] = _lru_get(pow_cache, seal)
+        if results[i] is not None:
+            continue
+        if len(h.mixhash) != 32 or len(h.nonce) != 8:
+            results[i] = False
+        else:
+            by_epoch.setdefault(h.number // EPOCH_LENGTH, []).append((i, seal))
+    tasks = []
+    for epoch, items in sorted(by_epoch.items()):
+        # loaded here, before the workers are forked
+        get_cache(items[0][1][0])
+        for j in range(0, len(items), VERIFY_BATCH):
+            tasks.append(items[j:j + VERIFY_BATCH])
+    seals = [[seal for _, seal in task] for task in tasks]
+    if processes == 1 or len(tasks) < 2:
+        pool = None
+        outputs = map(_verify_seals, seals)
+    else:
+        pool = multiprocessing.Pool(processes)
+        outputs = pool.imap(_verify_seals, seals)
+    try:
+        for task, oks in zip(tasks, outputs):
+            for (i, seal), ok in zip(task, oks):
+                results[i] = ok
+                _lru_put(pow_cache, seal, ok)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return results
 
 
 class Miner():
@@ -93,19 +302,22 @@ class Miner():
     4) verify (or, if mining, compute a valid) state and nonce.
 
     :param block: the block for which to find a valid nonce
+    :param pool: a ParallelMiner to search with instead of this process
     """
 
-    def __init__(self, block):
+    def __init__(self, block, pool=None):
         self.nonce = 0
         self.block = block
+        self.pool = pool
         log.debug('mining', block_number=self.block.number,
                   block_hash=utils.encode_hex(self.block.hash),
                   block_difficulty=self.block.difficulty)
 
     def mine(self, rounds=1000, start_nonce=0):
         blk = self.block
-        bin_nonce, mixhash = mine(blk.number, blk.difficulty, blk.mining_hash,
-                                  start_nonce=start_nonce, rounds=rounds)
+        search = self.pool.search if self.pool is not None else mine
+        bin_nonce, mixhash = search(blk.number, blk.difficulty, blk.mining_hash,
+                                    start_nonce=start_nonce, rounds=rounds)
         if bin_nonce:
             blk.header.mixhash = mixhash
             blk.header.nonce = bin_nonce
@@ -113,20 +325,186 @@ class Miner():
             return blk
 
 
-def mine(block_number, difficulty, mining_hash, start_nonce=0, rounds=1000):
-    assert utils.is_numeric(start_nonce)
+def hash_nonces(block_number, mining_hash, bin_nonces, dataset=None):
+    """
+    Runs hashimoto for each of `bin_nonces`, against the full `dataset` if
+    one is given and the light cache otherwise.
+    """
+    if dataset is not None:
+        if VECTORIZED:
+            return ethash.hashimoto_batch(
+                mining_hash, bin_nonces, len(dataset) * ethash_utils.HASH_BYTES,
+                lambda indices: dataset[indices])
+        return [ethash.hashimoto_full(dataset, mining_hash, n)
+                for n in bin_nonces]
     cache = get_cache(block_number)
+    if VECTORIZED:
+        return ethash.hashimoto_light_batch(
+            block_number, cache, mining_hash, bin_nonces)
+    return [hashimoto_light(block_number, cache, mining_hash, n)
+            for n in bin_nonces]
+
+
+def mine(block_number, difficulty, mining_hash, start_nonce=0, rounds=1000,
+         dataset=None, cancelled=None):
+    return _mine(block_number, difficulty, mining_hash, start_nonce, rounds,
+                 dataset, cancelled)[:2]
+
+
+def _mine(block_number, difficulty, mining_hash, start_nonce, rounds,
+          dataset, cancelled):
+    # Also returns the number of nonces tried
+    assert utils.is_numeric(start_nonce)
     nonce = start_nonce
     target = utils.zpad(utils.int_to_big_endian(
         2**256 // (difficulty or 1) - 1), 32)
-    for i in range(1, rounds + 1):
-        bin_nonce = utils.zpad(
-            utils.int_to_big_endian(
-                (nonce + i) & TT64M1), 8)
-        o = hashimoto_light(block_number, cache, mining_hash, bin_nonce)
-        if o[b"result"] <= target:
-            log.debug("nonce found")
-            assert len(bin_nonce) == 8
-            assert len(o[b"mix digest"]) == 32
-            return bin_nonce, o[b"mix digest"]
-    return None, None
+    batch = MINE_BATCH if VECTORIZED else 1
+    tried = 0
+    for i in range(1, rounds + 1, batch):
+        if cancelled is not None and cancelled.is_set():
+            break
+        bin_nonces = [utils.zpad(utils.int_to_big_endian(
+            (nonce + j) & TT64M1), 8) for j in range(i, min(i + batch, rounds + 1))]
+        outputs = hash_nonces(block_number, mining_hash, bin_nonces, dataset)
+        for bin_nonce, o in zip(bin_nonces, outputs):
+            tried += 1
+            if o[b"result"] <= target:
+                log.debug("nonce found")
+                assert len(bin_nonce) == 8
+                assert len(o[b"mix digest"]) == 32
+                return bin_nonce, o[b"mix digest"], tried
+    return None, None, tried
+
+
+class _AnyEvent(object):
+
+    """Set while any of `events` is"""
+
+    def __init__(self, *events):
+        self.events = events
+
+    def is_set(self):
+        return any(e.is_set() for e in self.events)
+
+
+# State of the ParallelMiner worker processes, set by _init_mining_worker
+_mining_cancelled = None
+_mining_datasets = {}
+
+
+def _init_mining_worker(cancelled, stopped, directory):
+    global _mining_cancelled
+    _mining_cancelled = _AnyEvent(cancelled, stopped)
+    if directory is not None:
+        set_ethash_dir(directory, processes=1, pregenerate=False)
+
+
+def _mine_chunk(args):
+    block_number, difficulty, mining_hash, start_nonce, rounds, full = args
+    dataset = None
+    if full:
+        epoch = block_number // EPOCH_LENGTH
+        if epoch not in _mining_datasets:
+            _mining_datasets.clear()
+            _mining_datasets[epoch] = store.get_dataset(block_number)
+        dataset = _mining_datasets[epoch]
+    return _mine(block_number, difficulty, mining_hash, start_nonce, rounds,
+                 dataset, _mining_cancelled)
+
+
+class ParallelMiner(object):
+
+    """
+    Searches for nonces on a pool of `processes` workers (all cores if
+    None), handing out the nonce space in chunks of `chunk_size`.
+
+    Workers share the caches and datasets of the EthashStore, if one is set
+    up with set_ethash_dir. With `full` they hash against its memory-mapped
+    dataset, generated once on first use; otherwise they use the light
+    cache. `cancel` stops a running search from another thread, eg. when a
+    new head arrives, and `hashrate` is that of the last search.
+    """
+
+    def __init__(self, processes=None, chunk_size=4 * MINE_BATCH, full=False):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+        self.full = full
+        self.cancelled = multiprocessing.Event()
+        # set by search itself to wind its chunks down, so that it never
+        # has to touch `cancelled` for that
+        self.stopped = multiprocessing.Event()
+        self.hashrate = 0.0
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(
+                self.processes, _init_mining_worker,
+                (self.cancelled, self.stopped,
+                 store.directory if store is not None else None))
+        return self._pool
+
+    def search(self, block_number, difficulty, mining_hash, start_nonce=0,
+               rounds=None):
+        """
+        Tries the `rounds` nonces after `start_nonce`, or all of them if
+        None, and returns the (nonce, mixhash) found or (None, None).
+        """
+        if self.cancelled.is_set():
+            # cancelled before it started, eg. a new head came in meanwhile
+            self.cancelled.clear()
+            return None, None
+        full = self.full and store is not None
+        # prepared here once rather than by every worker
+        if full:
+            store.get_dataset(block_number)
+        else:
+            get_cache(block_number)
+        pool = self.pool
+        self.stopped.clear()
+        end = start_nonce + rounds if rounds is not None else None
+        next_nonce = start_nonce
+        pending = deque()
+        hashes = 0
+        found = None, None
+        t = time.time()
+        while True:
+            if self.cancelled.is_set():
+                # taken by this search; a cancel arriving from here on is
+                # left set for the next one
+                self.stopped.set()
+                self.cancelled.clear()
+                break
+            while len(pending) < 2 * self.processes and \
+                    (end is None or next_nonce < end):
+                size = self.chunk_size if end is None else \
+                    min(self.chunk_size, end - next_nonce)
+                pending.append(pool.apply_async(_mine_chunk, [(
+                    block_number, difficulty, mining_hash, next_nonce, size,
+                    full)]))
+                next_nonce += size
+            if not pending:
+                break
+            nonce, mixhash, tried = pending.popleft().get()
+            hashes += tried
+            if nonce is not None:
+                found = nonce, mixhash
+                break
+        # stop the chunks still queued or running before the next search
+        self.stopped.set()
+        for result in pending:
+            hashes += result.get()[2]
+        self.hashrate = hashes / max(time.time() - t, 1e-6)
+        log.debug('mining stopped', hashes=hashes, hashrate=self.hashrate,
+                  found=found[0] is not None)
+        return found
+
+    def cancel(self):
+        """Stops the running search, or the next one if none is running"""
+        self.cancelled.set()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
@@ -0,0 +1,276 @@
+import json
+import os
+import struct
+import threading
+import time
+
+import rlp
+
+from ethereum.block import Block
+from ethereum.common import precheck_transaction_tree
+from ethereum.pow import ethpow
+from ethereum.slogging import get_logger
+from ethereum.transactions import recover_senders
+from ethereum.utils import big_endian_to_int
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+log = get_logger('eth.importer')
+
+
+def read_rlp_blocks(f):
+    """Yields the RLP encoded blocks concatenated in file `f` one by one"""
+    while True:
+        prefix = f.read(1)
+        if not prefix:
+            return
+        b = ord(prefix)
+        if b < 0xc0:
+            raise ValueError("Expected an RLP list at offset %d" %
+                             (f.tell() - 1))
+        if b <= 0xf7:
+            length = b - 0xc0
+        else:
+            length_bytes = f.read(b - 0xf7)
+            prefix += length_bytes
+            length = big_endian_to_int(length_bytes)
+        payload = f.read(length)
+        if len(payload) < length:
+            raise ValueError("Truncated block at the end of the file")
+        yield prefix + payload
+
+
+# Block files: a stream of blocks, each as a 4 byte big endian length
+# followed by its RLP, so that a reader can skip records without decoding
+
+def write_block_stream(f, blocks):
+    """Writes blocks (Blocks or their RLP) to file `f`; returns the count"""
+    count = 0
+    for block in blocks:
+        data = block if isinstance(block, bytes) else rlp.encode(block)
+        f.write(struct.pack('>I', len(data)))
+        f.write(data)
+        count += 1
+    return count
+
+
+def read_block_stream(f, skip=0):
+    """Yields the RLP of the blocks in file `f`, after the first `skip`"""
+    while True:
+        prefix = f.read(4)
+        if not prefix:
+            return
+        if len(prefix) < 4:
+            raise ValueError("Truncated block length at the end of the file")
+        length, = struct.unpack('>I', prefix)
+        if skip:
+            f.seek(length, os.SEEK_CUR)
+            skip -= 1
+            continue
+        data = f.read(length)
+        if len(data) < length:
+            raise ValueError("Truncated block at the end of the file")
+        yield data
+
+
+class BlockImporter(object):
+
+    """
+    Adds a long run of blocks to a chain as a pipeline. A background
+    thread decodes each batch of `batch_size` blocks, recovers the senders
+    of their transactions, checks their seals (ethpow.verify_headers_pow)
+    and their transaction roots while the batch before is executed. The
+    outcomes are left in the caches apply_block consults, so nothing is
+    done twice. Sender recovery and seal checks run in process pools of
+    `processes` workers (or in native code), so they overlap execution
+    despite the GIL. The chain's db is committed every `commit_interval`
+    blocks rather than after each one, at the end of a batch, after which
+    `checkpoint` (if given) is called with the number of blocks consumed so
+    far, all of them committed.
+    """
+
+    def __init__(self, chain, batch_size=64, processes=None,
+                 commit_interval=64, report_interval=10, checkpoint=None):
+        self.chain = chain
+        self.batch_size = batch_size
+        self.processes = processes
+        self.commit_interval = commit_interval
+        self.report_interval = report_interval
+        self.checkpoint = checkpoint
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.blocks = 0
+        self.known = 0
+        self.invalid = 0
+        self.gas = 0
+        self.elapsed = 0.0
+
+    def _prepare(self, blocks, prepared, stop):
+        try:
+            batch = []
+            for block in blocks:
+                if stop.is_set():
+                    return
+                if not isinstance(block, Block):
+                    block = rlp.decode(block, Block)
+                batch.append(block)
+                if len(batch) == self.batch_size:
+                    if not self._put(prepared, self._prepare_batch(batch),
+                                     stop):
+                        return
+                    batch = []
+            if batch:
+                self._put(prepared, self._prepare_batch(batch), stop)
+        except Exception as e:
+            self._put(prepared, e, stop)
+        finally:
+            self._put(prepared, None, stop)
+
+    @staticmethod
+    def _put(prepared, item, stop):
+        # Gives up once the import has stopped, eg. because add_block
+        # raised, rather than block on a queue that is no longer read
+        while not stop.is_set():
+            try:
+                prepared.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _prepare_batch(self, batch):
+        recover_senders([tx for b in batch for tx in b.transactions],
+                        processes=self.processes)
+        ethpow.verify_headers_pow([b.header for b in batch],
+                                  processes=self.processes)
+        for b in batch:
+            precheck_transaction_tree(b)
+        return batch
+
+    def import_blocks(self, blocks):
+        """
+        Adds `blocks` (Blocks or their RLP encodings), in order, to the
+        chain and returns the stats of the import.
+        """
+        chain = self.chain
+        prepared = queue.Queue(maxsize=2)
+        stop = threading.Event()
+        worker = threading.Thread(target=self._prepare,
+                                  args=(blocks, prepared, stop))
+        worker.daemon = True
+        # commits are left to the importer, at batch ends
+        commit_interval = chain.commit_interval
+        chain.commit_interval = float('inf')
+        consumed = uncommitted = 0
+        start = last_report = time.time()
+        worker.start()
+        try:
+            while True:
+                batch = prepared.get()
+                if batch is None:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                for block in batch:
+                    if block.header.hash in chain.db:
+                        self.known += 1
+                    elif chain.add_block(block):
+                        self.blocks += 1
+                        self.gas += block.header.gas_used
+                    else:
+                        self.invalid += 1
+                consumed += len(batch)
+                uncommitted += len(batch)
+                if uncommitted >= self.commit_interval:
+                    self._commit(consumed)
+                    uncommitted = 0
+                now = time.time()
+                if now - last_report >= self.report_interval:
+                    self.elapsed += now - start
+                    start = last_report = now
+                    log.info('Importing', **self.stats())
+            if uncommitted:
+                self._commit(consumed)
+        finally:
+            stop.set()
+            worker.join()
+            chain.commit()
+            chain.commit_interval = commit_interval
+            self.elapsed += time.time() - start
+        log.info('Import done', **self.stats())
+        return self.stats()
+
+    def _commit(self, consumed):
+        self.chain.commit()
+        if self.checkpoint is not None:
+            self.checkpoint(consumed)
+
+    def import_file(self, path):
+        """Imports the RLP encoded blocks concatenated in the file at `path`"""
+        with open(path, 'rb') as f:
+            return self.import_blocks(read_rlp_blocks(f))
+
+    def stats(self):
+        elapsed = self.elapsed or 1e-9
+        return {'blocks': self.blocks, 'known': self.known,
+                'invalid': self.invalid, 'gas': self.gas,
+                'elapsed': self.elapsed,
+                'blocks_per_second': self.blocks / elapsed,
+                'gas_per_second': self.gas / elapsed}
+
+
+def export_chain(chain, path, start=None, end=None):
+    """
+    Writes the canonical blocks `start` (default: the first after genesis)
+    to `end` (default: the head) of `chain` to a block file at `path`, as
+    stored, without decoding them. Returns the number of blocks written.
+    """
+    if start is None:
+        start = int(chain.db.get('GENESIS_NUMBER')) + 1
+    if end is None:
+        end = chain.get_header(chain.head_hash).number
+
+    def stored_blocks():
+        for number in range(start, end + 1):
+            blockhash = chain.get_blockhash_by_number(number)
+            if blockhash is None:
+                return
+            yield chain.db.get(blockhash)
+
+    with open(path, 'wb') as f:
+        return write_block_stream(f, stored_blocks())
+
+
+def import_chain(chain, path, checkpoint_path=None, **kwargs):
+    """
+    Imports the block file at `path` into `chain` with a BlockImporter
+    (`kwargs` are passed on to it) and returns the stats of the import.
+    If `checkpoint_path` is given, the number of blocks imported and
+    committed is kept in that file, and an import that was interrupted is
+    resumed from there; the chain's db must of course persist as well.
+    """
+    done = 0
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint['path'] == os.path.abspath(path):
+            done = checkpoint['blocks']
+            log.info('Resuming import', path=path, skipped=done)
+
+    def save_checkpoint(consumed):
+        tmp = checkpoint_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'path': os.path.abspath(path),
+                       'blocks': done + consumed}, f)
+        os.rename(tmp, checkpoint_path)
+
+    if checkpoint_path is not None:
+        kwargs['checkpoint'] = save_checkpoint
+    importer = BlockImporter(chain, **kwargs)
+    with open(path, 'rb') as f:
+        return importer.import_blocks(read_block_stream(f, skip=done))
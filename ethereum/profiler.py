@@ -0,0 +1,121 @@
+import json
+import time
+
+from ethereum import opcodes
+from ethereum.utils import encode_hex, sha3
+
+if hasattr(time, 'perf_counter'):
+    default_timer = time.perf_counter
+else:
+    default_timer = time.time
+
+
+class VMProfiler(object):
+
+    """
+    Aggregates wall time, invocation count and gas per opcode, per
+    contract (keyed by code hash) and per precompile. Attach it with
+    `state.profiler = VMProfiler()`; messages applied on that state then
+    report into it.
+
+    Opcode times are exclusive: time spent in a child call is booked on
+    the callee, not on the CALL instruction. Opcode gas is the gas the
+    frame lost on that step, which for calls includes what the child used.
+    """
+
+    def __init__(self, timer=default_timer):
+        self.timer = timer
+        self.ops = {}          # op name -> [count, gas, seconds]
+        self.contracts = {}    # code hash -> [calls, gas, seconds]
+        self.precompiles = {}  # address -> [calls, gas, seconds]
+        self.folded = {}       # call stack -> exclusive seconds
+        self._frames = []
+
+    # Called by messages._apply_msg around every message
+    def enter_frame(self, msg, code, is_precompile=False):
+        if is_precompile:
+            key = msg.code_address
+            label = 'precompile:' + encode_hex(key)
+        else:
+            key = sha3(code)
+            label = encode_hex(key)[:16]
+        now = self.timer()
+        stack = '%s;%d:%s' % (self._frames[-1]['stack'], msg.depth, label) \
+            if self._frames else '%d:%s' % (msg.depth, label)
+        self._frames.append({
+            'key': key,
+            'precompile': is_precompile,
+            'stack': stack,
+            'gas': msg.gas,
+            'start': now,
+            'children': 0.0,
+            # State of the instruction currently being executed
+            'op': None,
+            'op_start': now,
+            'op_gas': msg.gas,
+            'op_children': 0.0,
+        })
+
+    # Called by vm.vm_execute before every instruction
+    def step(self, opcode, gas):
+        frame = self._frames[-1]
+        now = self.timer()
+        self._close_op(frame, now, gas)
+        frame['op'] = opcode
+        frame['op_start'] = now
+        frame['op_gas'] = gas
+        frame['op_children'] = frame['children']
+
+    def exit_frame(self, gas_remaining):
+        frame = self._frames.pop()
+        now = self.timer()
+        self._close_op(frame, now, gas_remaining)
+        elapsed = now - frame['start']
+        table = self.precompiles if frame['precompile'] else self.contracts
+        _add(table, frame['key'], frame['gas'] - gas_remaining, elapsed)
+        self.folded[frame['stack']] = self.folded.get(frame['stack'], 0.0) + \
+            elapsed - frame['children']
+        if self._frames:
+            self._frames[-1]['children'] += elapsed
+
+    def _close_op(self, frame, now, gas):
+        if frame['op'] is None:
+            return
+        elapsed = now - frame['op_start'] - \
+            (frame['children'] - frame['op_children'])
+        name = opcodes.opcodes.get(frame['op'], ['INVALID'])[0]
+        _add(self.ops, name, max(frame['op_gas'] - gas, 0), elapsed)
+        frame['op'] = None
+
+    def to_dict(self):
+        def rows(table, keyfunc=lambda k: k):
+            return {keyfunc(k): {'count': v[0], 'gas': v[1], 'time': v[2]}
+                    for k, v in table.items()}
+        return {
+            'ops': rows(self.ops),
+            'contracts': rows(self.contracts, lambda k: '0x' + encode_hex(k)),
+            'precompiles': rows(self.precompiles, lambda k: '0x' + encode_hex(k)),
+        }
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4, sort_keys=True)
+
+    def write_folded(self, path):
+        """
+        Writes exclusive time per call stack in the folded format read by
+        flamegraph.pl, one frame per call depth, in microseconds
+        """
+        with open(path, 'w') as f:
+            for stack, seconds in sorted(self.folded.items()):
+                f.write('%s %d\n' % (stack, int(seconds * 1000000)))
+
+
+def _add(table, key, gas, seconds):
+    row = table.get(key)
+    if row is None:
+        table[key] = [1, gas, seconds]
+    else:
+        row[0] += 1
+        row[1] += gas
+        row[2] += seconds
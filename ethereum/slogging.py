@@ -20,6 +20,9 @@ known_loggers = set()
 
 log_listeners = []
 
+# callables invoked whenever logging levels change, see `add_level_listener`
+level_listeners = []
+
 
 def _inject_into_logger(name, code, namespace=None):
     # This is a hack to fool the logging module into reporting correct source files.
@@ -130,6 +133,22 @@ def get_configuration():
     return dict(config_string=config_string, log_json=SLogger.manager.log_json)
 
 
+def add_level_listener(listener):
+    """
+    register a callable that is run now and after every `configure` or
+    `set_level`. Hot code paths use it to cache `is_active` checks in
+    module level flags instead of asking the logging module on every call.
+    """
+    level_listeners.append(listener)
+    listener()
+    return listener
+
+
+def _notify_level_listeners():
+    for listener in level_listeners:
+        listener()
+
+
 def get_logger_names():
     return sorted(known_loggers, key=lambda x: '' if not x else x)
 
@@ -331,6 +350,8 @@ def configure(config_string=None, log_json=False, log_file=None):
         logger.setLevel(level.upper())
         logger.propagate = True
 
+    _notify_level_listeners()
+
 
 configure_logging = configure
 
@@ -339,6 +360,7 @@ def set_level(name, level):
     assert not isinstance(level, int)
     logger = getLogger(name)
     logger.setLevel(getattr(logging, level.upper()))
+    _notify_level_listeners()
 
 
 def get_logger(name=None):
@@ -1,11 +1,22 @@
 # -*- coding: utf8 -*-
 from py_ecc.secp256k1 import privtopub, ecdsa_raw_recover, N as secp256k1n
+from collections import OrderedDict
 import hashlib
 from rlp.utils import ascii_chr
 
-from ethereum import utils, opcodes
+from ethereum import utils, opcodes, bn128_backend
 from ethereum.utils import safe_ord, decode_hex, encode_int32
 
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+try:
+    from types import MappingProxyType as frozen_table
+except ImportError:  # Python 2
+    frozen_table = dict
+
 
 ZERO_PRIVKEY_ADDR = decode_hex('3f17f1962b36e491b30a40b2405849e597ba5fb5')
 
@@ -82,157 +93,242 @@ def mult_complexity(x):
         return x ** 2 // 16 + 480 * x - 199680
 
 
+if gmpy2 is not None:
+    def powmod(base, exp, mod):
+        return int(gmpy2.powmod(base, exp, mod))
+else:
+    powmod = pow
+
+
 def proc_modexp(ext, msg):
-    if not ext.post_metropolis_hardfork():
-        return 1, msg.gas, []
-    print('modexp proc', msg.gas)
     baselen = msg.data.extract32(0)
     explen = msg.data.extract32(32)
     modlen = msg.data.extract32(64)
+    # Gas only depends on the lengths and the first 32 bytes of the
+    # exponent, so it is checked before any operand is read
     first_exp_bytes = msg.data.extract32(
         96 + baselen) >> (8 * max(32 - explen, 0))
-    bitlength = -1
-    while first_exp_bytes:
-        bitlength += 1
-        first_exp_bytes >>= 1
-    adjusted_explen = max(bitlength, 0) + 8 * max(explen - 32, 0)
+    adjusted_explen = max(first_exp_bytes.bit_length() - 1, 0) + \
+        8 * max(explen - 32, 0)
     gas_cost = (mult_complexity(max(modlen, baselen)) *
                 max(adjusted_explen, 1)) // opcodes.GMODEXPQUADDIVISOR
-    print(baselen, explen, modlen, 'expected gas cost', gas_cost)
     if msg.gas < gas_cost:
         return 0, 0, []
     if baselen == 0:
-        return 1, msg.gas - gas_cost, [0] * modlen
+        return 1, msg.gas - gas_cost, bytearray(modlen)
     if modlen == 0:
         return 1, msg.gas - gas_cost, []
-    base = bytearray(baselen)
-    msg.data.extract_copy(base, 0, 96, baselen)
-    exp = bytearray(explen)
-    msg.data.extract_copy(exp, 0, 96 + baselen, explen)
-    mod = bytearray(modlen)
-    msg.data.extract_copy(mod, 0, 96 + baselen + explen, modlen)
-    if utils.big_endian_to_int(mod) == 0:
-        return 1, msg.gas - gas_cost, [0] * modlen
-    o = pow(
-        utils.big_endian_to_int(base),
-        utils.big_endian_to_int(exp),
-        utils.big_endian_to_int(mod))
-    return 1, msg.gas - \
-        gas_cost, [
-            safe_ord(x) for x in utils.zpad(
-                utils.int_to_big_endian(o), modlen)]
-
-
-def validate_point(x, y):
-    import py_ecc.optimized_bn128 as bn128
-    FQ = bn128.FQ
-    if x >= bn128.field_modulus or y >= bn128.field_modulus:
-        return False
-    if (x, y) != (0, 0):
-        p1 = (FQ(x), FQ(y), FQ(1))
-        if not bn128.is_on_curve(p1, bn128.b):
-            return False
-    else:
-        p1 = (FQ(1), FQ(1), FQ(0))
-    return p1
+    mod = utils.bytes_to_int(
+        msg.data.extract_bytes(96 + baselen + explen, modlen))
+    if mod == 0:
+        return 1, msg.gas - gas_cost, bytearray(modlen)
+    base = utils.bytes_to_int(msg.data.extract_bytes(96, baselen))
+    exp = utils.bytes_to_int(msg.data.extract_bytes(96 + baselen, explen))
+    o = powmod(base, exp, mod)
+    return 1, msg.gas - gas_cost, \
+        bytearray(utils.zpad(utils.int_to_big_endian(o), modlen))
 
 
 def proc_ecadd(ext, msg):
-    if not ext.post_metropolis_hardfork():
-        return 1, msg.gas, []
-    import py_ecc.optimized_bn128 as bn128
-    FQ = bn128.FQ
-    print('ecadd proc:', msg.gas)
     if msg.gas < opcodes.GECADD:
         return 0, 0, []
     x1 = msg.data.extract32(0)
     y1 = msg.data.extract32(32)
     x2 = msg.data.extract32(64)
     y2 = msg.data.extract32(96)
-    p1 = validate_point(x1, y1)
-    p2 = validate_point(x2, y2)
-    if p1 is False or p2 is False:
+    o = bn128_backend.get_backend().add(x1, y1, x2, y2)
+    if o is None:
         return 0, 0, []
-    o = bn128.normalize(bn128.add(p1, p2))
-    return 1, msg.gas - \
-        opcodes.GECADD, [safe_ord(x) for x in (
-            encode_int32(o[0].n) + encode_int32(o[1].n))]
+    return 1, msg.gas - opcodes.GECADD, \
+        bytearray(encode_int32(o[0]) + encode_int32(o[1]))
 
 
 def proc_ecmul(ext, msg):
-    if not ext.post_metropolis_hardfork():
-        return 1, msg.gas, []
-    import py_ecc.optimized_bn128 as bn128
-    FQ = bn128.FQ
-    print('ecmul proc', msg.gas)
     if msg.gas < opcodes.GECMUL:
         return 0, 0, []
     x = msg.data.extract32(0)
     y = msg.data.extract32(32)
     m = msg.data.extract32(64)
-    p = validate_point(x, y)
-    if p is False:
+    o = bn128_backend.get_backend().multiply(x, y, m)
+    if o is None:
         return 0, 0, []
-    o = bn128.normalize(bn128.multiply(p, m))
-    return (1, msg.gas - opcodes.GECMUL,
-            [safe_ord(c) for c in (encode_int32(o[0].n) + encode_int32(o[1].n))])
+    return 1, msg.gas - opcodes.GECMUL, \
+        bytearray(encode_int32(o[0]) + encode_int32(o[1]))
 
 
 def proc_ecpairing(ext, msg):
-    if not ext.post_metropolis_hardfork():
-        return 1, msg.gas, []
-    import py_ecc.optimized_bn128 as bn128
-    FQ = bn128.FQ
-    print('pairing proc', msg.gas)
     # Data must be an exact multiple of 192 byte
     if msg.data.size % 192:
         return 0, 0, []
     gascost = opcodes.GPAIRINGBASE + msg.data.size // 192 * opcodes.GPAIRINGPERPOINT
     if msg.gas < gascost:
         return 0, 0, []
-    zero = (bn128.FQ2.one(), bn128.FQ2.one(), bn128.FQ2.zero())
-    exponent = bn128.FQ12.one()
-    for i in range(0, msg.data.size, 192):
-        x1 = msg.data.extract32(i)
-        y1 = msg.data.extract32(i + 32)
-        x2_i = msg.data.extract32(i + 64)
-        x2_r = msg.data.extract32(i + 96)
-        y2_i = msg.data.extract32(i + 128)
-        y2_r = msg.data.extract32(i + 160)
-        p1 = validate_point(x1, y1)
-        if p1 is False:
-            return 0, 0, []
-        for v in (x2_i, x2_r, y2_i, y2_r):
-            if v >= bn128.field_modulus:
-                return 0, 0, []
-        fq2_x = bn128.FQ2([x2_r, x2_i])
-        fq2_y = bn128.FQ2([y2_r, y2_i])
-        if (fq2_x, fq2_y) != (bn128.FQ2.zero(), bn128.FQ2.zero()):
-            p2 = (fq2_x, fq2_y, bn128.FQ2.one())
-            if not bn128.is_on_curve(p2, bn128.b2):
-                return 0, 0, []
-        else:
-            p2 = zero
-        if bn128.multiply(p2, bn128.curve_order)[-1] != bn128.FQ2.zero():
-            return 0, 0, []
-        exponent *= bn128.pairing(p2, p1, final_exponentiate=False)
-    result = bn128.final_exponentiate(exponent) == bn128.FQ12.one()
+    pairs = [tuple(msg.data.extract32(i + j) for j in range(0, 192, 32))
+             for i in range(0, msg.data.size, 192)]
+    result = bn128_backend.get_backend().pairing_check(pairs)
+    if result is None:
+        return 0, 0, []
     return 1, msg.gas - gascost, [0] * 31 + [1 if result else 0]
 
 
-specials = {
-    decode_hex(k): v for k, v in
-    {
-        b'0000000000000000000000000000000000000001': proc_ecrecover,
-        b'0000000000000000000000000000000000000002': proc_sha256,
-        b'0000000000000000000000000000000000000003': proc_ripemd160,
-        b'0000000000000000000000000000000000000004': proc_identity,
-        b'0000000000000000000000000000000000000005': proc_modexp,
-        b'0000000000000000000000000000000000000006': proc_ecadd,
-        b'0000000000000000000000000000000000000007': proc_ecmul,
-        b'0000000000000000000000000000000000000008': proc_ecpairing,
-    }.items()
-}
+def proc_not_active(ext, msg):
+    # Stands in for a precompile whose fork has not arrived yet
+    return 1, msg.gas, []
+
+
+# Precompile registry: address -> (fork, handler), where fork names the
+# *_FORK_BLKNUM config key from which the precompile is active, or None
+registry = {}
+_registry_version = [0]
+_resolved = {}
+
+
+def register_precompile(address, handler, fork=None):
+    """
+    Registers `handler(ext, msg) -> (success, gas_remaining, output)` at
+    `address`, active from the block given by the `fork` config key (eg.
+    'METROPOLIS_FORK_BLKNUM') on, or from genesis if fork is None. This is
+    also how a compiled implementation replaces a builtin one.
+    """
+    registry[address] = (fork, handler)
+    specials[address] = handler
+    _registry_version[0] += 1
+    _resolved.clear()
+
+
+def resolve_precompiles(config, block_number):
+    """
+    Returns the address -> handler table in effect at `block_number`, with
+    handlers not yet active replaced by proc_not_active and the config's
+    CUSTOM_SPECIALS merged in. Tables are shared and read-only.
+    """
+    active = tuple(sorted(
+        (address, fork is None or block_number >= config[fork])
+        for address, (fork, _) in registry.items()))
+    custom = config['CUSTOM_SPECIALS']
+    key = (_registry_version[0], active,
+           tuple(sorted(custom.items(), key=lambda kv: kv[0])))
+    table = _resolved.get(key)
+    if table is None:
+        table = {}
+        for address, is_active in active:
+            table[address] = registry[address][1] if is_active \
+                else proc_not_active
+        for address, handler in custom.items():
+            table[address] = handler
+        table = _resolved[key] = frozen_table(table)
+    return table
+
+
+# Latest handler at every address, regardless of forks
+specials = {}
+
+for _address, _fork, _handler in [
+    (b'0000000000000000000000000000000000000001', None, proc_ecrecover),
+    (b'0000000000000000000000000000000000000002', None, proc_sha256),
+    (b'0000000000000000000000000000000000000003', None, proc_ripemd160),
+    (b'0000000000000000000000000000000000000004', None, proc_identity),
+    (b'0000000000000000000000000000000000000005', 'METROPOLIS_FORK_BLKNUM', proc_modexp),
+    (b'0000000000000000000000000000000000000006', 'METROPOLIS_FORK_BLKNUM', proc_ecadd),
+    (b'0000000000000000000000000000000000000007', 'METROPOLIS_FORK_BLKNUM', proc_ecmul),
+    (b'0000000000000000000000000000000000000008', 'METROPOLIS_FORK_BLKNUM', proc_ecpairing),
+]:
+    register_precompile(decode_hex(_address), _handler, _fork)
+
+# Precompiles whose output depends on nothing but their input
+CACHEABLE = [decode_hex(k) for k in [
+    b'0000000000000000000000000000000000000001',
+    b'0000000000000000000000000000000000000002',
+    b'0000000000000000000000000000000000000003',
+    b'0000000000000000000000000000000000000005',
+    b'0000000000000000000000000000000000000006',
+    b'0000000000000000000000000000000000000007',
+    b'0000000000000000000000000000000000000008',
+]]
+
+
+class ResultCache(object):
+
+    """
+    LRU cache of precompile results keyed by (address, input hash) and
+    bounded by the bytes of output it holds. Only successful calls are
+    stored, together with the gas they cost, so a hit returns exactly what
+    the precompile would: the cached output for the same gas if enough gas
+    was provided, an out-of-gas failure otherwise.
+    """
+
+    ENTRY_OVERHEAD = 128  # rough bytes per entry besides the output
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def wrap(self, address, proc):
+        def cached_proc(ext, msg):
+            key = (address, utils.sha3(msg.data.extract_all()))
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.entries[key] = entry  # pop and append at end
+                self.hits += 1
+                cost, out = entry
+                if msg.gas < cost:
+                    return 0, 0, []
+                return 1, msg.gas - cost, out
+            self.misses += 1
+            res, gas, out = proc(ext, msg)
+            if res == 1:
+                self.add(key, msg.gas - gas, out)
+            return res, gas, out
+        cached_proc.uncached = proc
+        return cached_proc
+
+    def add(self, key, cost, out):
+        out = bytearray(out)
+        self.entries[key] = (cost, out)
+        self.size += len(out) + self.ENTRY_OVERHEAD
+        while self.size > self.max_bytes and self.entries:
+            _, (_, old) = self.entries.popitem(last=False)
+            self.size -= len(old) + self.ENTRY_OVERHEAD
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hit_rate, 'entries': len(self.entries),
+                'bytes': self.size}
+
+
+result_cache = None
+
+
+def enable_result_cache(max_bytes=16 * 1024 * 1024):
+    """
+    Caches the results of the deterministic precompiles. Takes effect for
+    message contexts (VMExt) created after the call.
+    """
+    global result_cache
+    disable_result_cache()
+    result_cache = ResultCache(max_bytes)
+    for address in CACHEABLE:
+        fork, handler = registry[address]
+        register_precompile(address, result_cache.wrap(address, handler), fork)
+    return result_cache
+
+
+def disable_result_cache():
+    global result_cache
+    for address in CACHEABLE:
+        fork, handler = registry[address]
+        if hasattr(handler, 'uncached'):
+            register_precompile(address, handler.uncached, fork)
+    result_cache = None
+
 
 if __name__ == '__main__':
     class msg(object):
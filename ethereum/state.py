@@ -132,7 +132,13 @@ class State():
         self.journal = []
         self.cache = {}
         self.log_listeners = []
+        self.tracer = None
+        self.profiler = None
+        # VMExt of the current block context, see messages.get_block_ext
+        self.block_ext = None
         self.deletes = []
+        # address -> (rlp before, rlp after) of each account committed since
+        # `changed` was last reset, kept so that a block can be undone
         self.changed = {}
         self.executing_on_head = executing_on_head
 
@@ -354,13 +360,19 @@ class State():
                 acct.commit()
                 # Trie don't support delete for the moment
                 # self.deletes.extend(acct.storage_trie.deletes)
-                self.changed[addr] = True
+                if addr in self.changed:
+                    before = self.changed[addr][0]
+                else:
+                    before = self.trie.get(addr) or b''
                 if self.account_exists(addr) or allow_empties:
-                    self.trie.update(addr, rlp.encode(acct))
+                    rlpdata = rlp.encode(acct)
+                    self.changed[addr] = (before, rlpdata)
+                    self.trie.update(addr, rlpdata)
                     if self.executing_on_head:
-                        self.db.put(b'address:' + addr, rlp.encode(acct))
+                        self.db.put(b'address:' + addr, rlpdata)
                 else:
-                     # Trie don't support delete for the moment
+                    self.changed[addr] = (before, b'')
+                    # Trie don't support delete for the moment
                     # self.trie.delete(addr)
                     if self.executing_on_head:
                         try:
@@ -490,6 +502,16 @@ class State():
         state.changed = {}
         return state
 
+    # Copies a committed state without going through a snapshot. Unlike
+    # ephemeral_clone the copy writes to the same database.
+    def clone(self):
+        s = State(self.trie.root_hash, self.env)
+        for param in STATE_DEFAULTS:
+            setattr(s, param, copy.copy(getattr(self, param)))
+        s.recent_uncles = {n: list(uncles)
+                           for n, uncles in self.recent_uncles.items()}
+        return s
+
     def ephemeral_clone(self):
         snapshot = self.to_snapshot(root_only=True, no_prevblocks=True)
         env2 = Env(OverlayDB(self.env.db), self.env.config)
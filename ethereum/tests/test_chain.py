@@ -1,3 +1,7 @@
+import copy
+import json
+import threading
+
 import pytest
 import ethereum.messages as messages
 import ethereum.transactions as transactions
@@ -8,6 +12,8 @@ from rlp.utils import decode_hex, encode_hex
 import ethereum.pow.ethpow as ethpow
 import ethereum.utils as utils
 from ethereum.pow.chain import Chain
+from ethereum.pow.chain_index import NumberIndex
+from ethereum.pow.importer import BlockImporter, export_chain, import_chain
 from ethereum.db import EphemDB
 from ethereum.tests.utils import new_db
 from ethereum.state import State
@@ -185,6 +191,264 @@ def test_mine_block_with_transaction3(db):
     assert chain.state.get_balance(v2) == utils.denoms.finney * 10
 
 
+def test_head_candidate_builder(db):
+    k, v, k2, v2 = accounts()
+    chain = Chain({v: {"balance": utils.denoms.ether * 1}}, difficulty=1)
+    builder = meta.HeadCandidateBuilder(chain, coinbase=b'\x00' * 20)
+    builder.reset(timestamp=chain.state.timestamp + 1)
+    assert builder.candidate().transactions == []
+    tx0 = transactions.Transaction(
+        0, 0, 100000, v2, 1, b'', [v, v2], [v, v2]).sign(k)
+    tx1 = transactions.Transaction(
+        1, 0, 100000, v2, 1, b'', [v, v2], [v, v2]).sign(k)
+    # tx1 is held back until tx0 arrives
+    assert not builder.add_transaction(tx1)
+    assert builder.add_transaction(tx0)
+    hc = builder.candidate()
+    assert hc.transactions == [tx0, tx1]
+    assert builder.candidate() is hc
+    assert hc.header.gas_used == builder.state.gas_used > 0
+    assert hc.header.state_root != chain.state.trie.root_hash
+    # finalization is rolled back; the candidate state keeps just the txs
+    assert builder.state.get_balance(v2) == 2
+    assert builder.state.get_balance(b'\x00' * 20) == 0
+    assert chain.state.get_balance(v2) == 0
+
+
+def test_parallel_miner(db):
+    chain = Chain({}, difficulty=1)
+    hc, _ = meta.make_head_candidate(chain, TransactionQueue(), None,
+                                     chain.state.timestamp + 1, b'\x00' * 20)
+    pool = ethpow.ParallelMiner(processes=2, chunk_size=64)
+    try:
+        difficulty = 2 ** 8
+        nonce, mixhash = pool.search(hc.number, difficulty, hc.mining_hash)
+        assert ethpow.check_pow(hc.number, hc.mining_hash, mixhash, nonce,
+                                difficulty)
+        assert pool.hashrate > 0
+        # a search that can't succeed stops when cancelled
+        timer = threading.Timer(0.5, pool.cancel)
+        timer.start()
+        assert pool.search(hc.number, 2 ** 200, hc.mining_hash) == (None, None)
+        # a cancel issued between searches stops the next one
+        pool.cancel()
+        assert pool.search(hc.number, difficulty, hc.mining_hash) == (None, None)
+        assert pool.search(hc.number, difficulty, hc.mining_hash)[0] is not None
+    finally:
+        pool.close()
+
+
+def test_parallel_miner_cancel_while_stopping(db):
+    miner = ethpow.ParallelMiner(processes=1, chunk_size=8)
+
+    class Result(object):
+        def __init__(self, outcome):
+            self.outcome = outcome
+
+        def get(self):
+            if self.outcome[0] is not None:
+                # a new head arrives while the search winds down
+                miner.cancel()
+            return self.outcome
+
+    class Pool(object):
+        calls = 0
+
+        def apply_async(self, func, args):
+            self.calls += 1
+            if self.calls == 1:
+                return Result((b'\x01' * 8, b'\x02' * 32, 5))
+            return Result((None, None, 3))
+    miner._pool = Pool()
+    assert miner.search(0, 1, b'\x00' * 32) == (b'\x01' * 8, b'\x02' * 32)
+    # only the nonces actually tried count towards the hashrate
+    assert 0 < miner.hashrate <= 5 / 1e-6
+    # the cancel is kept for the next search
+    assert miner.search(0, 1, b'\x00' * 32) == (None, None)
+    assert not miner.cancelled.is_set()
+
+
+def test_verify_headers_pow(db, monkeypatch):
+    chain = Chain({}, difficulty=1)
+    headers = [mine_next_block(chain).header for i in range(3)]
+    bad = copy.deepcopy(headers[1])
+    bad.nonce = b'\xff' * 8
+    ethpow.pow_cache.clear()
+    assert ethpow.verify_headers_pow(headers + [bad]) == [True] * 3 + [False]
+    ethpow.pow_cache.clear()
+    monkeypatch.setattr(ethpow, 'VERIFY_BATCH', 1)
+    assert ethpow.verify_headers_pow(headers + [bad], processes=2) == \
+        [True] * 3 + [False]
+    # the outcomes are remembered for check_pow
+    h = headers[0]
+    assert (h.number, h.mining_hash, h.mixhash, h.nonce, h.difficulty) \
+        in ethpow.pow_cache
+
+
+def test_header_and_number_index(db, tmpdir):
+    path = str(tmpdir.join('number_index'))
+    chain = Chain({}, difficulty=1, index_path=path)
+    blocks = [mine_next_block(chain) for i in range(3)]
+    assert len(chain.number_index) == 4
+    assert chain.get_blockhash_by_number(2) == blocks[1].hash
+    # headers are read without decoding the bodies
+    assert b'header:' + blocks[0].hash in chain.db
+    assert chain.get_header(blocks[0].hash) == blocks[0].header
+    assert chain.get_header(chain.genesis.hash) == chain.genesis.header
+    assert chain.get_headers(1, 5) == [b.header for b in blocks]
+    assert chain.get_headers(3, 2, skip=1, reverse=True) == \
+        [blocks[2].header, blocks[0].header]
+    assert chain.get_blockhashes_from_hash(blocks[2].hash, 5) == \
+        [blocks[1].hash, blocks[0].hash, chain.genesis.hash]
+    assert chain.get_header_chain() == [b.header for b in blocks]
+    # a longer fork from block 1 replaces the index above it
+    fork = [blocks[0]]
+    for i in range(3):
+        fork.append(mine_on_chain(chain, parent=fork[-1],
+                                  coinbase=b'\x01' * 20))
+    assert chain.head == fork[-1]
+    assert [chain.get_blockhash_by_number(i) for i in range(1, 5)] == \
+        [b.hash for b in fork]
+    assert blocks[2].hash not in chain and fork[2].hash in chain
+    misses = chain.block_cache.misses
+    chain.block_cache.clear()
+    assert sorted(chain.get_descendant_headers(blocks[0].header),
+                  key=lambda h: h.hash) == \
+        sorted([b.header for b in blocks + fork[1:]], key=lambda h: h.hash)
+    assert chain.get_header_chain(2) == [b.header for b in fork[1:]]
+    assert chain.block_cache.misses == misses
+    # the table is kept on disk, and entries not backed by the db (as after
+    # an interrupted write) are dropped on startup
+    chain.number_index.set(5, b'\xff' * 32)
+    chain.number_index.close()
+    chain.number_index = NumberIndex(path)
+    chain.sync_number_index()
+    assert len(chain.number_index) == 5
+    assert chain.get_blockhash_by_number(4) == fork[-1].hash
+    assert chain.get_blockhash_by_number(5) is None
+
+
+def test_block_cache(db):
+    chain = Chain({}, difficulty=1, block_cache_size=2)
+    blocks = [mine_next_block(chain) for i in range(3)]
+    chain.block_cache.clear()
+    b = chain.get_block(blocks[0].hash)
+    assert b == blocks[0] and b.number == b.header.number == 1
+    assert chain.get_block(blocks[0].hash) is b
+    assert chain.get_parent(chain.get_block(blocks[1].hash)) is b
+    assert chain.block_cache.hits == 2
+    # the header came along with the block
+    assert chain.headers.cache.get(blocks[0].hash) is b.header
+    # bounded, least recently used first out
+    chain.get_block(blocks[2].hash)
+    assert blocks[1].hash not in chain.block_cache
+    assert chain.head == blocks[2]
+    stats = chain.block_cache.stats()
+    assert stats['entries'] == 2 and stats['hits'] == 3
+
+
+def test_score_index(db):
+    chain = Chain({}, difficulty=1)
+    blocks = [mine_next_block(chain) for i in range(2)]
+    # scores are stored as blocks are added
+    for b in blocks:
+        assert b'score:' + b.hash in chain.db
+    assert chain.head_score == chain.get_score(blocks[-1]) == 2
+    side = mine_on_chain(chain, parent=blocks[0], coinbase=b'\x01' * 20)
+    assert chain.get_score(side) == 2
+    assert chain.head == blocks[-1] and chain.head_score == 2
+    longer = mine_on_chain(chain, parent=side, coinbase=b'\x01' * 20)
+    assert chain.head == longer and chain.head_score == 3
+
+
+def test_reorg_state_diffs(db):
+    chain = Chain({}, difficulty=1)
+    coinbase, fork_coinbase = b'\x00' * 20, b'\x01' * 20
+    blocks = [mine_next_block(chain) for i in range(3)]
+    # each block records its accounts before and after
+    before, after = dict(chain.get_state_diff(blocks[2].hash))[coinbase]
+    assert after == chain.state.trie.get(coinbase) != before
+    fork = [blocks[0]]
+    for i in range(3):
+        fork.append(mine_on_chain(chain, parent=fork[-1],
+                                  coinbase=fork_coinbase))
+    assert chain.head == fork[-1]
+    # the flat account table is rolled back along the old chain and
+    # forward along the new one
+    for addr in (coinbase, fork_coinbase):
+        assert chain.db.get(b'address:' + addr) == chain.state.trie.get(addr)
+    assert chain.get_blockhash_by_number(2) == fork[1].hash
+    assert chain.db.get(b'block:4') == fork[3].hash
+    # without any record of what a replaced block changed (as once pruned)
+    # the head stays put and nothing is written
+    diff = chain.get_state_diff(fork[2].hash)
+    chain.db.delete(b'diff:' + fork[2].hash)
+    addresses = dict((addr, chain.db.get(b'address:' + addr))
+                     for addr in (coinbase, fork_coinbase))
+    back = [blocks[2]]
+    for i in range(2):
+        back.append(mine_on_chain(chain, parent=back[-1]))
+    assert chain.head == fork[-1]
+    assert chain.db.get(b'block:4') == fork[3].hash
+    for addr, data in addresses.items():
+        assert chain.db.get(b'address:' + addr) == data
+    # blocks stored before diffs were kept list the addresses they changed
+    chain.db.put(b'changed:' + fork[2].hash,
+                 b''.join(addr for addr, _ in diff))
+    back.append(mine_on_chain(chain, parent=back[-1]))
+    assert chain.head == back[-1]
+    for addr in (coinbase, fork_coinbase):
+        assert chain.db.get(b'address:' + addr) == chain.state.trie.get(addr)
+
+
+def test_block_importer(db, tmpdir):
+    chain = Chain({}, difficulty=1)
+    blocks = [mine_next_block(chain) for i in range(5)]
+    path = str(tmpdir.join('blocks.rlp'))
+    with open(path, 'wb') as f:
+        for b in blocks:
+            f.write(rlp.encode(b))
+    chain2 = Chain({}, difficulty=1)
+    importer = BlockImporter(chain2, batch_size=2, processes=1,
+                             commit_interval=3)
+    stats = importer.import_file(path)
+    assert chain2.head == blocks[-1]
+    assert stats['blocks'] == 5 and stats['invalid'] == 0
+    assert stats['blocks_per_second'] > 0
+    assert chain2.uncommitted_blocks == 0 and chain2.commit_interval == 1
+    importer.reset_stats()
+    assert importer.import_blocks(blocks)['known'] == 5
+    # a failing import stops the preparing thread rather than leave it
+    # blocked on the queue
+    chain3 = Chain({}, difficulty=1)
+
+    def fail(block):
+        raise ValueError('import failed')
+    chain3.add_block = fail
+    threads = threading.active_count()
+    with pytest.raises(ValueError):
+        BlockImporter(chain3, batch_size=1, processes=1).import_blocks(
+            blocks * 4)
+    assert threading.active_count() == threads
+
+
+def test_export_import_chain(db, tmpdir):
+    chain = Chain({}, difficulty=1)
+    blocks = [mine_next_block(chain) for i in range(5)]
+    path = str(tmpdir.join('chain.blocks'))
+    assert export_chain(chain, path) == 5
+    assert export_chain(chain, str(tmpdir.join('part')), 2, 3) == 2
+    checkpoint = str(tmpdir.join('checkpoint'))
+    chain2 = Chain({}, difficulty=1)
+    stats = import_chain(chain2, path, checkpoint, batch_size=2,
+                         processes=1, commit_interval=2)
+    assert stats['blocks'] == 5 and chain2.head == blocks[-1]
+    with open(checkpoint) as f:
+        assert json.load(f)['blocks'] == 5
+    # resuming skips what the checkpoint covers
+    assert import_chain(chain2, path, checkpoint)['known'] == 0
+
+
 def test_transaction(db):
     k, v, k2, v2 = accounts()
     chain = Chain({v: {"balance": utils.denoms.ether * 1}}, difficulty=1)
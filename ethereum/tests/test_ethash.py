@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from ethereum.pow import ethash, ethash_utils, ethpow
+
+
+def as_lists(items):
+    return [list(item) for item in items]
+
+
+def test_calc_dataset_parallel_matches_serial():
+    cache = ethash._get_cache(b'\x00' * 32, 17)
+    expected = [ethash.calc_dataset_item(cache, i) for i in range(20)]
+    assert as_lists(ethash.calc_dataset(64 * 20, cache, processes=1)) == expected
+    assert as_lists(ethash.calc_dataset(64 * 20, cache, processes=2,
+                                        chunk_items=3)) == expected
+
+
+@pytest.mark.skipif(ethash.numpy is None, reason="numpy not installed")
+def test_vectorised_matches_pure():
+    cache = ethash._get_cache(b'\x00' * 32, 17)
+    items = ethash.item_array(cache)
+    expected = [ethash.calc_dataset_item(cache, i) for i in range(40)]
+    assert ethash.calc_dataset_items(items, range(40)).tolist() == expected
+    header, nonces = b'\x11' * 32, [b'\x00' * 8, b'\x01' * 8, b'\xff' * 8]
+    dataset = ethash.item_array(expected)
+    results = ethash.hashimoto_batch(header, nonces, 64 * 40,
+                                     lambda indices: dataset[indices])
+    for nonce, result in zip(nonces, results):
+        assert result == ethash.hashimoto(header, nonce, 64 * 40,
+                                          lambda i: expected[i])
+        assert result == ethash.hashimoto_full(dataset, header, nonce)
+
+
+def test_store_reuses_and_pregenerates(tmpdir, monkeypatch):
+    monkeypatch.setattr(ethash, 'get_cache_size', lambda n: 64 * 17)
+    monkeypatch.setattr(ethash_utils, 'get_cache_size', lambda n: 64 * 17)
+    store = ethpow.EthashStore(str(tmpdir), processes=1)
+    cache = as_lists(store.get_cache(0))
+    assert cache == ethash.mkcache(0)
+    assert os.path.exists(store.path('cache', 0))
+    # the next epoch is generated in the background
+    next_epoch = store.path('cache', ethpow.EPOCH_LENGTH)
+    store.pending[next_epoch].wait()
+    assert os.path.exists(next_epoch)
+    # a fresh store, as after a restart, maps the file it left behind
+    assert as_lists(ethpow.EthashStore(str(tmpdir)).get_cache(0)) == cache
+    # a truncated file is generated again rather than trusted
+    with open(store.path('cache', 0), 'r+b') as f:
+        f.truncate(64)
+    store = ethpow.EthashStore(str(tmpdir), processes=1, pregenerate=False)
+    assert as_lists(store.get_cache(0)) == cache
+
+
+def test_store_dataset_uses_own_cache(tmpdir, monkeypatch):
+    monkeypatch.setattr(ethash, 'get_cache_size', lambda n: 64 * 17)
+    monkeypatch.setattr(ethash_utils, 'get_cache_size', lambda n: 64 * 17)
+    monkeypatch.setattr(ethash_utils, 'get_full_size', lambda n: 64 * 20)
+    store = ethpow.EthashStore(str(tmpdir), processes=1, pregenerate=False)
+    # the module-level cache is not consulted
+    monkeypatch.setattr(ethpow, 'get_cache', None)
+    cache = ethash.mkcache(0)
+    expected = [ethash.calc_dataset_item(cache, i) for i in range(20)]
+    assert as_lists(store.get_dataset(0)) == expected
+    assert os.path.exists(store.path('cache', 0))
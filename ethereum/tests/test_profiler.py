@@ -0,0 +1,46 @@
+import json
+
+from ethereum.profiler import VMProfiler
+from ethereum.vm import Message
+
+
+def mk_timer():
+    clock = [0.0]
+
+    def timer():
+        clock[0] += 1.0
+        return clock[0]
+    return timer
+
+
+def test_opcode_and_contract_totals():
+    p = VMProfiler(timer=mk_timer())
+    outer = Message(b'\x01' * 20, b'\x02' * 20, gas=1000)
+    p.enter_frame(outer, b'\x60\x00')
+    p.step(0x60, 1000)                  # PUSH1
+    p.step(0xf1, 997)                   # CALL
+    inner = Message(b'\x02' * 20, b'\x00' * 19 + b'\x02', gas=500, depth=1)
+    p.enter_frame(inner, b'', is_precompile=True)
+    p.exit_frame(440)
+    p.exit_frame(900)
+
+    assert p.ops['PUSH1'][:2] == [1, 3]
+    assert p.ops['CALL'][:2] == [1, 97]
+    # the child's time is not booked on the CALL instruction
+    assert p.ops['CALL'][2] == 2.0
+    assert list(p.precompiles.values()) == [[1, 60, 1.0]]
+    assert [v[:2] for v in p.contracts.values()] == [[1, 100]]
+    assert len(p.folded) == 2
+    assert json.dumps(p.to_dict())
+
+
+def test_write_folded(tmpdir):
+    p = VMProfiler(timer=mk_timer())
+    p.enter_frame(Message(b'\x01' * 20, b'\x02' * 20, gas=10), b'\x00')
+    p.step(0x00, 10)
+    p.exit_frame(10)
+    path = str(tmpdir.join('vm.folded'))
+    p.write_folded(path)
+    line = open(path).read().strip()
+    assert line.startswith('0:')
+    assert line.endswith(' 2000000')
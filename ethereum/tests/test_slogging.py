@@ -0,0 +1,20 @@
+from ethereum import fastvm, messages, slogging, vm
+
+
+def test_level_changes_refresh_module_flags():
+    try:
+        slogging.configure(':info')
+        assert not vm.trace_vm_op and not fastvm.trace_vm_op
+        assert not vm.debug_msg and not messages.trace_msg
+        slogging.set_level('eth.vm.op', 'trace')
+        assert vm.trace_vm_op and fastvm.trace_vm_op
+        assert not vm.trace_vm_exit
+        slogging.configure(':info,eth.pb.msg:trace,eth.pb.tx:debug')
+        assert not vm.trace_vm_op and not fastvm.trace_vm_op
+        assert vm.debug_msg and fastvm.debug_msg
+        assert messages.trace_msg and messages.debug_tx
+        slogging.set_level('eth.pb.msg', 'info')
+        assert not messages.trace_msg and not vm.debug_msg
+    finally:
+        slogging.configure()
+    assert not vm.trace_vm_op and not messages.debug_tx
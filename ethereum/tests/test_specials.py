@@ -0,0 +1,101 @@
+from ethereum import bn128_backend, specials
+from ethereum.utils import encode_int32, big_endian_to_int, int_to_big_endian
+from ethereum.vm import CallData, Message
+
+
+class FakeExt(object):
+
+    def post_metropolis_hardfork(self):
+        return True
+
+
+def call(proc, data, gas=10 ** 6):
+    msg = Message(b'\x00' * 20, b'\x00' * 20, 0, gas, CallData(bytearray(data)))
+    return proc(FakeExt(), msg)
+
+
+def test_ecadd_ecmul_agree():
+    g1 = encode_int32(1) + encode_int32(2)
+    res, _, added = call(specials.proc_ecadd, g1 + g1)
+    assert res == 1
+    res, _, multiplied = call(specials.proc_ecmul, g1 + encode_int32(2))
+    assert res == 1
+    assert bytes(added) == bytes(multiplied)
+
+
+def test_ecadd_rejects_point_off_curve():
+    res, gas, _ = call(specials.proc_ecadd, encode_int32(1) + encode_int32(3))
+    assert (res, gas) == (0, 0)
+
+
+def test_pairing_validates_before_miller_loops():
+    backend = bn128_backend.get_backend()
+    g1 = (1, 2)
+    bad_g2 = (0, 0, 0, 1)  # not on the twist
+    assert backend.pairing_check([g1 + bad_g2]) is None
+    # all pairs with a point at infinity: nothing to multiply
+    assert backend.pairing_check([(0, 0, 0, 0, 0, 0), g1 + (0, 0, 0, 0)])
+    res, _, out = call(specials.proc_ecpairing, b'')
+    assert res == 1 and big_endian_to_int(bytes(bytearray(out))) == 1
+
+
+def test_result_cache_preserves_gas():
+    sha256 = b'\x00' * 19 + b'\x02'
+    cache = specials.enable_result_cache(max_bytes=1024)
+    try:
+        proc = specials.specials[sha256]
+        first = call(proc, b'abc', gas=100)
+        assert first[0] == 1
+        second = call(proc, b'abc', gas=100)
+        assert second[:2] == first[:2]
+        assert bytearray(second[2]) == bytearray(first[2])
+        assert cache.hits == 1 and cache.misses == 1
+        # a hit with too little gas fails like the precompile would
+        cost = 100 - first[1]
+        assert call(proc, b'abc', gas=cost - 1) == (0, 0, [])
+        assert call(proc, b'abc', gas=cost)[1] == 0
+        # bounded by bytes
+        for i in range(100):
+            call(proc, encode_int32(i))
+        assert cache.size <= 1024
+    finally:
+        specials.disable_result_cache()
+    assert not hasattr(specials.specials[sha256], 'uncached')
+
+
+def mk_modexp_data(b, e, m):
+    benc, eenc, menc = [int_to_big_endian(x) for x in (b, e, m)]
+    return encode_int32(len(benc)) + encode_int32(len(eenc)) + \
+        encode_int32(len(menc)) + benc + eenc + menc
+
+
+def test_modexp():
+    for b, e, m in [(3, 5, 100), (3, 2 ** 254, 2 ** 256), (0, 3, 100),
+                    (2 ** 1024 - 96, 2 ** 1024 - 105, 97), (49, 2401, 2401),
+                    (2 ** 1024 - 96, 2 ** 1024 - 105, 0)]:
+        res, _, out = call(specials.proc_modexp, mk_modexp_data(b, e, m))
+        assert res == 1
+        assert big_endian_to_int(bytes(out)) == (pow(b, e, m) if m else 0)
+        assert len(out) == len(int_to_big_endian(m))
+
+
+def test_modexp_checks_gas_first():
+    # claims a 2**64 byte modulus without providing any of it
+    data = encode_int32(1) + encode_int32(1) + encode_int32(2 ** 64) + b'\x03'
+    assert call(specials.proc_modexp, data) == (0, 0, [])
+
+
+def test_resolve_precompiles():
+    modexp = b'\x00' * 19 + b'\x05'
+    custom = b'\x00' * 19 + b'\x42'
+    config = {'METROPOLIS_FORK_BLKNUM': 10, 'CUSTOM_SPECIALS': {}}
+    before = specials.resolve_precompiles(config, 9)
+    after = specials.resolve_precompiles(config, 10)
+    assert before[modexp] is specials.proc_not_active
+    assert after[modexp] is specials.proc_modexp
+    assert specials.resolve_precompiles(config, 11) is after
+    assert call(before[modexp], mk_modexp_data(3, 5, 100)) == (1, 10 ** 6, [])
+    config['CUSTOM_SPECIALS'] = {custom: specials.proc_identity}
+    table = specials.resolve_precompiles(config, 10)
+    assert table[custom] is specials.proc_identity
+    assert custom not in after
@@ -0,0 +1,60 @@
+from ethereum import tracer, vm
+
+
+def test_ring_buffer_wraps():
+    t = tracer.RingBufferTracer(capacity=3)
+    for pc in range(5):
+        t.record(pc, 0x01, 100 - pc, 0, -1)
+    assert len(t) == 3
+    assert [r[0] for r in t.records()] == [2, 3, 4]
+    t.clear()
+    assert list(t.records()) == []
+
+
+def test_file_tracer_roundtrip(tmpdir):
+    path = str(tmpdir.join('trace.bin'))
+    t = tracer.FileTracer(path)
+    t.record(0, 0x60, 1000, 0, 1)
+    t.record(2, 0x00, 997, 0, 0)
+    assert list(t.records()) == [(0, 0x60, 1000, 0, 1), (2, 0x00, 997, 0, 0)]
+    t.close()
+    assert len(list(tracer.read_trace_file(path))) == 2
+
+
+def test_struct_logs():
+    records = [
+        (0, 0x60, 1000, 0, 1),   # PUSH1, same frame follows
+        (2, 0xf1, 997, 0, -6),   # CALL, child frame follows
+        (0, 0x00, 500, 1, 0),    # STOP in the child
+    ]
+    logs = tracer.to_struct_logs(records)
+    assert [l['op'] for l in logs] == ['PUSH1', 'CALL', 'STOP']
+    assert logs[0]['gasCost'] == 3
+    assert logs[1]['gasCost'] == 40
+    assert [l['depth'] for l in logs] == [1, 1, 2]
+
+
+def run_traced(gas):
+    ext = vm.VmExtBase()
+    ext.gathering_mode = True
+    ext.post_metropolis_hardfork = lambda: True
+    ext.tracer = tracer.RingBufferTracer(capacity=16)
+    msg = vm.Message(b'\x01' * 20, b'\x02' * 20, gas=gas)
+    # PUSH1 1, PUSH1 2, ADD, STOP
+    result = vm.vm_execute(ext, msg, b'\x60\x01\x60\x02\x01\x00')
+    return result, list(ext.tracer.records())
+
+
+def test_vm_execute_traced():
+    (success, gas, _), records = run_traced(1000)
+    assert success == 1 and gas == 1000 - 9
+    assert [(pc, op, g) for pc, op, g, _, _ in records] == \
+        [(0, 0x60, 1000), (2, 0x60, 997), (4, 0x01, 994), (5, 0x00, 991)]
+    assert [r[4] for r in records] == [1, 1, -1, 0]
+
+
+def test_vm_execute_traced_huge_gas():
+    # gas is unbounded in the VM; tracing must not change the outcome
+    (success, gas, _), records = run_traced(2 ** 70)
+    assert success == 1 and gas == 2 ** 70 - 9
+    assert [r[2] for r in records] == [tracer.MAX_RECORDED_GAS] * 4
@@ -0,0 +1,80 @@
+from ethereum import utils
+from ethereum.transaction_queue import TransactionPool, make_test_tx
+
+
+def test_pool_nonce_order():
+    k1, k2 = utils.sha3(b'pool1'), utils.sha3(b'pool2')
+    a0 = make_test_tx(g=10, nonce=0).sign(k1)
+    a1 = make_test_tx(g=50, nonce=1).sign(k1)
+    a3 = make_test_tx(g=99, nonce=3).sign(k1)
+    b0 = make_test_tx(g=20, nonce=0).sign(k2)
+    q = TransactionPool()
+    for tx in [a1, a3, b0, a0]:
+        assert q.add_transaction(tx)
+    popped = []
+    while True:
+        tx = q.pop_transaction()
+        if tx is None:
+            break
+        popped.append(tx)
+    # a3 sits behind a nonce gap and is never handed out
+    assert popped == [b0, a0, a1]
+    assert len(q) == 1
+
+
+def test_pool_replacement_and_caps():
+    key = utils.sha3(b'pool3')
+    q = TransactionPool(max_txs=2, price_bump=10)
+    assert q.add_transaction(make_test_tx(g=100).sign(key))
+    assert not q.add_transaction(make_test_tx(g=105).sign(key))
+    replacement = make_test_tx(g=110).sign(key)
+    assert q.add_transaction(replacement)
+    assert len(q) == 1
+    assert q.add_transaction(make_test_tx(g=50).sign(utils.sha3(b'pool4')))
+    # the cheapest transaction is evicted, here the new one itself
+    assert not q.add_transaction(make_test_tx(g=1).sign(utils.sha3(b'pool5')))
+    assert len(q) == 2
+    assert q.pop_transaction() is replacement
+
+
+def test_pool_eviction_gaps_new_tx():
+    key = utils.sha3(b'pool7')
+    q = TransactionPool(max_txs=2)
+    assert q.add_transaction(make_test_tx(g=1, nonce=0).sign(key))
+    assert q.add_transaction(make_test_tx(g=50).sign(utils.sha3(b'pool8')))
+    # evicting nonce 0, the cheapest, leaves nonce 1 behind a gap
+    tx = make_test_tx(g=100, nonce=1).sign(key)
+    assert not q.add_transaction(tx)
+    assert tx not in q and len(q) == 1
+
+
+def test_pool_remove_included():
+    key = utils.sha3(b'pool6')
+    txs = [make_test_tx(nonce=i).sign(key) for i in range(3)]
+    q = TransactionPool(get_nonce=lambda sender: 0)
+    for tx in txs[1:]:
+        q.add_transaction(tx)
+    assert q.pop_transaction() is None
+
+    class FakeBlock(object):
+        transactions = txs[:1]
+    q.remove_included(FakeBlock())
+    assert q.pop_transaction() is txs[1]
+    # a reorg drops the block again
+    q.reinject(txs[:2])
+    assert [q.pop_transaction() for i in range(3)] == txs
+
+
+def test_pool_forgets_drained_senders():
+    txs = [make_test_tx(nonce=0).sign(utils.sha3(b'drain%d' % i))
+           for i in range(50)]
+    q = TransactionPool(get_nonce=lambda sender: 0)
+    for tx in txs:
+        assert q.add_transaction(tx)
+    assert [q.pop_transaction() for tx in txs] != [None] * 50
+
+    class FakeBlock(object):
+        transactions = txs
+    q.remove_included(FakeBlock())
+    assert not q.by_hash and not q.by_sender
+    assert q.next_nonce == {}
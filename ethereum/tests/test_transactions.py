@@ -7,6 +7,7 @@ from ethereum.messages import config_fork_specific_validation, null_address
 import ethereum.config as config
 import sys
 import json
+import threading
 import copy
 konfig = copy.copy(config.default_config)
 konfig['METROPOLIS_FORK_BLKNUM'] = 3000000
@@ -66,6 +67,88 @@ def test_transaction(filename, testname, testdata):
                 ''))
 
 
+def test_recover_senders():
+    txs = []
+    for i in range(20):
+        key = utils.sha3(str_to_bytes('key%d' % i))
+        tx = transactions.Transaction(i, 1, 21000, b'\x35' * 20, 0, b'')
+        tx.sign(key)
+        tx._sender = None
+        txs.append((tx, utils.privtoaddr(key)))
+    bad = transactions.Transaction(0, 1, 21000, b'\x35' * 20, 0, b'')
+    bad.v, bad.r, bad.s = 29, 1, 1
+    transactions.close_recovery_pool()
+    transactions.recover_senders([tx for tx, _ in txs] + [bad])
+    assert [tx._sender for tx, _ in txs] == [addr for _, addr in txs]
+    # left for the lazy path to reject
+    assert bad._sender is None
+    # only an explicit request starts a process pool
+    assert transactions._recovery_pool is None
+    for tx, _ in txs:
+        tx._sender = None
+    transactions.sender_cache.clear()
+    transactions.recover_senders([tx for tx, _ in txs], processes=2)
+    try:
+        assert [tx._sender for tx, _ in txs] == [addr for _, addr in txs]
+    finally:
+        transactions.close_recovery_pool()
+    assert transactions._recovery_pool is None
+
+
+def test_sender_cache():
+    key = utils.sha3(b'cache')
+    tx = transactions.Transaction(0, 1, 21000, b'\x35' * 20, 0, b'')
+    tx.sign(key, network_id=1)
+    transactions.sender_cache.clear()
+    decoded = rlp.decode(rlp.encode(tx), transactions.Transaction)
+    misses = transactions.sender_cache_stats['misses']
+    assert decoded.sender == utils.privtoaddr(key)
+    assert transactions.sender_cache_stats['misses'] == misses + 1
+    # a fresh copy of the same transaction is not recovered again
+    hits = transactions.sender_cache_stats['hits']
+    again = rlp.decode(rlp.encode(tx), transactions.Transaction)
+    assert again.sender == decoded.sender
+    assert transactions.sender_cache_stats['hits'] == hits + 1
+
+
+def test_sender_cache_threads():
+    # the importer's preparing thread fills the cache while the main
+    # thread reads it; evictions must not break concurrent lookups
+    max_items = transactions.sender_cache.max_items
+    transactions.sender_cache.max_items = 8
+    errors = []
+
+    def work(offset):
+        try:
+            for i in range(2000):
+                params = (offset, i % 16)
+                transactions.cache_sender(params, b'\x01' * 20)
+                transactions.get_cached_sender((offset, (i + 7) % 16))
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(4)]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        transactions.sender_cache.max_items = max_items
+        transactions.sender_cache.clear()
+    assert errors == []
+
+
+def test_hash_invalidated_on_mutation():
+    tx = transactions.Transaction(0, 1, 21000, b'\x35' * 20, 0, b'')
+    tx.sign(utils.sha3(b'mutate'))
+    h = tx.hash
+    assert tx.hash is h
+    assert tx.encoded == rlp.encode(tx)
+    tx.gasprice = 2
+    assert tx.hash != h
+    assert tx.hash == utils.sha3(rlp.encode(tx))
+
+
 def pytest_generate_tests(metafunc):
     testutils.generate_test_params('TransactionTests', metafunc)
 
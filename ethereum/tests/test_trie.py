@@ -65,6 +65,21 @@ def run_test(name, pairs):
                 name, pairs['root'], '0x' + encode_hex(t.root_hash), (i, list(permut) + deletes)))
 
 
+def test_bulk_root():
+    keys = [trie.sha3(to_string(i)) for i in range(200)]
+    # keys sharing all but their last few bits
+    keys += [keys[0][:31] + bytes([i << 1]) for i in range(8)]
+    for n in (0, 1, 2, 3, 50, len(keys)):
+        items = [(k, trie.sha3(k) * (i % 3 + 1)) for i, k in enumerate(keys[:n])]
+        t = trie.Trie(db.EphemDB())
+        for k, v in items:
+            t.update(k, v)
+        assert trie.bulk_root(items) == t.root_hash
+    # later values win, empty ones are left out
+    assert trie.bulk_root(items + [(keys[1], b'x'), (keys[2], b'')]) == \
+        trie.bulk_root(items[:1] + [(keys[1], b'x')] + items[3:])
+
+
 if __name__ == '__main__':
     for name, pairs in load_tests().items():
         run_test(name, pairs)
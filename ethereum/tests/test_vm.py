@@ -0,0 +1,36 @@
+from ethereum import opcodes, vm
+
+
+def memory_fee(words):
+    return words * opcodes.GMEMORY + words ** 2 // opcodes.GQUADRATICMEMDENOM
+
+
+def test_mem_extend_incremental_fee():
+    c = vm.Compustate(gas=10 ** 6)
+    for start, sz in [(0, 32), (100, 1), (64, 0), (1000, 64), (0, 2000)]:
+        assert vm.mem_extend(c.memory, c, 'MSTORE', start, sz)
+    words = (2000 + 31) // 32
+    assert c.mem_words == words
+    assert c.mem_cost == memory_fee(words)
+    assert c.gas == 10 ** 6 - memory_fee(words)
+    # the buffer may be larger than the visible memory, but stays zeroed
+    assert len(c.memory) >= words * 32
+    assert not any(c.memory)
+
+
+def test_mem_extend_out_of_gas():
+    c = vm.Compustate(gas=10)
+    assert not vm.mem_extend(c.memory, c, 'MLOAD', 2 ** 64, 32)
+    assert c.gas == 0
+    assert c.mem_words == 0
+    assert len(c.memory) == 0
+
+
+def test_block_ext_reused_within_block():
+    from ethereum.messages import get_block_ext
+    from ethereum.state import State
+    s = State()
+    ext = get_block_ext(s, None)
+    assert get_block_ext(s, None) is ext
+    s.block_number += 1
+    assert get_block_ext(s, None) is not ext
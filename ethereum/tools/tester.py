@@ -160,7 +160,8 @@ class State(object):
 
 
 class Chain(object):
-    def __init__(self, alloc=base_alloc, env=None, genesis=None):
+    def __init__(self, alloc=base_alloc, env=None, genesis=None,
+                 mining_pool=None):
         from ethereum.pow import chain as pow_chain
         if genesis:
             if type(genesis)!=dict and genesis.env.config['CONSENSUS_STRATEGY'] == 'hybrid_casper':
@@ -177,6 +178,8 @@ class Chain(object):
         self.cs.initialize(self.head_state, self.block)
         self.last_sender = None
         self.last_tx = None
+        # an ethpow.ParallelMiner to mine with, for non-trivial difficulties
+        self.mining_pool = mining_pool
 
     def direct_tx(self, transaction):
         self.last_tx = transaction
@@ -255,17 +258,26 @@ class Chain(object):
     def mine(self, number_of_blocks=1, timestamp=14, coinbase=a0):
         self.cs.finalize(self.head_state, self.block)
         set_execution_results(self.head_state, self.block)
-        self.block = Miner(self.block).mine(rounds=100, start_nonce=0)
+        self.block = self.seal(self.block)
         assert self.chain.add_block(self.block)
         b = self.block
         for i in range(1, number_of_blocks):
             b, _ = make_head_candidate(
                 self.chain, parent=b, timestamp=self.chain.state.timestamp + timestamp, coinbase=coinbase)
-            b = Miner(b).mine(rounds=100, start_nonce=0)
+            b = self.seal(b)
             assert self.chain.add_block(b)
         self.change_head(b.header.hash, coinbase)
         return b
 
+    def seal(self, block, rounds=1000):
+        miner = Miner(block, self.mining_pool)
+        nonce = 0
+        while True:
+            sealed = miner.mine(rounds=rounds, start_nonce=nonce)
+            if sealed:
+                return sealed
+            nonce += rounds
+
     def change_head(self, parent, coinbase=a0):
         self.head_state = self.chain.mk_poststate_of_blockhash(
             parent).ephemeral_clone()
@@ -0,0 +1,111 @@
+import struct
+
+from ethereum import opcodes
+
+# One trace record per executed instruction: program counter, opcode, gas
+# left before the instruction, call depth and stack height change. Packed
+# records are 16 bytes, so a million steps fit in 16 MB.
+TRACE_RECORD = struct.Struct('<IBQHb')
+# Gas is an unbounded int in the VM; more than fits a record is recorded
+# as this
+MAX_RECORDED_GAS = 2 ** 64 - 1
+
+
+class RingBufferTracer(object):
+
+    """
+    Keeps the most recent `capacity` trace records in a preallocated
+    buffer. Attach it with `state.tracer = RingBufferTracer()`; every VM
+    created for that state will then record into it.
+    """
+
+    def __init__(self, capacity=2 ** 20):
+        assert capacity > 0
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * TRACE_RECORD.size)
+        self.count = 0  # total records written, including overwritten ones
+
+    def record(self, pc, opcode, gas, depth, stack_delta):
+        TRACE_RECORD.pack_into(self.buffer,
+                               (self.count % self.capacity) * TRACE_RECORD.size,
+                               pc, opcode, min(gas, MAX_RECORDED_GAS), depth,
+                               stack_delta)
+        self.count += 1
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def records(self):
+        """Yields the retained records, oldest first"""
+        for i in range(self.count - len(self), self.count):
+            yield TRACE_RECORD.unpack_from(
+                self.buffer, (i % self.capacity) * TRACE_RECORD.size)
+
+    def clear(self):
+        self.count = 0
+
+
+class FileTracer(object):
+
+    """
+    Appends packed trace records to a binary file, for traces too long to
+    keep in memory. Use `read_trace_file` to iterate over them again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'ab')
+
+    def record(self, pc, opcode, gas, depth, stack_delta):
+        self.file.write(TRACE_RECORD.pack(
+            pc, opcode, min(gas, MAX_RECORDED_GAS), depth, stack_delta))
+
+    def records(self):
+        self.file.flush()
+        return read_trace_file(self.path)
+
+    def close(self):
+        self.file.close()
+
+
+def read_trace_file(path, chunk_records=4096):
+    size = TRACE_RECORD.size
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(size * chunk_records)
+            if not chunk:
+                break
+            for offset in range(0, len(chunk) - size + 1, size):
+                yield TRACE_RECORD.unpack_from(chunk, offset)
+
+
+def to_struct_logs(records):
+    """
+    Converts trace records into geth-compatible struct logs. Stack, memory
+    and storage are not recorded and thus left out. gasCost is the gas
+    difference to the next step of the same frame; where the frame is
+    left (calls, exits) the static opcode fee is reported instead.
+    """
+    o = []
+    prev = None
+    for rec in records:
+        if prev is not None:
+            o.append(_struct_log(prev, rec))
+        prev = rec
+    if prev is not None:
+        o.append(_struct_log(prev, None))
+    return o
+
+
+def _struct_log(rec, nxt):
+    pc, opcode, gas, depth, stack_delta = rec
+    op, _, _, fee = opcodes.opcodes.get(opcode, ['INVALID', 0, 0, 0])
+    if nxt is not None and nxt[3] == depth:
+        fee = gas - nxt[2]
+    return {
+        'pc': pc,
+        'op': op,
+        'gas': gas,
+        'gasCost': fee,
+        'depth': depth + 1,
+    }
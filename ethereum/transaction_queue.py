@@ -1,4 +1,6 @@
+import copy
 import heapq
+from ethereum.exceptions import InvalidTransaction
 heapq.heaptop = lambda x: x[0]
 PRIO_INFINITY = -2**100
 
@@ -34,6 +36,12 @@ class TransactionQueue():
         heapq.heappush(self.txs, OrderableTx(prio, self.counter, tx))
         self.counter += 1
 
+    def add_transactions(self, txs, force=False):
+        """Adds a batch of transactions, recovering their senders in one go"""
+        from ethereum.transactions import recover_senders
+        for tx in recover_senders(txs):
+            self.add_transaction(tx, force)
+
     def pop_transaction(self, max_gas=9999999999,
                         max_seek_depth=16, min_gasprice=0):
         while len(self.aside) and max_gas >= heapq.heaptop(self.aside).prio:
@@ -60,13 +68,256 @@ class TransactionQueue():
             return self.txs
 
     def diff(self, txs):
-        remove_hashes = [tx.hash for tx in txs]
-        keep = [item for item in self.txs if item.tx.hash not in remove_hashes]
+        remove_hashes = set(tx.hash for tx in txs)
+        # Fresh items, as popping from the new queue may reprioritize them
+        keep = [OrderableTx(item.prio, item.counter, item.tx)
+                for item in self.txs if item.tx.hash not in remove_hashes]
         q = TransactionQueue()
         q.txs = keep
         return q
 
 
+class TransactionPool(object):
+
+    """
+    A transaction pool indexed by sender. Each sender's transactions are
+    kept by nonce and only the sender's next nonce (its executable head)
+    enters the global gas price ordering, so pop_transaction never hands
+    out a transaction that sits behind a nonce gap.
+
+    `get_nonce` (eg. `state.get_nonce`) gives a sender's account nonce;
+    without it the lowest pooled nonce of a sender is taken as executable.
+    The pool keeps at most `max_txs` transactions and `max_per_sender` per
+    sender, evicting the cheapest ones when full. A transaction replaces
+    one with the same sender and nonce only if its gas price is at least
+    `price_bump` percent higher.
+    """
+
+    def __init__(self, get_nonce=None, max_txs=4096, max_per_sender=64,
+                 price_bump=10):
+        self.get_nonce = get_nonce
+        self.max_txs = max_txs
+        self.max_per_sender = max_per_sender
+        self.price_bump = price_bump
+        self.counter = 0
+        self.by_hash = {}     # tx hash -> OrderableTx
+        self.by_sender = {}   # sender -> {nonce: OrderableTx}
+        self.next_nonce = {}  # sender -> nonce of its executable head
+        # Both heaps are cleaned lazily: entries no longer in by_hash, or
+        # no longer at their sender's next nonce, are skipped when popped
+        self.heads = []       # (prio, counter, item) of executable heads
+        self.cheapest = []    # (gasprice, counter, item) of all txs
+
+    def __len__(self):
+        return len(self.by_hash)
+
+    def __contains__(self, tx):
+        return tx.hash in self.by_hash
+
+    @property
+    def txs(self):
+        return list(self.by_hash.values())
+
+    def peek(self, num=None):
+        items = sorted(self.by_hash.values())
+        return items[:num] if num else items
+
+    def add_transaction(self, tx, force=False):
+        """Adds a transaction, returning whether it was accepted"""
+        if tx.hash in self.by_hash:
+            return False
+        try:
+            sender = tx.sender
+        except InvalidTransaction:
+            return False
+        if sender not in self.next_nonce:
+            self.next_nonce[sender] = self.get_nonce(sender) \
+                if self.get_nonce else tx.nonce
+        if tx.nonce < self.next_nonce[sender]:
+            if self.get_nonce:
+                return False
+            self.next_nonce[sender] = tx.nonce
+        queue = self.by_sender.setdefault(sender, {})
+        old = queue.get(tx.nonce)
+        if old is not None:
+            if not force and tx.gasprice * 100 < \
+                    old.tx.gasprice * (100 + self.price_bump):
+                return False
+            self._remove(old)
+            queue = self.by_sender.setdefault(sender, {})
+        elif len(queue) >= self.max_per_sender and not force:
+            return False
+        item = OrderableTx(PRIO_INFINITY if force else -tx.gasprice,
+                           self.counter, tx)
+        self.counter += 1
+        queue[tx.nonce] = item
+        self.by_hash[tx.hash] = item
+        heapq.heappush(self.cheapest, (tx.gasprice, item.counter, item))
+        if tx.nonce == self.next_nonce[sender]:
+            heapq.heappush(self.heads, (item.prio, item.counter, item))
+        while len(self.by_hash) > self.max_txs:
+            self._evict_cheapest()
+        self._maybe_compact()
+        # Eviction may have dropped the new tx, or a lower nonce it needs
+        return tx.hash in self.by_hash
+
+    def add_transactions(self, txs, force=False):
+        """Adds a batch of transactions, recovering their senders in one go"""
+        from ethereum.transactions import recover_senders
+        return [self.add_transaction(tx, force) for tx in recover_senders(txs)]
+
+    def pop_transaction(self, max_gas=9999999999,
+                        max_seek_depth=16, min_gasprice=0):
+        skipped = []
+        found = None
+        while self.heads and len(skipped) < max_seek_depth:
+            entry = heapq.heappop(self.heads)
+            item = entry[2]
+            if not self._is_head(item):
+                continue
+            if item.tx.startgas > max_gas:
+                skipped.append(entry)
+                continue
+            if item.tx.gasprice >= min_gasprice or item.prio == PRIO_INFINITY:
+                found = item
+            else:
+                # Heads are price ordered, nothing cheaper will do either
+                skipped.append(entry)
+            break
+        for entry in skipped:
+            heapq.heappush(self.heads, entry)
+        if found is None:
+            return None
+        tx = found.tx
+        self._remove(found)
+        self.next_nonce[tx.sender] = tx.nonce + 1
+        self._push_head(tx.sender)
+        self._forget_idle(tx.sender)
+        return tx
+
+    def remove_transaction(self, tx):
+        item = self.by_hash.get(tx.hash)
+        if item is not None:
+            self._remove(item)
+            self._drop_gapped(tx.sender, tx.nonce)
+            self._forget_idle(tx.sender)
+
+    def remove_included(self, block):
+        """
+        Drops the transactions of a newly imported block, and any pooled
+        transaction they made stale, and advances the senders' nonces
+        """
+        self._remove_included(block.transactions)
+
+    def _remove_included(self, txs):
+        for tx in txs:
+            item = self.by_hash.get(tx.hash)
+            if item is not None:
+                self._remove(item)
+            try:
+                sender = tx.sender
+            except InvalidTransaction:
+                continue
+            if sender in self.next_nonce and \
+                    tx.nonce >= self.next_nonce[sender]:
+                self.next_nonce[sender] = tx.nonce + 1
+                queue = self.by_sender.get(sender, {})
+                for nonce in [n for n in queue if n <= tx.nonce]:
+                    self._remove(queue[nonce])
+                self._push_head(sender)
+            self._forget_idle(sender)
+        self._maybe_compact()
+
+    def reinject(self, txs):
+        """
+        Puts the transactions of blocks dropped by a reorg back into the
+        pool. Call it after the new head is set, so that `get_nonce`
+        reflects the new chain.
+        """
+        from ethereum.transactions import recover_senders
+        recover_senders(txs)
+        for tx in txs:
+            try:
+                sender = tx.sender
+            except InvalidTransaction:
+                continue
+            if sender not in self.next_nonce:
+                continue
+            if self.get_nonce:
+                self.next_nonce[sender] = self.get_nonce(sender)
+            elif tx.nonce < self.next_nonce[sender]:
+                self.next_nonce[sender] = tx.nonce
+            self._push_head(sender)
+        for tx in txs:
+            self.add_transaction(tx)
+
+    def diff(self, txs):
+        """Returns a copy of the pool with the given (included) txs removed"""
+        q = copy.copy(self)
+        q.by_hash = dict(self.by_hash)
+        q.by_sender = dict((s, dict(queue))
+                           for s, queue in self.by_sender.items())
+        q.next_nonce = dict(self.next_nonce)
+        q.heads = list(self.heads)
+        q.cheapest = list(self.cheapest)
+        q._remove_included(txs)
+        return q
+
+    def _is_head(self, item):
+        tx = item.tx
+        return self.by_hash.get(tx.hash) is item and \
+            self.next_nonce.get(tx.sender) == tx.nonce
+
+    def _push_head(self, sender):
+        item = self.by_sender.get(sender, {}).get(self.next_nonce[sender])
+        if item is not None:
+            heapq.heappush(self.heads, (item.prio, item.counter, item))
+
+    def _forget_idle(self, sender):
+        # A sender without pooled txs needs no nonce; it is looked up again
+        # when the sender's next transaction arrives
+        if sender not in self.by_sender:
+            self.next_nonce.pop(sender, None)
+
+    def _remove(self, item):
+        tx = item.tx
+        del self.by_hash[tx.hash]
+        queue = self.by_sender[tx.sender]
+        del queue[tx.nonce]
+        if not queue:
+            del self.by_sender[tx.sender]
+
+    def _drop_gapped(self, sender, nonce):
+        # Transactions above a removed nonce can no longer execute
+        queue = self.by_sender.get(sender, {})
+        for n in [n for n in queue if n > nonce]:
+            self._remove(queue[n])
+
+    def _evict_cheapest(self):
+        while self.cheapest:
+            item = heapq.heappop(self.cheapest)[2]
+            if self.by_hash.get(item.tx.hash) is item:
+                self._remove(item)
+                self._drop_gapped(item.tx.sender, item.tx.nonce)
+                self._forget_idle(item.tx.sender)
+                return item
+        return None
+
+    def _maybe_compact(self):
+        # Rebuild the heaps once stale entries dominate them
+        if len(self.cheapest) > 2 * len(self.by_hash) + 64:
+            self.cheapest = [(item.tx.gasprice, item.counter, item)
+                             for item in self.by_hash.values()]
+            heapq.heapify(self.cheapest)
+        if len(self.heads) > 2 * len(self.by_sender) + 64:
+            self.heads = []
+            for sender, queue in self.by_sender.items():
+                item = queue.get(self.next_nonce[sender])
+                if item is not None:
+                    self.heads.append((item.prio, item.counter, item))
+            heapq.heapify(self.heads)
+
+
 def make_test_tx(s=100000, g=50, data='', nonce=0):
     from ethereum.transactions import Transaction
     return Transaction(nonce=nonce, startgas=s, gasprice=g,
@@ -1,4 +1,7 @@
 # -*- coding: utf-8 -*-
+import atexit
+import threading
+from collections import OrderedDict
 import rlp
 from rlp.sedes import big_endian_int, binary, CountableList
 from rlp.utils import str_to_bytes, ascii_chr
@@ -19,6 +22,35 @@ log = get_logger('eth.chain.tx')
 secpk1n = 115792089237316195423570985008687907852837564279074904382605163141518161494337
 null_address = b'\xff' * 20
 
+# Process-wide cache of recovered senders keyed by (sighash, v, r, s). The
+# txqueue, the block builder and the importer all hold their own copies of
+# a transaction, so this lets each signature be recovered only once. The
+# importer's preparing thread fills it while blocks are applied, hence the
+# lock.
+sender_cache = OrderedDict()
+sender_cache.max_items = 2 ** 16
+sender_cache_stats = {'hits': 0, 'misses': 0}
+sender_cache_lock = threading.Lock()
+
+
+def get_cached_sender(params):
+    with sender_cache_lock:
+        sender = sender_cache.pop(params, None)  # pop and append at end
+        if sender is None:
+            sender_cache_stats['misses'] += 1
+            return None
+        sender_cache[params] = sender
+        sender_cache_stats['hits'] += 1
+        return sender
+
+
+def cache_sender(params, sender):
+    with sender_cache_lock:
+        sender_cache[params] = sender
+        if len(sender_cache) > sender_cache.max_items:
+            # remove last recently accessed
+            sender_cache.popitem(last=False)
+
 
 class Transaction(rlp.Serializable):
 
@@ -55,6 +87,10 @@ class Transaction(rlp.Serializable):
     ]
 
     _sender = None
+    # Memoized hash and (sighash, v), dropped whenever a field is assigned.
+    # Mutating read_list/write_list in place is not detected.
+    _hash = None
+    _signing_params = None
 
     def __init__(self, nonce, gasprice, startgas, to, value, data,
                  read_list=None, write_list=None, v=0, r=0, s=0):
@@ -85,6 +121,15 @@ class Transaction(rlp.Serializable):
                 self.value >= TT256 or self.nonce >= TT256:
             raise InvalidTransaction("Values way too high!")
 
+    def __setattr__(self, attr, value):
+        super(Transaction, self).__setattr__(attr, value)
+        if attr in tx_field_names:
+            d = self.__dict__
+            if d.get('_hash') is not None or \
+                    d.get('_signing_params') is not None or \
+                    d.get('_cached_rlp') is not None:
+                d['_hash'] = d['_signing_params'] = d['_cached_rlp'] = None
+
     @property
     def sender(self):
         if not self._sender:
@@ -92,26 +137,44 @@ class Transaction(rlp.Serializable):
             if self.r == 0 and self.s == 0:
                 self._sender = null_address
             else:
-                if self.v in (27, 28):
-                    vee = self.v
-                    sighash = utils.sha3(rlp.encode(self, UnsignedTransaction))
-                elif self.v >= 37:
-                    vee = self.v - self.network_id * 2 - 8
-                    assert vee in (27, 28)
-                    rlpdata = rlp.encode(rlp.infer_sedes(self).serialize(self)[
-                                         :-3] + [self.network_id, '', ''])
-                    sighash = utils.sha3(rlpdata)
+                params = self._recovery_params()
+                sender = get_cached_sender(params)
+                if sender is None:
+                    self._set_sender_from_pub(ecrecover_to_pub(*params))
+                    cache_sender(params, self._sender)
                 else:
-                    raise InvalidTransaction("Invalid V value")
-                if self.r >= secpk1n or self.s >= secpk1n or self.r == 0 or self.s == 0:
-                    raise InvalidTransaction("Invalid signature values!")
-                pub = ecrecover_to_pub(sighash, vee, self.r, self.s)
-                if pub == b"\x00" * 64:
-                    raise InvalidTransaction(
-                        "Invalid signature (zero privkey cannot sign)")
-                self._sender = utils.sha3(pub)[-20:]
+                    self._sender = sender
         return self._sender
 
+    def _recovery_params(self):
+        """Returns the (sighash, v, r, s) to recover the sender from"""
+        if self._signing_params is None:
+            self._signing_params = self._compute_signing_params()
+        sighash, vee = self._signing_params
+        if self.r >= secpk1n or self.s >= secpk1n or self.r == 0 or self.s == 0:
+            raise InvalidTransaction("Invalid signature values!")
+        return sighash, vee, self.r, self.s
+
+    def _compute_signing_params(self):
+        if self.v in (27, 28):
+            vee = self.v
+            sighash = utils.sha3(rlp.encode(self, UnsignedTransaction))
+        elif self.v >= 37:
+            vee = self.v - self.network_id * 2 - 8
+            assert vee in (27, 28)
+            rlpdata = rlp.encode(rlp.infer_sedes(self).serialize(self)[
+                                 :-3] + [self.network_id, '', ''])
+            sighash = utils.sha3(rlpdata)
+        else:
+            raise InvalidTransaction("Invalid V value")
+        return sighash, vee
+
+    def _set_sender_from_pub(self, pub):
+        if pub == b"\x00" * 64:
+            raise InvalidTransaction(
+                "Invalid signature (zero privkey cannot sign)")
+        self._sender = utils.sha3(pub)[-20:]
+
     @property
     def network_id(self):
         if self.r == 0 and self.s == 0:
@@ -141,15 +204,26 @@ class Transaction(rlp.Serializable):
         key = normalize_key(key)
 
         self.v, self.r, self.s = ecsign(rawhash, key)
+        self._sender = utils.privtoaddr(key)
+        cache_sender((rawhash, self.v, self.r, self.s), self._sender)
+        vee = self.v
         if network_id is not None:
             self.v += 8 + network_id * 2
-
-        self._sender = utils.privtoaddr(key)
+        self._signing_params = (rawhash, vee)
         return self
 
     @property
     def hash(self):
-        return utils.sha3(rlp.encode(self))
+        if self._hash is None:
+            self._hash = utils.sha3(self.encoded)
+        return self._hash
+
+    @property
+    def encoded(self):
+        """The canonical RLP encoding, kept from decode time when available"""
+        if not getattr(self, '_cached_rlp', None):
+            self._cached_rlp = rlp.encode(self)
+        return self._cached_rlp
 
     def to_dict(self):
         d = {}
@@ -215,4 +289,83 @@ class Transaction(rlp.Serializable):
     def read_write_union_list(self):
         return set(self.read_list).union(self.write_list)
 
+tx_field_names = frozenset(name for name, _ in Transaction.fields)
 UnsignedTransaction = Transaction.exclude(['v', 'r', 's'])
+
+
+# Below this many pending recoveries the pool round trip costs more than
+# it saves
+PARALLEL_RECOVERY_MIN = 16
+_recovery_pool = None
+_recovery_pool_size = 0
+
+
+def _recover_pub(params):
+    try:
+        return ecrecover_to_pub(*params)
+    except ValueError:
+        return None
+
+
+def _get_recovery_pool(processes):
+    global _recovery_pool, _recovery_pool_size
+    import multiprocessing
+    processes = processes or multiprocessing.cpu_count()
+    if _recovery_pool is None or processes != _recovery_pool_size:
+        if _recovery_pool is not None:
+            _recovery_pool.terminate()
+        _recovery_pool = multiprocessing.Pool(processes)
+        _recovery_pool_size = processes
+    return _recovery_pool
+
+
+@atexit.register
+def close_recovery_pool():
+    global _recovery_pool, _recovery_pool_size
+    if _recovery_pool is not None:
+        _recovery_pool.terminate()
+        _recovery_pool = None
+        _recovery_pool_size = 0
+
+
+def recover_senders(txs, processes=1):
+    """
+    Recovers the senders of a batch of transactions (eg. a block or a
+    txqueue batch) up front and caches them on each transaction.
+
+    Recovery runs in-process by default. Without coincurve, passing
+    `processes` other than 1 spreads the pure python recovery over a
+    process pool of that many workers (None: one per CPU), as the block
+    importer does; the pool is kept for later batches and closed at exit.
+    Transactions with a malformed signature are left alone, so that
+    reading their `sender` raises the usual InvalidTransaction.
+    """
+    pending, params = [], []
+    for tx in txs:
+        if tx._sender:
+            continue
+        if tx.r == 0 and tx.s == 0:
+            tx._sender = null_address
+            continue
+        try:
+            p = tx._recovery_params()
+        except (InvalidTransaction, AssertionError):
+            continue
+        sender = get_cached_sender(p)
+        if sender is None:
+            params.append(p)
+            pending.append(tx)
+        else:
+            tx._sender = sender
+    if utils.coincurve is None and processes != 1 and \
+            len(params) >= PARALLEL_RECOVERY_MIN:
+        pool = _get_recovery_pool(processes)
+        chunksize = max(1, len(params) // (4 * _recovery_pool_size))
+        pubs = pool.map(_recover_pub, params, chunksize=chunksize)
+    else:
+        pubs = [_recover_pub(p) for p in params]
+    for tx, p, pub in zip(pending, params, pubs):
+        if pub is not None and pub != b"\x00" * 64:
+            tx._sender = utils.sha3(pub)[-20:]
+            cache_sender(p, tx._sender)
+    return txs
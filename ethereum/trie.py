@@ -315,6 +315,54 @@ def _verify_branch(branch, root, keypath, value):
     return True
 
 
+# Bits of each byte value, as encode_bin gives them
+_byte_bits = [encode_bin(bytes([c])) for c in range(256)]
+
+def key_path(key):
+    return b''.join([_byte_bits[ord(c)] for c in key])
+
+# Hash of the subtree holding the sorted (keypath, value) pairs[lo:hi],
+# all of whose keypaths share their first `depth` bits
+def _bulk_node(pairs, lo, hi, depth):
+    first = pairs[lo][0]
+    if hi - lo == 1:
+        leaf = sha3(encode_leaf_node(pairs[lo][1]))
+        if depth == len(first):
+            return leaf
+        return sha3(encode_kv_node(first[depth:], leaf))
+    last = pairs[hi - 1][0]
+    cf = depth
+    while first[cf] == last[cf]:
+        cf += 1
+    # The keys diverge at bit cf: the first one there with a 1
+    a, b = lo, hi - 1
+    while a < b:
+        mid = (a + b) // 2
+        if pairs[mid][0][cf]:
+            b = mid
+        else:
+            a = mid + 1
+    branch = sha3(encode_branch_node(_bulk_node(pairs, lo, a, cf + 1),
+                                     _bulk_node(pairs, a, hi, cf + 1)))
+    if cf == depth:
+        return branch
+    return sha3(encode_kv_node(first[depth:cf], branch))
+
+# Root hash of the trie holding the (32 byte key, value) pairs `items`, the
+# same as updating an empty Trie with them one by one would give, but built
+# in one pass over the sorted keys and without a database. As with update,
+# later duplicates win and empty values are left out.
+def bulk_root(items):
+    values = {}
+    for key, value in items:
+        assert len(key) == 32
+        values[key] = value
+    pairs = sorted((key_path(k), v) for k, v in values.items() if v)
+    if not pairs:
+        return BLANK_ROOT
+    return _bulk_node(pairs, 0, len(pairs), 0)
+
+
 BLANK_ROOT = b'' 
 # Trie wrapper class
 class Trie():
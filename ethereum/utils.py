@@ -93,7 +93,7 @@ else:
 
 
 def ecrecover_to_pub(rawhash, v, r, s):
-    if coincurve and hasattr(coincurve, "PublicKey") and False:
+    if coincurve and hasattr(coincurve, "PublicKey"):
         try:
             pk = coincurve.PublicKey.from_signature_and_message(
                 zpad(bytearray_to_bytestr(int_to_32bytearray(r)), 32) + zpad(bytearray_to_bytestr(int_to_32bytearray(s)), 32) +
@@ -102,8 +102,9 @@ def ecrecover_to_pub(rawhash, v, r, s):
                 hasher=None,
             )
             pub = pk.format(compressed=False)[1:]
-        except BaseException:
-            pub = b"\x00" * 64
+        except Exception:
+            # Fail the same way as the pure python path below
+            raise ValueError('Invalid VRS')
     else:
         result = ecdsa_raw_recover(rawhash, (v, r, s))
         if result:
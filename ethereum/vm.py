@@ -12,8 +12,9 @@ from rlp.utils import encode_hex, ascii_chr
 from ethereum import utils
 from ethereum.abi import is_numeric
 from ethereum import opcodes
-from ethereum.slogging import get_logger
-from ethereum.utils import to_string, encode_int, zpad, bytearray_to_bytestr, safe_ord
+from ethereum.slogging import get_logger, add_level_listener
+from ethereum.utils import to_string, encode_int, zpad, bytearray_to_bytestr, safe_ord, \
+    bytes_to_int, encode_int32
 
 if sys.version_info.major == 2:
     from repoze.lru import lru_cache
@@ -28,6 +29,21 @@ log_vm_op_stack = get_logger('eth.vm.op.stack')
 log_vm_op_memory = get_logger('eth.vm.op.memory')
 log_vm_op_storage = get_logger('eth.vm.op.storage')
 
+# Level flags for the hot path, refreshed by slogging whenever the log
+# configuration changes, so disabled logging costs a single boolean test
+trace_vm_op = trace_vm_exit = trace_log = debug_msg = False
+
+
+def _refresh_log_flags():
+    global trace_vm_op, trace_vm_exit, trace_log, debug_msg
+    trace_vm_op = log_vm_op.is_active('trace')
+    trace_vm_exit = log_vm_exit.is_active('trace')
+    trace_log = log_log.is_active('trace')
+    debug_msg = log_msg.is_active('debug')
+
+
+add_level_listener(_refresh_log_flags)
+
 TT256 = 2 ** 256
 TT256M1 = 2 ** 256 - 1
 TT255 = 2 ** 255
@@ -42,6 +58,8 @@ MAX_DEPTH = 1024
 # slice plus the start and end of the slice
 class CallData(object):
 
+    __slots__ = ['data', 'offset', 'size', 'rlimit']
+
     def __init__(self, parent_memory, offset=0, size=None):
         self.data = parent_memory
         self.offset = offset
@@ -62,6 +80,14 @@ class CallData(object):
         o.extend(bytearray(32 - len(o)))
         return utils.bytearray_to_int(o)
 
+    # Extract a slice as a bytearray, zero padded past the end of the data
+    def extract_bytes(self, start, size):
+        if start >= self.size:
+            return bytearray(size)
+        o = self.data[self.offset + start: min(self.offset + start + size, self.rlimit)]
+        o.extend(bytearray(size - len(o)))
+        return o
+
     # Extract a slice and copy it to memory
     def extract_copy(self, mem, memstart, datastart, size):
         for i in range(size):
@@ -75,6 +101,10 @@ class CallData(object):
 # destination, gas, whether or not it is a STATICCALL, etc
 class Message(object):
 
+    __slots__ = ['sender', 'to', 'value', 'gas', 'data', 'depth',
+                 'code_address', 'is_create', 'transfers_value', 'static',
+                 'salt']
+
     def __init__(self, sender, to, value=0, gas=1000000, data='', depth=0,
                  code_address=None, is_create=False, transfers_value=True,
                  static=False, salt=None):
@@ -85,7 +115,6 @@ class Message(object):
         self.data = CallData(list(map(utils.safe_ord, data))) if isinstance(
             data, (str, bytes)) else data
         self.depth = depth
-        self.logs = []
         self.code_address = to if code_address is None else code_address
         self.is_create = is_create
         self.transfers_value = transfers_value
@@ -97,16 +126,21 @@ class Message(object):
 
 
 # Virtual machine state of the current EVM instance
-class Compustate():
+class Compustate(object):
+
+    __slots__ = ['memory', 'mem_words', 'mem_cost', 'stack', 'pc', 'gas',
+                 'last_returned']
 
-    def __init__(self, **kwargs):
+    def __init__(self, gas=0):
+        # `memory` may be allocated beyond the EVM-visible size, which is
+        # `mem_words` * 32 bytes; `mem_cost` is the total fee paid for it
         self.memory = bytearray()
+        self.mem_words = 0
+        self.mem_cost = 0
         self.stack = []
         self.pc = 0
-        self.gas = 0
+        self.gas = gas
         self.last_returned = bytearray()
-        for kw in kwargs:
-            setattr(self, kw, kwargs[kw])
 
 
 # Preprocesses code, and determines which locations are in the middle
@@ -130,22 +164,23 @@ def preprocess_code(code):
     return o, pushcache
 
 
-# Extends memory, and pays gas for it
+# Extends memory, and pays gas for it. Only the fee of the new size is
+# computed; the fee already paid is kept on the compustate. The underlying
+# buffer grows geometrically, bytes past the visible size stay zero.
 def mem_extend(mem, compustate, op, start, sz):
-    if sz and start + sz > len(mem):
-        oldsize = len(mem) // 32
-        old_totalfee = oldsize * opcodes.GMEMORY + \
-            oldsize ** 2 // opcodes.GQUADRATICMEMDENOM
-        newsize = utils.ceil32(start + sz) // 32
+    if sz and start + sz > compustate.mem_words * 32:
+        newsize = (start + sz + 31) // 32
         new_totalfee = newsize * opcodes.GMEMORY + \
             newsize**2 // opcodes.GQUADRATICMEMDENOM
-        memfee = new_totalfee - old_totalfee
+        memfee = new_totalfee - compustate.mem_cost
         if compustate.gas < memfee:
             compustate.gas = 0
             return False
         compustate.gas -= memfee
-        m_extend = (newsize - oldsize) * 32
-        mem.extend(bytearray(m_extend))
+        compustate.mem_words = newsize
+        compustate.mem_cost = new_totalfee
+        if newsize * 32 > len(mem):
+            mem.extend(bytearray(max(newsize * 32, 2 * len(mem)) - len(mem)))
     return True
 
 # Extends storage, and pays gas for it
@@ -182,19 +217,22 @@ def all_but_1n(x, n):
 
 # Throws a VM exception
 def vm_exception(error, **kargs):
-    log_vm_exit.trace('EXCEPTION', cause=error, **kargs)
+    if trace_vm_exit:
+        log_vm_exit.trace('EXCEPTION', cause=error, **kargs)
     return 0, 0, []
 
 
 # Peacefully exits the VM
 def peaceful_exit(cause, gas, data, **kargs):
-    log_vm_exit.trace('EXIT', cause=cause, **kargs)
+    if trace_vm_exit:
+        log_vm_exit.trace('EXIT', cause=cause, **kargs)
     return 1, gas, data
 
 
 # Exits with the REVERT opcode
 def revert(gas, data, **kargs):
-    log_vm_exit.trace('REVERT', **kargs)
+    if trace_vm_exit:
+        log_vm_exit.trace('REVERT', **kargs)
     return 0, gas, data
 
 
@@ -206,12 +244,14 @@ def vm_execute(ext, msg, code):
 
     # precompute trace flag
     # if we trace vm, we're in slow mode anyway
-    trace_vm = log_vm_op.is_active('trace')
+    trace_vm = trace_vm_op
 
     # Initialize stack, memory, program counter, etc
     compustate = Compustate(gas=msg.gas)
     stk = compustate.stack
     mem = compustate.memory
+    tracer = ext.tracer
+    profiler = ext.profiler
 
     # Compute
     jumpdest_mask, pushcache = preprocess_code(code)
@@ -235,6 +275,13 @@ def vm_execute(ext, msg, code):
 
         op, in_args, out_args, fee = opcodes.opcodes[opcode]
 
+        # Structured tracing into the pluggable tracer, see ethereum.tracer
+        if tracer is not None:
+            tracer.record(compustate.pc, opcode, compustate.gas, msg.depth,
+                          out_args - in_args)
+        if profiler is not None:
+            profiler.step(opcode, compustate.gas)
+
         # Apply operation
         compustate.gas -= fee
         compustate.pc += 1
@@ -252,14 +299,15 @@ def vm_execute(ext, msg, code):
             if _prevop in ('MLOAD', 'MSTORE', 'MSTORE8', 'SHA3', 'CALL',
                            'CALLCODE', 'CREATE', 'CALLDATACOPY', 'CODECOPY',
                            'EXTCODECOPY'):
-                if len(compustate.memory) < 4096:
+                visible_memory = mem[:compustate.mem_words * 32]
+                if len(visible_memory) < 4096:
                     trace_data['memory'] = \
                         ''.join([encode_hex(ascii_chr(x)) for x
-                                 in compustate.memory])
+                                 in visible_memory])
                 else:
                     trace_data['sha3memory'] = \
                         encode_hex(utils.sha3(b''.join([ascii_chr(x) for
-                                                        x in compustate.memory])))
+                                                        x in visible_memory])))
             if _prevop in ('SSTORE',) or steps == 0:
                 trace_data['storage'] = ext.log_storage(msg.to)
             trace_data['gas'] = to_string(compustate.gas + fee)
@@ -448,7 +496,8 @@ def vm_execute(ext, msg, code):
                     return vm_exception('OOG COPY DATA')
                 if dstart + size > len(compustate.last_returned):
                     return vm_exception('RETURNDATACOPY out of range')
-                mem[mstart: mstart + size] = compustate.last_returned
+                mem[mstart: mstart + size] = \
+                    compustate.last_returned[dstart: dstart + size]
             elif op == 'RETURNDATASIZE':
                 stk.append(len(compustate.last_returned))
             elif op == 'GASPRICE':
@@ -517,12 +566,12 @@ def vm_execute(ext, msg, code):
                 s0 = stk.pop()
                 if not mem_extend(mem, compustate, op, s0, 32):
                     return vm_exception('OOG EXTENDING MEMORY')
-                stk.append(utils.bytes_to_int(mem[s0: s0 + 32]))
+                stk.append(bytes_to_int(mem[s0: s0 + 32]))
             elif op == 'MSTORE':
                 s0, s1 = stk.pop(), stk.pop()
                 if not mem_extend(mem, compustate, op, s0, 32):
                     return vm_exception('OOG EXTENDING MEMORY')
-                mem[s0: s0 + 32] = utils.encode_int32(s1)
+                mem[s0: s0 + 32] = encode_int32(s1)
             elif op == 'MSTORE8':
                 s0, s1 = stk.pop(), stk.pop()
                 if not mem_extend(mem, compustate, op, s0, 1):
@@ -683,7 +732,7 @@ def vm_execute(ext, msg, code):
             elif op == 'PC':
                 stk.append(compustate.pc - 1)
             elif op == 'MSIZE':
-                stk.append(len(mem))
+                stk.append(compustate.mem_words * 32)
             elif op == 'GAS':
                 stk.append(compustate.gas)  # AFTER subtracting cost 1
         # DUPn (eg. DUP1: a b c -> a b c c, DUP3: a b c -> a b c a)
@@ -720,8 +769,9 @@ def vm_execute(ext, msg, code):
                 return vm_exception('OOG EXTENDING MEMORY')
             data = bytearray_to_bytestr(mem[mstart: mstart + msz])
             ext.log(msg.to, topics, data)
-            log_log.trace('LOG', to=msg.to, topics=topics,
-                          data=list(map(utils.safe_ord, data)))
+            if trace_log:
+                log_log.trace('LOG', to=msg.to, topics=topics,
+                              data=list(map(utils.safe_ord, data)))
             # print('LOG', msg.to, topics, list(map(ord, data)))
         # Create a new contract
         elif op == 'CREATE':
@@ -893,7 +943,8 @@ def vm_execute(ext, msg, code):
                     raise Exception("Lolwut")
                 # Temporary solution to replace call to Identity procompiled contrac
                 if call_msg.code_address == b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x04':
-                    mem[memoutstart : memoutstart+memoutsz] = mem[meminstart : meminstart+meminsz]
+                    copysz = min(meminsz, memoutsz)
+                    mem[memoutstart : memoutstart+copysz] = mem[meminstart : meminstart+copysz]
                     stk.append(1)
                     compustate.gas += submsg_gas
                     continue
@@ -904,8 +955,8 @@ def vm_execute(ext, msg, code):
                 else:
                     stk.append(1)
                 # Set output memory
-                for i in range(min(len(data), memoutsz)):
-                    mem[memoutstart + i] = data[i]
+                copysz = min(len(data), memoutsz)
+                mem[memoutstart: memoutstart + copysz] = data[:copysz]
                 compustate.gas += gas
                 compustate.last_returned = bytearray(data)
         # Return opcode
@@ -943,12 +994,13 @@ def vm_execute(ext, msg, code):
             ext.set_balance(to, ext.get_balance(to) + xfer)
             ext.set_balance(msg.to, 0)
             ext.add_suicide(msg.to)
-            log_msg.debug(
-                'SUICIDING',
-                addr=utils.checksum_encode(
-                    msg.to),
-                to=utils.checksum_encode(to),
-                xferring=xfer)
+            if debug_msg:
+                log_msg.debug(
+                    'SUICIDING',
+                    addr=utils.checksum_encode(
+                        msg.to),
+                    to=utils.checksum_encode(to),
+                    xferring=xfer)
             return peaceful_exit('SUICIDED', compustate.gas, [])
 
     return peaceful_exit('CODE OUT OF RANGE', compustate.gas, [])
@@ -976,6 +1028,8 @@ class VmExtBase():
         self.log = lambda addr, topics, data: 0
         self.tx_origin = b'0' * 40
         self.tx_gasprice = 0
+        self.tracer = None
+        self.profiler = None
         self.create = lambda msg: 0, 0, 0
         self.call = lambda msg: 0, 0, 0
         self.sendmsg = lambda msg: 0, 0, 0
@@ -0,0 +1,119 @@
+"""
+Times the ECPAIRING precompile on the vectors of mk_ecpairing_tests.py.
+
+    python tools/bench_ecpairing.py [rounds]
+
+Runs the installed bn128 backend (see ethereum.bn128_backend) and, for
+reference, a naive check doing a full pairing per pair.
+"""
+import sys
+import time
+
+import py_ecc.optimized_bn128 as bn128
+
+from ethereum import bn128_backend, specials
+from ethereum.opcodes import GPAIRINGBASE as GPB
+from ethereum.opcodes import GPAIRINGPERPOINT as GPP
+from ethereum.utils import encode_int32, big_endian_to_int
+from ethereum.vm import CallData, Message
+
+G1, G2 = bn128.G1, bn128.G2
+m = bn128.multiply
+co = bn128.curve_order
+fm = bn128.field_modulus
+G1_zero = (bn128.FQ.one(), bn128.FQ.one(), bn128.FQ.zero())
+G2_zero = (bn128.FQ2.one(), bn128.FQ2.one(), bn128.FQ2.zero())
+
+
+def mk_ecpairing_data(pts):
+    o = b''
+    for p, q in pts:
+        np, nq = bn128.normalize(p), bn128.normalize(q)
+        o += encode_int32(np[0].n) + encode_int32(np[1].n) + \
+            encode_int32(nq[0].coeffs[1]) + encode_int32(nq[0].coeffs[0]) + \
+            encode_int32(nq[1].coeffs[1]) + encode_int32(nq[1].coeffs[0])
+    return o
+
+
+def perturb(inp, pos, by):
+    return inp[:pos] + \
+        encode_int32(big_endian_to_int(inp[pos: pos + 32]) + by) + inp[pos + 32:]
+
+
+# (data, expected result) pairs, None meaning the call fails
+vectors = [
+    ('empty_data', b'', True),
+    ('one_point_fail', mk_ecpairing_data([(G1, G2)]), False),
+    ('one_point_with_g1_zero', mk_ecpairing_data([(G1_zero, G2)]), True),
+    ('one_point_with_g2_zero', mk_ecpairing_data([(G1, G2_zero)]), True),
+    ('two_point_fail_1', mk_ecpairing_data([(G1, G2), (G1, G2)]), False),
+    ('two_point_match_1', mk_ecpairing_data([(G1, G2), (m(G1, co - 1), G2)]), True),
+    ('two_point_match_2', mk_ecpairing_data([(G1, G2), (G1, m(G2, co - 1))]), True),
+    ('two_point_match_3', mk_ecpairing_data(
+        [(G1, m(G2, 2)), (m(G1, co - 2), G2)]), True),
+    ('two_point_match_4', mk_ecpairing_data(
+        [(m(G1, 27), m(G2, 37)), (G1, m(G2, co - 999))]), True),
+    ('two_point_fail_2', mk_ecpairing_data(
+        [(m(G1, 27), m(G2, 37)), (G1, m(G2, 998))]), False),
+    ('three_point_match_1', mk_ecpairing_data(
+        [(m(G1, 27), m(G2, 37)), (G1, m(G2, co - 999)), (G1, G2_zero)]), True),
+    ('three_point_fail_1', mk_ecpairing_data(
+        [(m(G1, 27), m(G2, 37)), (G1, m(G2, 999)), (G1, G2)]), False),
+    ('perturb_g2_by_one', perturb(mk_ecpairing_data([(G1_zero, G2)]), 64, 1), None),
+    ('perturb_g2_by_field_modulus',
+     perturb(mk_ecpairing_data([(G1_zero, G2)]), 128, fm), None),
+]
+
+
+class NaiveBackend(bn128_backend.PyECCBackend):
+
+    """One full pairing, final exponentiation included, per pair"""
+
+    name = 'naive'
+
+    def pairing_check(self, pairs):
+        bn128 = self.bn128
+        o = bn128.FQ12.one()
+        for x1, y1, x2_i, x2_r, y2_i, y2_r in pairs:
+            p1 = self.g1_point(x1, y1)
+            p2 = self.g2_point(x2_i, x2_r, y2_i, y2_r)
+            if p1 is None or p2 is None or \
+                    bn128.multiply(p2, co)[-1] != bn128.FQ2.zero():
+                return None
+            o *= bn128.pairing(p2, p1)
+        return o == bn128.FQ12.one()
+
+
+class FakeExt(object):
+
+    def post_metropolis_hardfork(self):
+        return True
+
+
+def run(backend, rounds):
+    bn128_backend.set_backend(backend)
+    ext = FakeExt()
+    total = 0
+    for name, data, expected in vectors:
+        gas = GPB + GPP * (len(data) // 192)
+        msg = Message(b'\x00' * 20, b'\x00' * 19 + b'\x08', 0, gas,
+                      CallData(bytearray(data)))
+        t = time.time()
+        for i in range(rounds):
+            res, _, out = specials.proc_ecpairing(ext, msg)
+        elapsed = (time.time() - t) / rounds
+        total += elapsed
+        got = bool(out[-1]) if res else None
+        assert got == expected, (backend.name, name, got)
+        print('%-8s %-30s %8.1f ms' % (backend.name, name, elapsed * 1000))
+    print('%-8s %-30s %8.1f ms' % (backend.name, 'total', total * 1000))
+    return total
+
+
+if __name__ == '__main__':
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    default = bn128_backend.get_backend()
+    fast = run(default, rounds)
+    slow = run(NaiveBackend(), rounds)
+    bn128_backend.set_backend(default)
+    print('speedup over naive: %.2fx' % (slow / fast))
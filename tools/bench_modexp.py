@@ -0,0 +1,85 @@
+"""
+Times the MODEXP precompile on the cases of mk_modexp_tests.py plus
+adversarial inputs with 1 KB operands.
+
+    python tools/bench_modexp.py [rounds]
+
+Runs with gmpy2 when it is installed and again with the builtin pow.
+"""
+import sys
+import time
+
+from ethereum import specials
+from ethereum.utils import int_to_big_endian, encode_int32
+from ethereum.vm import CallData, Message
+
+K = 2 ** 8192  # 1 KB operands
+
+cases = [
+    (3, 5, 100),
+    (3, 2**254, 2**256),
+    (0, 3, 100),
+    (0, 0, 0),
+    (0, 1, 0),
+    (1, 0, 0),
+    (1, 0, 1),
+    (2**256, 1, 3**160),
+    (9, 2**1024 - 105, 2**1024 - 105),
+    (2**1024 - 96, 2**1024 - 105, 2**1024 - 105),
+    (2**1024 - 96, 2**1024 - 105, 97),
+    (2**1024 - 96, 2**1024 - 105, 1),
+    (2**1024 - 96, 2**1024 - 105, 0),
+    (1, 1, 1),
+    (49, 2401, 2401),
+    (3**160 - 11, 3**160 - 11, 2**160 - 11),
+    # adversarial
+    (K - 1, 2**256 - 1, K - 159),
+    (K - 1, K - 1, K - 159),
+    (2, 2**255, K - 1),
+]
+
+
+def mk_modexp_data(b, e, m):
+    benc = int_to_big_endian(b)
+    eenc = int_to_big_endian(e)
+    menc = int_to_big_endian(m)
+    return encode_int32(len(benc)) + encode_int32(len(eenc)) + \
+        encode_int32(len(menc)) + benc + eenc + menc
+
+
+class FakeExt(object):
+
+    def post_metropolis_hardfork(self):
+        return True
+
+
+def run(label, rounds):
+    ext = FakeExt()
+    total = 0
+    for b, e, m in cases:
+        msg = Message(b'\x00' * 20, b'\x00' * 19 + b'\x05', 0, 2**256,
+                      CallData(bytearray(mk_modexp_data(b, e, m))))
+        t = time.time()
+        for i in range(rounds):
+            specials.proc_modexp(ext, msg)
+        elapsed = (time.time() - t) / rounds
+        total += elapsed
+        print('%-8s %5d/%5d/%5d bits %10.3f ms' % (
+            label, b.bit_length(), e.bit_length(), m.bit_length(), elapsed * 1000))
+    # a claimed 1 GB modulus must be rejected on gas without being read
+    data = encode_int32(1) + encode_int32(1) + encode_int32(2**30) + b'\x03'
+    msg = Message(b'\x00' * 20, b'\x00' * 19 + b'\x05', 0, 10**7,
+                  CallData(bytearray(data)))
+    t = time.time()
+    assert specials.proc_modexp(ext, msg) == (0, 0, [])
+    print('%-8s %-21s %10.3f ms' % (label, 'oog on 1 GB modulus',
+                                    (time.time() - t) * 1000))
+    print('%-8s %-21s %10.3f ms' % (label, 'total', total * 1000))
+
+
+if __name__ == '__main__':
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    if specials.gmpy2 is not None:
+        run('gmpy2', rounds)
+        specials.powmod = pow
+    run('pow', rounds)
@@ -0,0 +1,73 @@
+"""
+Exports and imports chains as block files (see ethereum.pow.importer).
+
+    python tools/chain_io.py export_chain <genesis.json> <datadir> <file> [--from N] [--to N]
+    python tools/chain_io.py import_chain <genesis.json> <file> [--datadir DIR] [--checkpoint FILE]
+
+A datadir is a LevelDB database and needs pyethapp installed. Without
+one, import_chain imports into memory, which is useful for timing it.
+"""
+import argparse
+import json
+import sys
+import time
+
+from ethereum.config import Env
+from ethereum.db import EphemDB
+from ethereum.pow.chain import Chain
+from ethereum.pow.importer import export_chain, import_chain
+
+
+def open_chain(genesis_path, datadir=None):
+    if datadir is None:
+        db = EphemDB()
+    else:
+        try:
+            from pyethapp.leveldb_service import LevelDB
+        except ImportError:
+            sys.exit('A datadir needs pyethapp installed')
+        db = LevelDB(datadir)
+    with open(genesis_path) as f:
+        genesis = json.load(f)
+    return Chain(genesis, Env(db))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    commands = parser.add_subparsers(dest='command')
+    export = commands.add_parser('export_chain')
+    export.add_argument('genesis')
+    export.add_argument('datadir')
+    export.add_argument('file')
+    export.add_argument('--from', dest='start', type=int)
+    export.add_argument('--to', dest='end', type=int)
+    imp = commands.add_parser('import_chain')
+    imp.add_argument('genesis')
+    imp.add_argument('file')
+    imp.add_argument('--datadir')
+    imp.add_argument('--checkpoint')
+    imp.add_argument('--batch-size', type=int, default=64)
+    imp.add_argument('--processes', type=int)
+    args = parser.parse_args(args)
+
+    if args.command == 'export_chain':
+        chain = open_chain(args.genesis, args.datadir)
+        t = time.time()
+        count = export_chain(chain, args.file, args.start, args.end)
+        print('Exported %d blocks in %.2f s' % (count, time.time() - t))
+    elif args.command == 'import_chain':
+        chain = open_chain(args.genesis, args.datadir)
+        stats = import_chain(chain, args.file, args.checkpoint,
+                             batch_size=args.batch_size,
+                             processes=args.processes)
+        print('Imported %d blocks (%d known, %d invalid) in %.2f s: '
+              '%.1f blocks/s, %.0f gas/s' %
+              (stats['blocks'], stats['known'], stats['invalid'],
+               stats['elapsed'], stats['blocks_per_second'],
+               stats['gas_per_second']))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()